@@ -1,11 +1,45 @@
-from flask import Flask, jsonify, request, g
+from flask import Flask, jsonify, request, g, Response
 import sqlite3
 from prometheus_client import Histogram, make_wsgi_app, Counter
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from urllib.parse import quote
+from collections import OrderedDict
+from functools import wraps
+import base64
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
 import time
 
+from create_DB_sqlite3 import create_indexes
+from size_index import SizeIndex, fetch_rows
+
 app = Flask(__name__)
 
+# SQLite settings for the read-only query path
+DB_FILE = 'file_metadata_database.db'
+DB_IMMUTABLE = False                 # set True when the DB file never changes while the API runs
+DB_MMAP_SIZE = 256 * 1024 * 1024     # bytes of the DB file read through memory-mapped I/O
+DB_POOL_SIZE = 8                     # idle connections kept for reuse
+
+# Engine for the size queries: 'sqlite' runs them against the covering index,
+# 'numpy' answers them from an in-memory sorted array (size_index.py) and reads only the selected rows
+SIZE_ENGINE = 'sqlite'
+
+# Keyset pagination / streaming settings for /files-in-range
+MAX_PAGE_LIMIT = 10000               # largest page a client can ask for
+STREAM_FETCH_ROWS = 1000             # rows fetched from SQLite per NDJSON chunk
+SEARCH_PAGE_LIMIT = 100              # default page size of /search
+SEARCH_DRIVING_MATCHES = 5000        # name matches up to which /search starts from the FTS index
+
+# Response cache settings for the size endpoints
+CACHE_MAX_ENTRIES = 1024             # serialized responses kept (least recently used evicted first)
+CACHE_TTL_SECONDS = 300              # responses older than this are recomputed
+CACHE_MAX_BODY_BYTES = 1024 * 1024   # larger responses are not cached
+
 # Counter for total HTTP requests
 REQUEST_COUNT = Counter(
     'http_requests_total',
@@ -27,6 +61,30 @@ REQUEST_ERRORS = Counter(
     ['method', 'endpoint', 'http_status']
 )
 
+# Counters for the response cache
+CACHE_HITS = Counter(
+    'api_cache_hits_total',
+    'Size endpoint responses served from the cache',
+    ['endpoint']
+)
+
+CACHE_MISSES = Counter(
+    'api_cache_misses_total',
+    'Size endpoint responses computed from SQLite',
+    ['endpoint']
+)
+
+CACHE_EVICTIONS = Counter(
+    'api_cache_evictions_total',
+    'Cached responses dropped',
+    ['reason']
+)
+
+# Label for the endpoint a request was routed to: the URL rule, not the raw path, so the label
+# has one value per route (requests that match no route share 'unmatched')
+def endpoint_label():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
 @app.before_request
 def start_timer():
     g.start_time = time.time()
@@ -35,15 +93,16 @@ def start_timer():
 def stop_timer(response):
     # ⏱ Record latency
     request_latency = time.time() - g.start_time
+    endpoint = endpoint_label()
     REQUEST_LATENCY.labels(
         method=request.method,
-        endpoint=request.path
+        endpoint=endpoint
     ).observe(request_latency)
 
     # 🔢 Count request
     REQUEST_COUNT.labels(
         method=request.method,
-        endpoint=request.path,
+        endpoint=endpoint,
         http_status=str(response.status_code)
     ).inc()
     
@@ -51,7 +110,7 @@ def stop_timer(response):
     if response.status_code >= 400:
         REQUEST_ERRORS.labels(
             method=request.method,
-            endpoint=request.path,
+            endpoint=endpoint,
             http_status=str(response.status_code)
         ).inc()
 
@@ -63,68 +122,322 @@ app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {
 })
 
 
-# Function to connect to the SQLite database and fetch N smallest files
+# Pool of read-only SQLite connections shared by request handlers.
+# Connections are opened with URI mode=ro (plus immutable=1 if configured) and memory-mapped I/O
+class ReadOnlyConnectionPool:
+    def __init__(self, db_file, size=DB_POOL_SIZE, immutable=DB_IMMUTABLE, mmap_size=DB_MMAP_SIZE):
+        self.db_file = db_file
+        self.uri = f"file:{quote(os.path.abspath(db_file))}?mode=ro" + ("&immutable=1" if immutable else "")
+        self.mmap_size = mmap_size
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def connect(self):
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        return conn
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn):
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+db_pool = ReadOnlyConnectionPool(DB_FILE)
+
+# Request-scoped connection: borrowed from the pool on first use, returned when the request ends
+def get_db():
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+# Version token of the database files; changes whenever the importer writes to the DB or its WAL
+def db_version(db_file=DB_FILE):
+    version = []
+    for path in (db_file, db_file + '-wal'):
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+# In-process LRU cache of serialized responses with a TTL, emptied whenever the DB version changes
+class ResponseCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+
+    def check_version(self, version):
+        with self.lock:
+            if version != self.version:
+                if self.entries:
+                    CACHE_EVICTIONS.labels(reason='db_changed').inc(len(self.entries))
+                self.entries.clear()
+                self.version = version
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                CACHE_EVICTIONS.labels(reason='ttl').inc()
+                return None
+            self.entries.move_to_end(key)
+            return entry[1:]
+
+    def put(self, key, body, etag, mimetype):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, body, etag, mimetype)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                CACHE_EVICTIONS.labels(reason='lru').inc()
+
+response_cache = ResponseCache()
+
+# Build the response for a cached body, or 304 if the client already has this ETag
+def cached_body_response(body, etag, mimetype):
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    return response
+
+# Decorator for GET endpoints whose response depends only on the path, the query string and the DB contents
+def cached_endpoint(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        response_cache.check_version(db_version(db_pool.db_file))
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        cached = response_cache.get(key)
+        if cached is not None:
+            CACHE_HITS.labels(endpoint=endpoint_label()).inc()
+            return cached_body_response(*cached)
+
+        CACHE_MISSES.labels(endpoint=endpoint_label()).inc()
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        body = response.get_data()
+        etag = hashlib.sha1(body).hexdigest()
+        if len(body) <= CACHE_MAX_BODY_BYTES:
+            response_cache.put(key, body, etag, response.mimetype)
+        return cached_body_response(body, etag, response.mimetype)
+    return wrapper
+
+# Create the covering file_size index and the search index if an older DB does not have them yet (needs write access)
+def ensure_indexes(db_file=DB_FILE):
+    if not os.path.exists(db_file):
+        return
+    conn = sqlite3.connect(db_file)
+    try:
+        create_indexes(conn)
+    finally:
+        conn.close()
+
+def rows_to_files(results):
+    return [{'file_id': row[0], 'file_name': row[1], 'file_size': row[2], 'md5sum': row[3], 'signedUrl': row[4]} for row in results]
+
+size_index = None
+
+# The in-memory size index when SIZE_ENGINE is 'numpy', reloaded whenever the DB changes; None otherwise
+def get_size_index():
+    global size_index
+    if SIZE_ENGINE != 'numpy':
+        return None
+    if size_index is None:
+        size_index = SizeIndex()
+    size_index.refresh_if_changed(get_db(), db_version(db_pool.db_file))
+    return size_index
+
+# Function to query the SQLite database and fetch N smallest files
 def get_smallest_files(n=10):
-    conn = sqlite3.connect('file_metadata_database.db')
-    cursor = conn.cursor()
-    
+    index = get_size_index()
+    if index is not None:
+        return rows_to_files(fetch_rows(get_db(), index.smallest_rowids(n)))
     query = '''
     SELECT file_id, file_name, file_size, md5sum, signedUrl
     FROM files
     ORDER BY file_size ASC
     LIMIT ?
     '''
-    
-    cursor.execute(query, (n,))
-    results = cursor.fetchall()
-
-    files = [{'file_id': row[0], 'file_name': row[1], 'file_size': row[2], 'md5sum': row[3], 'signedUrl': row[4]} for row in results]
+    return rows_to_files(get_db().execute(query, (n,)).fetchall())
 
-    conn.close()
-    return files
-
-# Function to connect to the SQLite database and fetch N largest files
+# Function to query the SQLite database and fetch N largest files
 def get_largest_files(n=10):
-    conn = sqlite3.connect('file_metadata_database.db')
-    cursor = conn.cursor()
-    
+    index = get_size_index()
+    if index is not None:
+        return rows_to_files(fetch_rows(get_db(), index.largest_rowids(n)))
     query = '''
     SELECT file_id, file_name, file_size, md5sum, signedUrl
     FROM files
     ORDER BY file_size DESC
     LIMIT ?
     '''
-    
-    cursor.execute(query, (n,))
-    results = cursor.fetchall()
-
-    files = [{'file_id': row[0], 'file_name': row[1], 'file_size': row[2], 'md5sum': row[3], 'signedUrl': row[4]} for row in results]
+    return rows_to_files(get_db().execute(query, (n,)).fetchall())
 
-    conn.close()
-    return files
-
-# Function to connect to the SQLite database and fetch files within a file size range
+# Function to query the SQLite database and fetch files within a file size range
 def get_files_in_size_range(min_size, max_size):
-    conn = sqlite3.connect('file_metadata_database.db')
-    cursor = conn.cursor()
-    
+    index = get_size_index()
+    if index is not None:
+        return rows_to_files(fetch_rows(get_db(), index.range_rowids(min_size, max_size)))
     query = '''
     SELECT file_id, file_name, file_size, md5sum, signedUrl
     FROM files
     WHERE file_size BETWEEN ? AND ?
     ORDER BY file_size ASC
     '''
-    
-    cursor.execute(query, (min_size, max_size))
-    results = cursor.fetchall()
+    return rows_to_files(get_db().execute(query, (min_size, max_size)).fetchall())
+
+# Cursor tokens encode the (file_size, file_id) of the last row of a page
+def encode_cursor(file_size, file_id):
+    return base64.urlsafe_b64encode(json.dumps([file_size, file_id]).encode()).decode()
+
+def decode_cursor(token):
+    file_size, file_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+    return int(file_size), str(file_id)
+
+# Lower bound of a keyset page: the cursor, or min_size when there is no cursor past it. SQLite is given only
+# one of the two, since with both it seeks the index to min_size and filters its way up to the cursor
+def keyset_lower_bound(min_size, after):
+    if after is not None and after[0] >= min_size:
+        return '(file_size, file_id) > (?, ?)', list(after)
+    return 'file_size >= ?', [min_size]
+
+# SQL for a size range in (file_size, file_id) order, optionally starting after a cursor position.
+# Both orderings are served by the covering index, so each page costs O(limit) no matter how deep it is
+def size_range_query(min_size, max_size, after=None, limit=None):
+    lower, params = keyset_lower_bound(min_size, after)
+    query = f'''
+    SELECT file_id, file_name, file_size, md5sum, signedUrl
+    FROM files
+    WHERE {lower} AND file_size <= ?
+    '''
+    params.append(max_size)
+    query += ' ORDER BY file_size ASC, file_id ASC'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+    return query, params
 
-    files = [{'file_id': row[0], 'file_name': row[1], 'file_size': row[2], 'md5sum': row[3], 'signedUrl': row[4]} for row in results]
+# One page of a size range; returns (files, next_cursor) where next_cursor is None on the last page
+def get_files_in_size_range_page(min_size, max_size, limit, after=None):
+    query, params = size_range_query(min_size, max_size, after, limit + 1)
+    files = rows_to_files(get_db().execute(query, params).fetchall())
+    if len(files) <= limit:
+        return files, None
+    files = files[:limit]
+    return files, encode_cursor(files[-1]['file_size'], files[-1]['file_id'])
 
-    conn.close()
-    return files
+# Stream a size range as NDJSON lines while SQLite produces the rows.
+# The generator borrows its own pooled connection since it outlives the request handler
+def iter_files_in_size_range_ndjson(min_size, max_size, after=None, limit=None):
+    query, params = size_range_query(min_size, max_size, after, limit)
+    conn = db_pool.acquire()
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(STREAM_FETCH_ROWS)
+            if not rows:
+                break
+            yield ''.join(json.dumps(file) + '\n' for file in rows_to_files(rows))
+    finally:
+        db_pool.release(conn)
+
+# FTS5 query for a search string: every whitespace-separated word must occur in the file name as a phrase
+# of its tokens ('W_JHU_2017' matches the tokens w, jhu, 2017 in a row); a trailing '*' makes the last token a prefix.
+# Words are quoted, so FTS5 operators in user input are matched literally. Returns None if nothing is searchable
+def fts_query(text):
+    phrases = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if not re.search(r'[^\W_]', word):
+            continue
+        phrases.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(phrases) or None
+
+# SQL for /search: optional name match (files_fts), extensions, study_id and size range, keyset-paged
+# in (file_size, file_id) order. Extensions are served by idx_files_extension, one ordered branch per extension
+# merged with UNION ALL; a study filter by the study_files primary key. With drive_from_match the FTS matches are
+# fetched and sorted (best for rare names); without it the unary + makes SQLite walk a size-ordered index and
+# test each row against the match set, which stops after `limit` rows (best for common names)
+def search_query(match=None, extensions=(), study_id=None, min_size=0, max_size=None, after=None, limit=None,
+                 drive_from_match=True):
+    lower, params = keyset_lower_bound(min_size, after)
+    conditions = [lower]
+    if max_size is not None:
+        conditions.append('file_size <= ?')
+        params.append(max_size)
+    if match is not None:
+        conditions.append(('rowid' if drive_from_match else '+rowid')
+                          + ' IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?)')
+        params.append(match)
+    if study_id is not None:
+        conditions.append('file_id IN (SELECT file_id FROM study_files WHERE study_id = ?)')
+        params.append(study_id)
+    order = ' ORDER BY file_size ASC, file_id ASC' + (' LIMIT ?' if limit is not None else '')
+
+    branches = []
+    branch_params = []
+    for extension in extensions or [None]:
+        where = conditions + (['extension = ?'] if extension is not None else [])
+        branches.append('''
+    SELECT file_id, file_name, file_size, md5sum, signedUrl
+    FROM files
+    WHERE ''' + ' AND '.join(where) + order)
+        branch_params += params + ([extension] if extension is not None else []) + ([limit] if limit is not None else [])
+    if len(branches) == 1:
+        return branches[0], branch_params
+    query = 'SELECT * FROM (' + ' UNION ALL '.join(f'SELECT * FROM ({branch})' for branch in branches) + ')' + order
+    return query, branch_params + ([limit] if limit is not None else [])
+
+# Whether a name match is selective enough to drive the query: at most SEARCH_DRIVING_MATCHES files match
+def is_selective_match(conn, match):
+    count = conn.execute('''
+        SELECT COUNT(*) FROM (SELECT rowid FROM files_fts WHERE files_fts MATCH ? LIMIT ?)
+    ''', (match, SEARCH_DRIVING_MATCHES + 1)).fetchone()[0]
+    return count <= SEARCH_DRIVING_MATCHES
+
+# One page of search results; returns (files, next_cursor) where next_cursor is None on the last page
+def search_files_page(limit, after=None, match=None, **filters):
+    conn = get_db()
+    drive_from_match = match is not None and is_selective_match(conn, match)
+    query, params = search_query(match=match, after=after, limit=limit + 1, drive_from_match=drive_from_match, **filters)
+    files = rows_to_files(conn.execute(query, params).fetchall())
+    if len(files) <= limit:
+        return files, None
+    files = files[:limit]
+    return files, encode_cursor(files[-1]['file_size'], files[-1]['file_id'])
 
 # API endpoint to fetch N smallest files
 @app.route('/smallest-files', methods=['GET'])
+@cached_endpoint
 def smallest_files():
     # Get the 'n' parameter from the URL, if provided; otherwise, default to 10
     n = request.args.get('n', default=10, type=int)
@@ -133,6 +446,7 @@ def smallest_files():
 
 # API endpoint to fetch N largest files
 @app.route('/largest-files', methods=['GET'])
+@cached_endpoint
 def largest_files():
     # Get the 'n' parameter from the URL, if provided; otherwise, default to 10
     n = request.args.get('n', default=10, type=int)
@@ -141,14 +455,67 @@ def largest_files():
 
 # API endpoint to fetch files within a size range
 @app.route('/files-in-range', methods=['GET'])
+@cached_endpoint
 def files_in_range():
     # Get the 'min_size' and 'max_size' parameters from the URL, and provide defaults
     min_size = request.args.get('min_size', default=0, type=int)
     max_size = request.args.get('max_size', default=1000000000, type=int)  # Adjust this default to a reasonable max size
-    
+    # Optional keyset pagination ('limit', 'cursor') and NDJSON streaming ('format=ndjson')
+    limit = request.args.get('limit', type=int)
+    token = request.args.get('cursor')
+    output_format = request.args.get('format', default='json')
+
+    after = None
+    if token:
+        try:
+            after = decode_cursor(token)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'invalid cursor'}), 400
+    if limit is not None and not 1 <= limit <= MAX_PAGE_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_LIMIT}'}), 400
+
+    if output_format == 'ndjson':
+        return Response(iter_files_in_size_range_ndjson(min_size, max_size, after, limit), mimetype='application/x-ndjson')
+
+    if limit is not None or after is not None:
+        files, next_cursor = get_files_in_size_range_page(min_size, max_size, limit or MAX_PAGE_LIMIT, after)
+        return jsonify({'files': files, 'next_cursor': next_cursor})
+
     files = get_files_in_size_range(min_size, max_size)
     return jsonify(files)
 
+# API endpoint to search files by name, extension and study, within a size range, one page at a time.
+# 'q': words matched against the file name tokens ('f07', 'LUMOS f0*'); 'ext': extensions, repeated or
+# comma-separated ('raw,mzML'); 'study_id'; 'min_size'/'max_size'; 'limit' and 'cursor' as in /files-in-range
+@app.route('/search', methods=['GET'])
+@cached_endpoint
+def search():
+    text = request.args.get('q', default='')
+    extensions = [ext.strip().lstrip('.').lower()
+                  for value in request.args.getlist('ext') for ext in value.split(',') if ext.strip()]
+    study_id = request.args.get('study_id') or None
+    min_size = request.args.get('min_size', default=0, type=int)
+    max_size = request.args.get('max_size', type=int)
+    limit = request.args.get('limit', default=SEARCH_PAGE_LIMIT, type=int)
+    token = request.args.get('cursor')
+
+    match = fts_query(text)
+    if text.strip() and match is None:
+        return jsonify({'error': 'q has no searchable words'}), 400
+    after = None
+    if token:
+        try:
+            after = decode_cursor(token)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'invalid cursor'}), 400
+    if not 1 <= limit <= MAX_PAGE_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_LIMIT}'}), 400
+
+    files, next_cursor = search_files_page(limit, after, match=match, extensions=extensions, study_id=study_id,
+                                           min_size=min_size, max_size=max_size)
+    return jsonify({'files': files, 'next_cursor': next_cursor})
+
 # Run the Flask app
 if __name__ == '__main__':
+    ensure_indexes()
     app.run(debug=True)
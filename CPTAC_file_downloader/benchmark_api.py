@@ -0,0 +1,122 @@
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+import API_get_files
+from create_DB_sqlite3 import create_indexes, drop_indexes, stream_rows_into_db
+
+'''
+load benchmark for the size endpoints in API_get_files.py
+builds a synthetic files table, then reports p50/p99 latency of
+/smallest-files, /largest-files and /files-in-range for
+  - before: a new sqlite3.connect per request and no file_size index (the original implementation)
+  - after: the pooled read-only connections and the covering file_size index
+'''
+
+
+# Synthetic catalog rows with file sizes spread between 1 KB and 5 GB
+def synthetic_rows(num_rows, seed=0):
+    rng = random.Random(seed)
+    for i in range(num_rows):
+        yield None, (f"file-{i:09d}", f"synthetic_{i}.raw", rng.randint(1_000, 5_000_000_000),
+                     f"{rng.getrandbits(128):032x}", f"{{'url': 'https://example.invalid/{i}'}}")
+
+
+# Original API behaviour: one connection per request, rows materialised as dicts
+def make_baseline_app(db_file):
+    baseline = Flask("baseline")
+
+    def query(sql, params):
+        conn = sqlite3.connect(db_file)
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        results = cursor.fetchall()
+        conn.close()
+        return jsonify([{'file_id': row[0], 'file_name': row[1], 'file_size': row[2], 'md5sum': row[3], 'signedUrl': row[4]}
+                        for row in results])
+
+    @baseline.route('/smallest-files')
+    def smallest_files():
+        n = request.args.get('n', default=10, type=int)
+        return query('SELECT file_id, file_name, file_size, md5sum, signedUrl FROM files ORDER BY file_size ASC LIMIT ?', (n,))
+
+    @baseline.route('/largest-files')
+    def largest_files():
+        n = request.args.get('n', default=10, type=int)
+        return query('SELECT file_id, file_name, file_size, md5sum, signedUrl FROM files ORDER BY file_size DESC LIMIT ?', (n,))
+
+    @baseline.route('/files-in-range')
+    def files_in_range():
+        min_size = request.args.get('min_size', default=0, type=int)
+        max_size = request.args.get('max_size', default=1000000000, type=int)
+        return query('''SELECT file_id, file_name, file_size, md5sum, signedUrl FROM files
+                        WHERE file_size BETWEEN ? AND ? ORDER BY file_size ASC''', (min_size, max_size))
+
+    return baseline
+
+
+# Fire `requests_per_endpoint` requests at each endpoint from `concurrency` clients; returns {path: (p50_ms, p99_ms)}
+def measure(app, paths, requests_per_endpoint, concurrency):
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    local = threading.local()
+
+    def timed_get(path):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        response = local.session.get(base_url + path)
+        response.raise_for_status()
+        return (time.perf_counter() - start) * 1000
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for path in paths:
+                list(executor.map(timed_get, [path] * concurrency))  # warm up
+                latencies = sorted(executor.map(timed_get, [path] * requests_per_endpoint))
+                p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+                results[path] = (statistics.median(latencies), p99)
+    finally:
+        server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency benchmark for the API_get_files.py size endpoints")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    paths = ["/smallest-files?n=10", "/largest-files?n=10", "/files-in-range?min_size=1000000&max_size=2000000"]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "files.db")
+        conn = sqlite3.connect(db_file)
+        stream_rows_into_db(conn, synthetic_rows(args.rows))
+
+        drop_indexes(conn)
+        before = measure(make_baseline_app(db_file), paths, args.requests, args.concurrency)
+
+        create_indexes(conn)
+        conn.close()
+        API_get_files.db_pool = API_get_files.ReadOnlyConnectionPool(db_file)
+        after = measure(API_get_files.app, paths, args.requests, args.concurrency)
+
+    print(f"{args.rows} rows, {args.requests} requests per endpoint, concurrency {args.concurrency}")
+    print(f"{'endpoint':<52} {'before p50':>11} {'before p99':>11} {'after p50':>10} {'after p99':>10}  (ms)")
+    for path in paths:
+        print(f"{path:<52} {before[path][0]:>11.2f} {before[path][1]:>11.2f} {after[path][0]:>10.2f} {after[path][1]:>10.2f}")
@@ -0,0 +1,56 @@
+import argparse
+import contextlib
+import io
+import time
+
+import fetch_study_files
+from local_pdc_server import make_synthetic_catalog, start_server
+
+'''
+throughput benchmark for the study crawl in fetch_study_files.py
+runs get_all_files_from_studies against a local stand-in GraphQL server
+and reports studies/sec at several concurrency levels
+'''
+
+
+def run_benchmark(num_studies, files_per_study, latency, concurrency_levels, batch_sizes=(1,), alias_error_rate=0.0):
+    studies, files = make_synthetic_catalog(num_studies=num_studies, versions_per_study=1, files_per_study=files_per_study)
+    server = start_server(studies, files, latency=latency, alias_error_rate=alias_error_rate)
+    fetch_study_files.url = server.url
+
+    study_ids = fetch_study_files.get_study_id_list(fetch_study_files.fetch_study_catalog(True))
+    results = []
+    try:
+        for batch_size in batch_sizes:
+            for workers in concurrency_levels:
+                session = fetch_study_files.make_session(pool_size=workers)
+                requests_before = server.request_count
+                start = time.perf_counter()
+                # silence the per-study progress output while timing
+                with contextlib.redirect_stdout(io.StringIO()):
+                    all_files = fetch_study_files.get_all_files_from_studies(study_ids, max_workers=workers, session=session,
+                                                                             batch_size=batch_size)
+                elapsed = time.perf_counter() - start
+                session.close()
+                assert len(all_files) == num_studies * files_per_study
+                results.append((batch_size, workers, server.request_count - requests_before, elapsed, len(study_ids) / elapsed))
+    finally:
+        server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark concurrent study crawl against a local GraphQL stand-in")
+    parser.add_argument("--studies", type=int, default=200)
+    parser.add_argument("--files-per-study", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated server latency per request (seconds)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1], help="studies per aliased GraphQL query")
+    parser.add_argument("--alias-error-rate", type=float, default=0.0, help="fraction of aliased selections the server fails")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.studies, args.files_per_study, args.latency, args.concurrency,
+                            args.batch_sizes, args.alias_error_rate)
+    print(f"{'batch':>6} {'workers':>8} {'requests':>9} {'seconds':>10} {'studies/sec':>12}")
+    for batch_size, workers, request_count, elapsed, rate in results:
+        print(f"{batch_size:>6} {workers:>8} {request_count:>9} {elapsed:>10.2f} {rate:>12.1f}")
@@ -0,0 +1,157 @@
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import download_files_with_progress_DB as downloader
+from download_scheduler import POLICIES, schedule_downloads, schedule_stream, format_timeline
+from local_pdc_server import catalog_for_file_servers, start_file_server, start_server
+
+'''
+benchmark for the download scheduling policies in download_scheduler.py
+serves synthetic files of mixed sizes (many small, a few large) from local stand-in file hosts
+with per-request latency and a per-connection bandwidth cap, then downloads them all with
+  - baseline: download_files_in_parallel (ThreadPoolExecutor(4), smallest first, direct progress writes)
+  - the asyncio scheduler under each policy, with the progress writer thread
+and reports makespan and MB/s, plus each run's queue-depth / throughput timeline with --timeline.
+with --pipeline the files are instead listed by a local stand-in GraphQL server (split into studies, with
+crawl latency) and it compares crawl-then-download against the streamed crawl -> download pipeline,
+reporting time to the first completed download and the makespan of both
+'''
+
+
+# File sizes for one host: mostly small files with a long tail of large ones
+def mixed_sizes(num_files, large_fraction, seed):
+    rng = random.Random(seed)
+    sizes = {}
+    for i in range(num_files):
+        if rng.random() < large_fraction:
+            size = rng.randint(20_000_000, 60_000_000)
+        else:
+            size = rng.randint(10_000, 2_000_000)
+        sizes[f"h{seed}_file_{i:04d}.raw"] = size
+    return sizes
+
+# Run one download pass in a fresh download folder and progress DB; returns (seconds, timeline or None)
+def run_pass(work_dir, files, policy, args):
+    downloader.DB_FILE = os.path.join(work_dir, "download_progress.db")
+    downloader.DOWNLOAD_FOLDER = os.path.join(work_dir, "files")
+    shutil.rmtree(downloader.DOWNLOAD_FOLDER, ignore_errors=True)
+    if os.path.exists(downloader.DB_FILE):
+        os.remove(downloader.DB_FILE)
+    downloader.init_db()
+
+    # silence the per-file progress output while timing
+    with contextlib.redirect_stdout(io.StringIO()):
+        if policy == 'baseline':
+            # original behaviour: a connection and commit per progress update
+            downloader.completed_ids = None
+            start = time.perf_counter()
+            downloader.download_files_in_parallel(sorted(files, key=lambda f: int(f['file_size'])))
+            return time.perf_counter() - start, None
+        downloader.load_completed_ids()
+        downloader.start_progress_writer()
+        try:
+            summary, timeline = schedule_downloads(files, policy=policy, max_concurrency=args.concurrency,
+                                                   per_host_concurrency=args.per_host, bandwidth_bps=args.bandwidth_limit,
+                                                   sample_interval=args.sample_interval)
+        finally:
+            downloader.stop_progress_writer()
+    return summary['seconds'], timeline
+
+# Fresh download folder and progress DB, with the progress writer running
+def reset_work_dir(work_dir):
+    downloader.DB_FILE = os.path.join(work_dir, "download_progress.db")
+    downloader.DOWNLOAD_FOLDER = os.path.join(work_dir, "files")
+    shutil.rmtree(downloader.DOWNLOAD_FOLDER, ignore_errors=True)
+    if os.path.exists(downloader.DB_FILE):
+        os.remove(downloader.DB_FILE)
+    downloader.init_db()
+    downloader.load_completed_ids()
+    downloader.start_progress_writer()
+
+# Crawl every study and then download (the old __main__ flow), or stream the crawl into the scheduler.
+# Returns (seconds to the first completed download, makespan); both include the crawl
+def run_crawl_pass(work_dir, study_ids, pipelined, args):
+    reset_work_dir(work_dir)
+    options = dict(policy='smallest-first', max_concurrency=args.concurrency, per_host_concurrency=args.per_host,
+                   bandwidth_bps=args.bandwidth_limit, sample_interval=args.sample_interval)
+    crawl = dict(batch_size=args.crawl_batch_size, max_workers=args.crawl_workers)
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            start = time.perf_counter()
+            if pipelined:
+                summary, _ = schedule_stream(downloader.iter_files_for_studies(study_ids, **crawl),
+                                             reorder_window=args.reorder_window, **options)
+                crawl_seconds = 0
+            else:
+                files = sorted(downloader.fetch_files_for_studies(study_ids, **crawl), key=lambda f: int(f['file_size']))
+                crawl_seconds = time.perf_counter() - start
+                summary, _ = schedule_downloads(files, **options)
+            makespan = time.perf_counter() - start
+        finally:
+            downloader.stop_progress_writer()
+    return crawl_seconds + (summary['first_download_seconds'] or 0), makespan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark download scheduling policies against local file hosts")
+    parser.add_argument("--hosts", type=int, default=2)
+    parser.add_argument("--files-per-host", type=int, default=60)
+    parser.add_argument("--large-fraction", type=float, default=0.1, help="fraction of 20-60 MB files, the rest are 10 KB-2 MB")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated latency per request (seconds)")
+    parser.add_argument("--host-bandwidth", type=float, default=20e6, help="per-connection bandwidth of the hosts (bytes/sec)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--per-host", type=int, default=4)
+    parser.add_argument("--bandwidth-limit", type=float, default=None, help="aggregate bandwidth cap (bytes/sec)")
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--timeline", action="store_true", help="print each scheduler run's timeline")
+    parser.add_argument("--pipeline", action="store_true", help="compare crawl-then-download with the streamed pipeline")
+    parser.add_argument("--files-per-study", type=int, default=5)
+    parser.add_argument("--crawl-latency", type=float, default=0.2, help="simulated latency per GraphQL request (seconds)")
+    parser.add_argument("--crawl-batch-size", type=int, default=2)
+    parser.add_argument("--crawl-workers", type=int, default=2)
+    parser.add_argument("--reorder-window", type=int, default=256)
+    args = parser.parse_args()
+
+    servers = [start_file_server(mixed_sizes(args.files_per_host, args.large_fraction, seed=h), latency=args.latency,
+                                 bandwidth_bps=args.host_bandwidth, study_id=f"study-bench-{h}")
+               for h in range(args.hosts)]
+    files = [file for server in servers for file in server.catalog]
+    total_bytes = sum(int(file['file_size']) for file in files)
+    print(f"{len(files)} files, {total_bytes / 1e6:.0f} MB over {args.hosts} hosts")
+
+    if args.pipeline:
+        # list the files through a GraphQL stand-in, a few files per study
+        catalog, studies = catalog_for_file_servers(servers, args.files_per_study)
+        pdc = start_server(catalog, studies, latency=args.crawl_latency)
+        downloader.url = pdc.url
+        print(f"{len(studies)} studies, {args.crawl_latency}s per GraphQL request")
+        results = []
+        with tempfile.TemporaryDirectory() as work_dir:
+            for name, pipelined in (('crawl-then-download', False), ('pipelined', True)):
+                results.append((name,) + run_crawl_pass(work_dir, list(studies), pipelined, args))
+        for server in servers + [pdc]:
+            server.shutdown()
+        print(f"\n{'mode':<20} {'first file s':>12} {'makespan s':>10}")
+        for name, first, makespan in results:
+            print(f"{name:<20} {first:>12.2f} {makespan:>10.2f}")
+        raise SystemExit
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for policy in ('baseline',) + POLICIES:
+            seconds, timeline = run_pass(work_dir, files, policy, args)
+            results.append((policy, seconds))
+            if args.timeline and timeline:
+                print(f"\n{policy}\n{format_timeline(timeline)}")
+    for server in servers:
+        server.shutdown()
+
+    print(f"\n{'policy':<16} {'seconds':>8} {'MB/s':>8}")
+    for policy, seconds in results:
+        print(f"{policy:<16} {seconds:>8.2f} {total_bytes / seconds / 1e6:>8.1f}")
@@ -0,0 +1,164 @@
+import argparse
+import csv
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import download_files_with_progress_DB as downloader
+import export_parquet
+from benchmark_search import synthetic_catalog_rows
+from create_DB_sqlite3 import export_sorted_csv, stream_rows_into_db
+
+'''
+benchmark for export_parquet.py on a synthetic catalog (CPTAC-style names, 2000 files per study version)
+and a download_progress.db with a status for every catalog file
+  1. export timings: full export, re-export with nothing changed, and re-export after one study's files
+     and some download statuses changed (only those partitions should be rewritten)
+  2. load + aggregate (bytes and files per extension) of the whole catalog, each in a fresh process
+     to measure its peak memory: all_files_sorted.csv with the csv module, a row scan of the SQLite
+     files table, the Parquet dataset, and the memory-mapped Arrow snapshot
+'''
+
+STATUSES = [('completed', 0.80), ('failed', 0.05), ('checksum_mismatch', 0.01), ('downloading', 0.04), (None, 0.10)]
+
+
+# download_progress rows for every catalog file, with statuses drawn from STATUSES
+def populate_progress(progress_db, catalog_db, seed=0):
+    rng = random.Random(seed)
+    downloader.DB_FILE = progress_db
+    downloader.init_db()
+    statuses, weights = zip(*STATUSES)
+    conn = sqlite3.connect(progress_db)
+    rows = sqlite3.connect(catalog_db).execute('''
+        SELECT study_id, files.file_id, file_name, file_size, md5sum FROM files JOIN study_files USING (file_id)
+    ''')
+    now = time.time()
+    with conn:
+        conn.executemany('''
+            INSERT INTO download_progress (unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum,
+                                           generated_md5sum, status, bytes_downloaded, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', ((f"{study_id}_{file_id}", study_id, f"PDC{int(study_id[-5:]) % 300:06d}", file_id, name, size, md5,
+               md5, status, size if status == 'completed' else None, now)
+              for (study_id, file_id, name, size, md5), status in
+              ((row, rng.choices(statuses, weights)[0]) for row in rows)))
+    conn.close()
+
+# Change one study's file checksums in the catalog and move `count` failed downloads to completed
+def apply_changes(catalog_db, progress_db, study_id, count):
+    with sqlite3.connect(catalog_db) as conn:
+        conn.execute('''
+            UPDATE files SET md5sum = 'changed-' || md5sum
+            WHERE file_id IN (SELECT file_id FROM study_files WHERE study_id = ?)
+        ''', (study_id,))
+    with sqlite3.connect(progress_db) as conn:
+        conn.execute('''
+            UPDATE download_progress SET status = 'completed', updated_at = ?
+            WHERE unique_id IN (SELECT unique_id FROM download_progress WHERE status = 'failed' LIMIT ?)
+        ''', (time.time(), count))
+
+
+def extension_of(file_name):
+    return file_name.rsplit('.', 1)[1].lower() if '.' in file_name else ''
+
+# Load the whole catalog with one method, then total bytes and files per extension
+def load_and_aggregate(method, path):
+    totals = defaultdict(lambda: [0, 0])
+    if method == 'csv':
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+        for row in rows:
+            total = totals[extension_of(row['file_name'])]
+            total[0] += int(row['file_size'])
+            total[1] += 1
+    elif method == 'sqlite':
+        rows = sqlite3.connect(path).execute('SELECT file_id, file_name, file_size, md5sum, signedUrl FROM files').fetchall()
+        for row in rows:
+            total = totals[extension_of(row[1])]
+            total[0] += row[2]
+            total[1] += 1
+    else:
+        if method == 'parquet':
+            # the catalog lists a file once per study listing it; each synthetic file is in one study
+            table = export_parquet.read_partitions(path, 'catalog', columns=['file_id', 'extension', 'file_size'])
+        else:
+            table = export_parquet.load_table(path, 'catalog').select(['file_id', 'extension', 'file_size'])
+        grouped = table.group_by('extension').aggregate([('file_size', 'sum'), ('file_id', 'count')])
+        for extension, size, count in zip(*(grouped.column(name).to_pylist()
+                                              for name in ('extension', 'file_size_sum', 'file_id_count'))):
+            totals[extension] = [size, count]
+    return {extension: tuple(total) for extension, total in sorted(totals.items())}
+
+# Current and peak resident memory of this process in MB (Linux; ru_maxrss would include the parent's peak)
+def memory_mb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+
+# Run load_and_aggregate in a fresh interpreter; returns (seconds, peak MB above the process baseline, totals)
+def measure_load(method, path):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', method, path],
+                            check=True, capture_output=True, text=True).stdout
+    result = json.loads(output)
+    return result['seconds'], result['peak_mb'] - result['baseline_mb'], result['totals']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Parquet/Arrow export and its read paths")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--changed-downloads", type=int, default=1000, help="downloads moved from failed to completed")
+    parser.add_argument("--measure", nargs=2, metavar=("METHOD", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        baseline = memory_mb('VmRSS')
+        start = time.perf_counter()
+        totals = load_and_aggregate(*args.measure)
+        seconds = time.perf_counter() - start
+        peak = memory_mb('VmHWM')
+        print(json.dumps({'seconds': seconds, 'baseline_mb': baseline, 'peak_mb': peak, 'totals': totals}))
+        raise SystemExit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        catalog_db = os.path.join(tmp, 'file_metadata_database.db')
+        progress_db = os.path.join(tmp, 'download_progress.db')
+        csv_file = os.path.join(tmp, 'all_files_sorted.csv')
+        export_dir = os.path.join(tmp, 'export')
+        conn = sqlite3.connect(catalog_db)
+        stream_rows_into_db(conn, synthetic_catalog_rows(args.rows))
+        export_sorted_csv(conn, csv_file)
+        conn.close()
+        populate_progress(progress_db, catalog_db)
+        databases = {'catalog': catalog_db, 'progress': progress_db}
+
+        runs = [('full export', None), ('nothing changed', None), ('one study + downloads changed', 'change')]
+        print(f"{args.rows:,} catalog rows")
+        print(f"{'export':<30} {'table':<9} {'written':>8} {'unchanged':>10} {'seconds':>8}")
+        for name, action in runs:
+            if action == 'change':
+                apply_changes(catalog_db, progress_db, 'study-00000', args.changed_downloads)
+            for table, stats in export_parquet.export_all(export_dir, databases).items():
+                print(f"{name:<30} {table:<9} {stats['written']:>8} {stats['unchanged']:>10} {stats['seconds']:>8.2f}")
+
+        sizes = {
+            'csv': os.path.getsize(csv_file),
+            'sqlite': os.path.getsize(catalog_db),
+            'parquet': sum(os.path.getsize(os.path.join(root, name))
+                           for root, _, names in os.walk(os.path.join(export_dir, 'catalog')) for name in names),
+            'arrow': os.path.getsize(os.path.join(export_dir, 'catalog.arrow')),
+        }
+        print()
+        print(f"{'load + aggregate':<18} {'seconds':>8} {'peak MB':>8} {'on disk MB':>11}")
+        reference = None
+        for method, path in (('csv', csv_file), ('sqlite', catalog_db), ('parquet', export_dir), ('arrow', export_dir)):
+            seconds, peak_mb, totals = measure_load(method, path)
+            reference = reference or totals
+            mismatch = "" if totals == reference else "  (totals differ from csv!)"
+            print(f"{method:<18} {seconds:>8.2f} {peak_mb:>8.0f} {sizes[method] / 2**20:>11.0f}{mismatch}")
@@ -0,0 +1,160 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import threading
+
+import requests
+from werkzeug.serving import make_server
+
+import API_get_files
+from benchmark_api import measure
+from create_DB_sqlite3 import stream_rows_into_db
+
+'''
+latency benchmark for the /search endpoint of API_get_files.py
+builds a synthetic catalog with CPTAC-style file names (one raw, mzML, mzid.gz and psm file per fraction,
+2000 files per study version), then reports p50/p99 latency of name, extension, study and combined searches
+with the response cache disabled (from one client, and from --concurrency clients), next to the old way of finding the same files: streaming /files-in-range
+and filtering the names on the client
+'''
+
+COHORTS = ['CCRCC', 'LSCC', 'LUAD', 'HNSCC', 'PDA', 'UCEC', 'GBM', 'BRCA']
+SITES = ['JHU', 'PNNL', 'BI', 'UMich']
+INSTRUMENTS = ['LUMOS', 'QE', 'QEHF', 'Exploris']
+EXTENSIONS = ['raw', 'mzML', 'mzid.gz', 'psm']
+FILES_PER_STUDY = 2000
+
+
+# Synthetic (study_id, row) pairs named like 05CPTAC_CCRCC_W_JHU_20171007_LUMOS_f07.raw
+def synthetic_catalog_rows(num_rows, seed=0):
+    rng = random.Random(seed)
+    for i in range(num_rows):
+        study = i // FILES_PER_STUDY
+        cohort = COHORTS[study % len(COHORTS)]
+        site = SITES[study % len(SITES)]
+        instrument = INSTRUMENTS[(study // len(SITES)) % len(INSTRUMENTS)]
+        date = 20170101 + study % 28 + 100 * (study % 12)
+        fraction = (i // len(EXTENSIONS)) % 24 + 1
+        plex = (i // (len(EXTENSIONS) * 24)) % 25 + 1
+        name = f"{plex:02d}CPTAC_{cohort}_W_{site}_{date}_{instrument}_f{fraction:02d}.{EXTENSIONS[i % len(EXTENSIONS)]}"
+        yield f"study-{study:05d}", (f"file-{i:09d}", name, rng.randint(1_000, 5_000_000_000),
+                                     f"{rng.getrandbits(128):032x}", f"{{'url': 'https://example.invalid/{i}'}}")
+
+
+# Old client-side search: stream the whole size range as NDJSON and keep the names that match
+def client_side_search(base_url, predicate, limit, min_size=0, max_size=5_000_000_000):
+    found = []
+    with requests.get(f"{base_url}/files-in-range", params={'min_size': min_size, 'max_size': max_size, 'format': 'ndjson'},
+                      stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            file = json.loads(line)
+            if predicate(file['file_name']):
+                found.append(file)
+                if len(found) == limit:
+                    break
+    return found
+
+
+# Median latency of each path from a single client, through the Flask test client
+def single_client_ms(paths, repeats):
+    client = API_get_files.app.test_client()
+    results = {}
+    for path in paths:
+        client.get(path)  # warm up
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            response = client.get(path)
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.get_data(as_text=True)
+        results[path] = statistics.median(latencies)
+    return results
+
+
+def baseline_ms(searches, repeats):
+    server = make_server("127.0.0.1", 0, API_get_files.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    results = {}
+    try:
+        for name, (predicate, kwargs) in searches.items():
+            latencies = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                client_side_search(base_url, predicate, 100, **kwargs)
+                latencies.append((time.perf_counter() - start) * 1000)
+            results[name] = statistics.median(latencies)
+    finally:
+        server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency benchmark for the /search endpoint of API_get_files.py")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--requests", type=int, default=500, help="requests per search")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--baseline-repeats", type=int, default=3, help="client-side filtering runs per search (0 to skip)")
+    args = parser.parse_args()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    middle_study = f"study-{args.rows // FILES_PER_STUDY // 2:05d}"
+    rare = next(name for study, (_, name, *_) in synthetic_catalog_rows(args.rows // 2 + 1) if study == middle_study)
+    rare_plex, rare_date = rare.split('_')[0], rare.split('_')[4]
+    deep_cursor = API_get_files.encode_cursor(2_500_000_000, "")
+    searches = {
+        'name: f07': "/search?q=f07",
+        'name prefix: LUMOS f1*': "/search?q=LUMOS+f1*",
+        'name phrase: W_JHU_2017*': "/search?q=W_JHU_2017*",
+        'rare name: plex date f07': f"/search?q={rare_plex}+{rare_date}+f07",
+        'ext: mzML': "/search?ext=mzML",
+        'ext: raw,mzML deep page': f"/search?ext=raw,mzML&cursor={deep_cursor}",
+        'study': f"/search?study_id={middle_study}",
+        'name+ext+size: f07 raw 1-2 GB': "/search?q=f07&ext=raw&min_size=1000000000&max_size=2000000000",
+        'name+study: f07': f"/search?q=f07&study_id={middle_study}",
+    }
+    # Client-side equivalents of a few of the searches, for the old /files-in-range approach
+    baseline_searches = {
+        'name: f07': (lambda name: '_f07.' in name, {}),
+        'rare name: plex date f07': (lambda name: name.startswith(rare_plex + 'CPTAC_') and f"_{rare_date}_" in name
+                                     and '_f07.' in name, {}),
+        'ext: mzML': (lambda name: name.endswith('.mzML'), {}),
+        'name+ext+size: f07 raw 1-2 GB': (lambda name: name.endswith('_f07.raw'),
+                                          {'min_size': 1_000_000_000, 'max_size': 2_000_000_000}),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "files.db")
+        conn = sqlite3.connect(db_file)
+        start = time.perf_counter()
+        stream_rows_into_db(conn, synthetic_catalog_rows(args.rows))
+        load_seconds = time.perf_counter() - start
+        fts_pages = conn.execute("SELECT COUNT(*) FROM dbstat WHERE name LIKE 'files_fts%'").fetchone()[0] \
+            if conn.execute("SELECT 1 FROM pragma_module_list WHERE name = 'dbstat'").fetchone() else None
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        conn.close()
+        print(f"{args.rows:,} rows loaded and indexed in {load_seconds:.1f}s, "
+              f"database {os.path.getsize(db_file) / 2**20:.0f} MB"
+              + (f", FTS index {fts_pages * page_size / 2**20:.0f} MB" if fts_pages is not None else ""))
+
+        API_get_files.db_pool = API_get_files.ReadOnlyConnectionPool(db_file)
+        API_get_files.response_cache = API_get_files.ResponseCache(max_entries=0)
+        single = single_client_ms(list(searches.values()), args.requests)
+        after = measure(API_get_files.app, list(searches.values()), args.requests, args.concurrency)
+        before = baseline_ms(baseline_searches, args.baseline_repeats) if args.baseline_repeats else {}
+        API_get_files.db_pool.close()
+
+    print(f"{args.requests} requests per search, response cache disabled")
+    print(f"{'search':<32} {'1 client p50':>13} {f'{args.concurrency} clients p50':>16} {'p99':>8} {'client-side p50':>16}  (ms)")
+    for name, path in searches.items():
+        p50, p99 = after[path]
+        baseline = f"{before[name]:>16.0f}" if name in before else f"{'':>16}"
+        print(f"{name:<32} {single[path]:>13.2f} {p50:>16.2f} {p99:>8.2f} {baseline}")
@@ -0,0 +1,77 @@
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import API_get_files
+from benchmark_api import synthetic_rows
+from create_DB_sqlite3 import stream_rows_into_db
+
+'''
+compares the two size engines of API_get_files.py ('sqlite' and the in-memory 'numpy' index)
+on synthetic catalogs: index load time, memory per file and median latency of
+get_smallest_files, get_largest_files and get_files_in_size_range
+'''
+
+
+def median_ms(func, args_list):
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies)
+
+
+def run_queries(num_queries, seed=1):
+    rng = random.Random(seed)
+    narrow = []
+    wide = []
+    for _ in range(num_queries):
+        low = rng.randint(1_000, 4_000_000_000)
+        narrow.append((low, low + 500_000))     # tens of rows per million files
+        wide.append((low, low + 50_000_000))    # ~1% of the catalog
+    return {
+        'smallest n=10': (API_get_files.get_smallest_files, [(10,)] * num_queries),
+        'largest n=10': (API_get_files.get_largest_files, [(10,)] * num_queries),
+        'range narrow': (API_get_files.get_files_in_size_range, narrow),
+        'range ~1%': (API_get_files.get_files_in_size_range, wide[:max(1, num_queries // 10)]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the SQLite and NumPy size engines of API_get_files.py")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    for num_rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_file = os.path.join(tmp, "files.db")
+            conn = sqlite3.connect(db_file)
+            stream_rows_into_db(conn, synthetic_rows(num_rows))
+            conn.close()
+            API_get_files.db_pool = API_get_files.ReadOnlyConnectionPool(db_file)
+            API_get_files.size_index = None
+
+            results = {}
+            with API_get_files.app.app_context():
+                for engine in ('sqlite', 'numpy'):
+                    API_get_files.SIZE_ENGINE = engine
+                    start = time.perf_counter()
+                    index = API_get_files.get_size_index()
+                    load_seconds = time.perf_counter() - start
+                    queries = run_queries(args.queries)
+                    results[engine] = {name: median_ms(func, params) for name, (func, params) in queries.items()}
+                    if index is not None:
+                        print(f"{num_rows:,} rows: numpy index loaded in {load_seconds:.2f}s, "
+                              f"{index.nbytes() / num_rows:.1f} bytes/file")
+            API_get_files.db_pool.close()
+
+        print(f"{'query':<16} {'sqlite ms':>10} {'numpy ms':>10}")
+        for name in results['sqlite']:
+            print(f"{name:<16} {results['sqlite'][name]:>10.3f} {results['numpy'][name]:>10.3f}")
+        print()
@@ -0,0 +1,331 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+from werkzeug.serving import make_server
+
+import API_get_files
+import download_files_with_progress_DB as downloader
+import fetch_study_files
+from benchmark_downloads import mixed_sizes
+from benchmark_search import EXTENSIONS
+from create_DB_sqlite3 import diff_staging, export_sorted_csv, import_csv, load_staging, merge_staging, stream_into_db
+from local_pdc_server import catalog_for_file_servers, make_synthetic_catalog, start_file_server, start_server
+
+'''
+end-to-end benchmark suite for CPTAC_file_downloader, run entirely against local stand-ins (local_pdc_server.py)
+  crawl     studyCatalog + filesPerStudy crawl of a synthetic catalog from the GraphQL stand-in, streamed into SQLite
+  import    all_files_sorted.csv export of the crawled catalog, bulk import into a fresh database, and a merge re-import
+  api       every API_get_files.py endpoint under concurrent load with the response cache disabled
+            (p50/p90/p99 latency, requests/sec, errors)
+  download  download_files_in_parallel makespan against signed-URL file hosts with latency, a bandwidth cap and
+            injected failures (503s and transfers cut off halfway), then retry passes until every file is complete;
+            files above --segment-threshold take the segmented (byte-range) download path
+import and api use the catalog from the crawl stage, so selecting either also runs the crawl.
+every measurement is a metric {stage, name, value, unit, better} in the --output JSON, next to the run's parameters,
+git commit and platform; --compare prints the change against an earlier results file and exits 1 if any metric
+got worse by more than --threshold
+'''
+
+STAGES = ['crawl', 'import', 'api', 'download']
+DOWNLOAD_FILES_PER_STUDY = 5
+
+
+def metric(stage, name, value, unit, better='lower'):
+    return {'stage': stage, 'name': name, 'value': value, 'unit': unit, 'better': better}
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Crawl the synthetic catalog from the GraphQL stand-in into catalog_db; returns (study_ids, metrics)
+def run_crawl_stage(catalog_db, args):
+    studies, files = make_synthetic_catalog(num_studies=args.studies, versions_per_study=args.versions,
+                                            files_per_study=args.files_per_study, extensions=EXTENSIONS)
+    server = start_server(studies, files, latency=args.latency)
+    fetch_study_files.url = server.url
+    session = fetch_study_files.make_session(pool_size=args.crawl_workers)
+    try:
+        # silence the per-study progress output while timing
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            study_ids = fetch_study_files.get_study_id_list(fetch_study_files.fetch_study_catalog(True, session=session))
+            records = fetch_study_files.iter_file_records(study_ids, max_workers=args.crawl_workers, session=session,
+                                                          batch_size=args.crawl_batch_size)
+            conn = sqlite3.connect(catalog_db)
+            loaded = stream_into_db(conn, records)
+            conn.close()
+            seconds = time.perf_counter() - start
+    finally:
+        session.close()
+        server.shutdown()
+    return study_ids, [
+        metric('crawl', 'seconds', seconds, 's'),
+        metric('crawl', 'studies_per_second', len(study_ids) / seconds, 'studies/s', 'higher'),
+        metric('crawl', 'records_per_second', loaded / seconds, 'records/s', 'higher'),
+        metric('crawl', 'graphql_requests', server.request_count, 'requests', None),
+        metric('crawl', 'records', loaded, 'records', None),
+    ]
+
+# Export the crawled catalog to CSV, import it into a fresh database and merge it back in unchanged
+def run_import_stage(work_dir, catalog_db):
+    csv_file = os.path.join(work_dir, 'all_files_sorted.csv')
+    conn = sqlite3.connect(catalog_db)
+    start = time.perf_counter()
+    export_sorted_csv(conn, csv_file)
+    export_seconds = time.perf_counter() - start
+    conn.close()
+
+    conn = sqlite3.connect(os.path.join(work_dir, 'imported.db'))
+    start = time.perf_counter()
+    rows = import_csv(conn, csv_file)
+    import_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    load_staging(conn, csv_file)
+    diff = diff_staging(conn)
+    merge_staging(conn)
+    merge_seconds = time.perf_counter() - start
+    conn.close()
+    assert diff == {'added': 0, 'changed': 0, 'removed': 0}, diff
+    return [
+        metric('import', 'csv_export_seconds', export_seconds, 's'),
+        metric('import', 'csv_import_seconds', import_seconds, 's'),
+        metric('import', 'csv_import_rows_per_second', rows / import_seconds, 'rows/s', 'higher'),
+        metric('import', 'merge_seconds', merge_seconds, 's'),
+    ]
+
+
+# Fire `requests_per_endpoint` GETs at one path from `concurrency` clients, after one warm-up request per client
+def load_test(base_url, path, requests_per_endpoint, concurrency):
+    local = threading.local()
+
+    def timed_get(_):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            ok = local.session.get(base_url + path, timeout=60).status_code == 200
+        except requests.RequestException:
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed_get, range(concurrency)))
+        start = time.perf_counter()
+        samples = list(executor.map(timed_get, range(requests_per_endpoint)))
+        seconds = time.perf_counter() - start
+    latencies = sorted(ms for ms, _ in samples)
+    return {'p50_ms': percentile(latencies, 0.50), 'p90_ms': percentile(latencies, 0.90),
+            'p99_ms': percentile(latencies, 0.99), 'requests_per_second': len(samples) / seconds,
+            'errors': sum(not ok for _, ok in samples)}
+
+# Every endpoint and response format of API_get_files.py, over the crawled catalog
+def api_paths(study_ids):
+    deep_cursor = API_get_files.encode_cursor(2_500_000_000, "")
+    return {
+        'smallest-files': "/smallest-files?n=10",
+        'largest-files': "/largest-files?n=10",
+        'files-in-range json': "/files-in-range?min_size=1000000000&max_size=1050000000",
+        'files-in-range page': f"/files-in-range?min_size=0&max_size=5000000000&limit=100&cursor={deep_cursor}",
+        'files-in-range ndjson': "/files-in-range?min_size=1000000000&max_size=1050000000&format=ndjson",
+        'search name': "/search?q=f07",
+        'search ext': "/search?ext=mzML",
+        'search study': f"/search?study_id={study_ids[len(study_ids) // 2]}",
+        'search name+ext+size': "/search?q=f07&ext=raw&min_size=1000000000&max_size=2000000000",
+    }
+
+API_METRICS = [('p50_ms', 'ms', 'lower'), ('p90_ms', 'ms', 'lower'), ('p99_ms', 'ms', 'lower'),
+               ('requests_per_second', 'requests/s', 'higher'), ('errors', 'requests', 'lower')]
+
+def run_api_stage(catalog_db, study_ids, args):
+    API_get_files.db_pool = API_get_files.ReadOnlyConnectionPool(catalog_db)
+    API_get_files.response_cache = API_get_files.ResponseCache(max_entries=0)
+    server = make_server("127.0.0.1", 0, API_get_files.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    metrics = []
+    try:
+        for name, path in api_paths(study_ids).items():
+            result = load_test(base_url, path, args.requests, args.concurrency)
+            metrics += [metric('api', f"{name} {key}", result[key], unit, better) for key, unit, better in API_METRICS]
+    finally:
+        server.shutdown()
+    return metrics
+
+
+# List the hosted files through the GraphQL stand-in and download them with download_files_in_parallel,
+# re-running it for the files that failed until all are complete or max_passes is reached
+def run_download_stage(work_dir, args):
+    servers = [start_file_server(mixed_sizes(args.files_per_host, args.large_fraction, seed=h), latency=args.file_latency,
+                                 bandwidth_bps=args.host_bandwidth, study_id=f"study-bench-{h}",
+                                 error_rate=args.error_rate, drop_rate=args.drop_rate, seed=h)
+               for h in range(args.hosts)]
+    catalog, studies = catalog_for_file_servers(servers, DOWNLOAD_FILES_PER_STUDY)
+    pdc = start_server(catalog, studies, latency=args.latency)
+    downloader.url = pdc.url
+    downloader.DB_FILE = os.path.join(work_dir, "download_progress.db")
+    downloader.DOWNLOAD_FOLDER = os.path.join(work_dir, "files")
+    downloader.init_db()
+    downloader.completed_ids = None
+    # files from segment_threshold up go through the concurrent byte-range segment path
+    downloader.SEGMENT_THRESHOLD = args.segment_threshold
+    downloader.SEGMENT_SIZE = args.segment_size
+
+    pass_seconds = []
+    first_pass_bytes = first_pass_failed = 0
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            files = sorted(downloader.fetch_files_for_studies(list(studies)), key=lambda f: int(f['file_size']))
+            listing_seconds = time.perf_counter() - start
+            pending = files
+            while pending and len(pass_seconds) < args.max_passes:
+                start = time.perf_counter()
+                downloader.download_files_in_parallel(pending, max_workers=args.download_workers)
+                pass_seconds.append(time.perf_counter() - start)
+                conn = sqlite3.connect(downloader.DB_FILE)
+                completed = {row[0] for row in conn.execute("SELECT unique_id FROM download_progress WHERE status = 'completed'")}
+                conn.close()
+                if len(pass_seconds) == 1:
+                    first_pass_bytes = sum(int(f['file_size']) for f in files
+                                           if downloader.create_unique_identifier(f) in completed)
+                    first_pass_failed = len(files) - len(completed)
+                pending = [f for f in files if downloader.create_unique_identifier(f) not in completed]
+    finally:
+        for server in servers + [pdc]:
+            server.shutdown()
+    makespan = pass_seconds[0] if pass_seconds else 0.0  # no pass runs for an empty listing
+    return [
+        metric('download', 'listing_seconds', listing_seconds, 's'),
+        metric('download', 'makespan_seconds', makespan, 's'),
+        metric('download', 'mb_per_second', first_pass_bytes / 1e6 / makespan if makespan else 0.0, 'MB/s', 'higher'),
+        metric('download', 'first_pass_failed', first_pass_failed, 'files', None),
+        metric('download', 'seconds_to_complete', sum(pass_seconds), 's'),
+        metric('download', 'passes', len(pass_seconds), 'passes', None),
+        metric('download', 'incomplete_files', len(pending), 'files'),
+        metric('download', 'injected_errors', sum(server.error_count for server in servers), 'requests', None),
+        metric('download', 'injected_drops', sum(server.drop_count for server in servers), 'requests', None),
+        metric('download', 'files', len(files), 'files', None),
+        metric('download', 'segmented_files', sum(int(f['file_size']) >= args.segment_threshold for f in files), 'files', None),
+        metric('download', 'total_mb', sum(int(f['file_size']) for f in files) / 1e6, 'MB', None),
+    ]
+
+
+def run_suite(stages, args):
+    metrics = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        if {'crawl', 'import', 'api'} & set(stages):
+            catalog_db = os.path.join(work_dir, 'file_metadata_database.db')
+            study_ids, crawl_metrics = run_crawl_stage(catalog_db, args)
+            metrics += crawl_metrics
+            if 'import' in stages:
+                metrics += run_import_stage(work_dir, catalog_db)
+            if 'api' in stages:
+                metrics += run_api_stage(catalog_db, study_ids, args)
+        if 'download' in stages:
+            metrics += run_download_stage(work_dir, args)
+    return metrics
+
+# Relative change of each metric against a baseline results file; a metric regressed if it moved in its
+# worse direction by more than threshold. Returns [(metric, baseline value or None, change or None, regressed)]
+def compare(metrics, baseline, threshold):
+    previous = {(m['stage'], m['name']): m['value'] for m in baseline['metrics']}
+    rows = []
+    for m in metrics:
+        old = previous.get((m['stage'], m['name']))
+        if not old:
+            # no relative change from zero; a lower-is-better count (errors) rising from zero still regressed
+            rows.append((m, old, None, old == 0 and m['better'] == 'lower' and m['value'] > 0))
+            continue
+        change = (m['value'] - old) / abs(old)
+        regressed = (m['better'] == 'lower' and change > threshold) or (m['better'] == 'higher' and change < -threshold)
+        rows.append((m, old, change, regressed))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmark suite against local PDC and file server stand-ins")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change that counts as a regression")
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated latency per GraphQL request (seconds)")
+    # crawl and import
+    parser.add_argument("--studies", type=int, default=500)
+    parser.add_argument("--versions", type=int, default=2, help="versions per study")
+    parser.add_argument("--files-per-study", type=int, default=200)
+    parser.add_argument("--crawl-workers", type=int, default=8)
+    parser.add_argument("--crawl-batch-size", type=int, default=10, help="studies per aliased GraphQL query")
+    # api
+    parser.add_argument("--requests", type=int, default=300, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    # download
+    parser.add_argument("--hosts", type=int, default=2)
+    parser.add_argument("--files-per-host", type=int, default=40)
+    parser.add_argument("--large-fraction", type=float, default=0.05, help="fraction of 20-60 MB files, the rest are 10 KB-2 MB")
+    parser.add_argument("--file-latency", type=float, default=0.02, help="simulated latency per file request (seconds)")
+    parser.add_argument("--host-bandwidth", type=float, default=50e6, help="per-connection bandwidth of the hosts (bytes/sec)")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="fraction of file requests answered with 503")
+    parser.add_argument("--drop-rate", type=float, default=0.02, help="fraction of file transfers cut off halfway")
+    parser.add_argument("--segment-threshold", type=int, default=16 * 1024 * 1024,
+                        help="files at least this large are downloaded as concurrent byte-range segments")
+    parser.add_argument("--segment-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--download-workers", type=int, default=4)
+    parser.add_argument("--max-passes", type=int, default=5, help="download passes before giving up on failed files")
+    args = parser.parse_args()
+    if args.max_passes < 1:
+        parser.error("--max-passes must be at least 1")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    results = {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sqlite': sqlite3.sqlite_version,
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+    }
+    results['metrics'] = run_suite(args.stages, args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if not args.compare:
+        print(f"{'stage':<9} {'metric':<42} {'value':>12}  unit")
+        for m in results['metrics']:
+            print(f"{m['stage']:<9} {m['name']:<42} {m['value']:>12.2f}  {m['unit']}")
+        raise SystemExit(0)
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    rows = compare(results['metrics'], baseline, args.threshold)
+    print(f"compared with {args.compare} (commit {baseline.get('git_commit') or 'unknown'}), threshold {args.threshold:.0%}")
+    print(f"{'stage':<9} {'metric':<42} {'baseline':>12} {'value':>12} {'change':>8}  unit")
+    for m, old, change, regressed in rows:
+        old_text = f"{old:>12.2f}" if old is not None else f"{'-':>12}"
+        change_text = f"{change:>+8.1%}" if change is not None else f"{'-':>8}"
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{m['stage']:<9} {m['name']:<42} {old_text} {m['value']:>12.2f} {change_text}  {m['unit']}{flag}")
+    regressions = sum(regressed for *_, regressed in rows)
+    print(f"{regressions} regression(s)")
+    if regressions:
+        raise SystemExit(1)
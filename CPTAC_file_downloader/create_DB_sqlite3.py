@@ -1,36 +1,300 @@
 import sqlite3
 import csv
+import argparse
+import os
+import time
+from itertools import islice
+from operator import itemgetter
 
-# Step 1: Connect to (or create) the SQLite database
-conn = sqlite3.connect('file_metadata_database.db')
-cursor = conn.cursor()
-
-# Step 2: Create a table for the CSV data
-# Primary key ensures that only unique files are added
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS files (
-        file_id TEXT PRIMARY KEY,
-        file_name TEXT NOT NULL,
-        file_size INTEGER,
-        md5sum TEXT,
-        signedUrl TEXT
-    )
-''')
-
-# Step 3: Read the CSV file and insert data into the SQLite database
-csv_file = 'all_files_sorted.csv'  # Replace with your actual CSV file path
-
-with open(csv_file, 'r') as file:
-    csv_reader = csv.DictReader(file)
-    
-    for row in csv_reader:
-        cursor.execute('''
+DB_FILE = 'file_metadata_database.db'
+CSV_FILE = 'all_files_sorted.csv'  # Replace with your actual CSV file path
+
+# Bulk load settings: rows per executemany call and rows per committed transaction
+BATCH_ROWS = 10_000
+TRANSACTION_ROWS = 500_000
+
+FILE_COLUMNS = ['file_id', 'file_name', 'file_size', 'md5sum', 'signedUrl']
+
+# Create the tables for the file metadata
+def create_tables(conn):
+    cursor = conn.cursor()
+    # Primary key ensures that only unique files are added
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS files (
+            file_id TEXT PRIMARY KEY,
+            file_name TEXT NOT NULL,
+            file_size INTEGER,
+            md5sum TEXT,
+            signedUrl TEXT
+        )
+    ''')
+    # Which study versions list which files (filled by the crawler / incremental sync)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS study_files (
+            study_id TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (study_id, file_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_study_files_file_id ON study_files (file_id)')
+    conn.commit()
+
+# Lower-cased suffix after the last '.' of file_name ('' if there is none), e.g. 'raw', 'mzml', 'gz'
+EXTENSION_SQL = """
+    CASE WHEN instr(file_name, '.') = 0 THEN ''
+    ELSE lower(substr(file_name, length(rtrim(file_name, replace(file_name, '.', ''))) + 1)) END
+"""
+
+# Triggers keeping the external-content FTS5 index files_fts in step with files.
+# INSERT OR REPLACE does not fire the delete trigger, so the bulk load drops them and rebuilds the index instead
+SEARCH_TRIGGERS = {
+    'files_fts_insert': '''
+        CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN
+            INSERT INTO files_fts (rowid, file_name) VALUES (new.rowid, new.file_name);
+        END
+    ''',
+    'files_fts_delete': '''
+        CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN
+            INSERT INTO files_fts (files_fts, rowid, file_name) VALUES ('delete', old.rowid, old.file_name);
+        END
+    ''',
+    'files_fts_update': '''
+        CREATE TRIGGER IF NOT EXISTS files_fts_update AFTER UPDATE OF file_name ON files BEGIN
+            INSERT INTO files_fts (files_fts, rowid, file_name) VALUES ('delete', old.rowid, old.file_name);
+            INSERT INTO files_fts (rowid, file_name) VALUES (new.rowid, new.file_name);
+        END
+    ''',
+}
+
+# Search index for API_get_files.py /search:
+#   - extension, a virtual generated column, indexed with the size keyset as (extension, file_size, file_id)
+#   - files_fts, an FTS5 index over the tokens of file_name (split at '_', '-', '.'; prefix queries of 2-3 chars indexed)
+# study_id filters use the (study_id, file_id) primary key of study_files.
+# files_fts is rebuilt from the table whenever its triggers were not in place, i.e. after a bulk load or on an older DB
+def create_search_index(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_xinfo(files)')}
+    if 'extension' not in columns:
+        conn.execute(f'ALTER TABLE files ADD COLUMN extension TEXT GENERATED ALWAYS AS ({EXTENSION_SQL}) VIRTUAL')
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5 (
+            file_name, content='files', content_rowid='rowid', prefix='2 3'
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_files_extension ON files (extension, file_size, file_id)')
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    if not existing.issuperset(SEARCH_TRIGGERS):
+        for sql in SEARCH_TRIGGERS.values():
+            conn.execute(sql)
+        conn.execute("INSERT INTO files_fts (files_fts) VALUES ('rebuild')")
+    conn.commit()
+
+# Indexes built after a bulk load rather than maintained row by row during it.
+# The size index covers every column API_get_files.py returns, so size-ordered queries
+# are answered from the index alone without touching the table
+def create_indexes(conn):
+    conn.execute('DROP INDEX IF EXISTS idx_files_file_size')  # superseded by the covering index
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_files_size_covering
+        ON files (file_size, file_id, file_name, md5sum, signedUrl)
+    ''')
+    create_search_index(conn)
+    conn.commit()
+
+def drop_indexes(conn):
+    conn.execute('DROP INDEX IF EXISTS idx_files_file_size')
+    conn.execute('DROP INDEX IF EXISTS idx_files_size_covering')
+    conn.execute('DROP INDEX IF EXISTS idx_files_extension')
+    for name in SEARCH_TRIGGERS:
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    conn.commit()
+
+# PRAGMAs for fast loading: WAL journal, fewer fsyncs, larger page cache
+def configure_for_bulk_load(conn):
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-200000')  # ~200 MB
+
+# Row for the files table; signedUrl is stored as text, the same way the CSV import stores it
+def file_row(file):
+    return (file['file_id'], file['file_name'], int(file['file_size']), file['md5sum'], str(file['signedUrl']))
+
+# Insert (study_id, row) pairs, row being a files-table tuple, in executemany batches,
+# committing every TRANSACTION_ROWS rows. study_id may be None when the study is unknown (e.g. CSV input).
+# Returns the number of rows loaded
+def load_rows(conn, rows, batch_rows=BATCH_ROWS, transaction_rows=TRANSACTION_ROWS):
+    cursor = conn.cursor()
+    rows = iter(rows)
+    loaded = 0
+    since_commit = 0
+    while True:
+        batch = list(islice(rows, batch_rows))
+        if not batch:
+            break
+        cursor.executemany('''
             INSERT OR REPLACE INTO files (file_id, file_name, file_size, md5sum, signedUrl)
             VALUES (?, ?, ?, ?, ?)
-        ''', (row['file_id'], row['file_name'], row['file_size'], row['md5sum'], row['signedUrl']))
+        ''', [row for _, row in batch])
+        cursor.executemany('INSERT OR IGNORE INTO study_files (study_id, file_id) VALUES (?, ?)',
+                           [(study_id, row[0]) for study_id, row in batch if study_id is not None])
+        loaded += len(batch)
+        since_commit += len(batch)
+        if since_commit >= transaction_rows:
+            conn.commit()
+            since_commit = 0
+    conn.commit()
+    return loaded
+
+# Streaming ingest: load rows from any iterator (e.g. the crawler) and build indexes afterwards.
+# Memory use is bounded by one batch, however large the catalog is. The indexes and search triggers
+# are rebuilt even if the iterator fails part-way, keeping the rows committed so far
+def stream_rows_into_db(conn, rows, batch_rows=BATCH_ROWS):
+    create_tables(conn)
+    configure_for_bulk_load(conn)
+    drop_indexes(conn)
+    try:
+        loaded = load_rows(conn, rows, batch_rows=batch_rows)
+    finally:
+        conn.rollback()  # a failed load keeps what load_rows had committed; a finished one has nothing pending
+        create_indexes(conn)
+        conn.execute('ANALYZE')
+    return loaded
+
+# Same, for (study_id, file) records as yielded by the crawler
+def stream_into_db(conn, records, batch_rows=BATCH_ROWS):
+    return stream_rows_into_db(conn, ((study_id, file_row(file)) for study_id, file in records), batch_rows=batch_rows)
+
+# Optional export of the files table, sorted by file size, in the all_files_sorted.csv format
+def export_sorted_csv(conn, csv_file):
+    cursor = conn.execute('SELECT file_id, file_name, file_size, md5sum, signedUrl FROM files ORDER BY file_size ASC')
+    with open(csv_file, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(FILE_COLUMNS)
+        for row in cursor:
+            writer.writerow(row)
+
+# Stream CSV rows as (study_id, row) pairs; the CSV carries no study_id.
+# Columns are picked by header name; file_size is converted by the INTEGER column affinity
+def iter_csv_rows(csv_file):
+    with open(csv_file, 'r', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        pick = itemgetter(*(header.index(column) for column in FILE_COLUMNS))
+        for row in reader:
+            yield None, pick(row)
+
+# Read the CSV file and insert data into the SQLite database (INSERT OR REPLACE, chunked executemany)
+def import_csv(conn, csv_file, batch_rows=BATCH_ROWS):
+    return stream_rows_into_db(conn, iter_csv_rows(csv_file), batch_rows=batch_rows)
+
+# Column comparison used by the merge: a row counts as changed if any column differs
+CHANGED_CONDITION = """
+    files.file_name IS NOT {other}.file_name OR files.file_size IS NOT {other}.file_size
+    OR files.md5sum IS NOT {other}.md5sum OR files.signedUrl IS NOT {other}.signedUrl
+"""
+
+# Load the CSV into a temporary staging table (last row wins for duplicate file_ids)
+def load_staging(conn, csv_file, batch_rows=BATCH_ROWS):
+    conn.execute('DROP TABLE IF EXISTS temp.files_staging')
+    conn.execute('''
+        CREATE TEMP TABLE files_staging (
+            file_id TEXT PRIMARY KEY,
+            file_name TEXT NOT NULL,
+            file_size INTEGER,
+            md5sum TEXT,
+            signedUrl TEXT
+        )
+    ''')
+    cursor = conn.cursor()
+    rows = iter_csv_rows(csv_file)
+    loaded = 0
+    while True:
+        batch = list(islice(rows, batch_rows))
+        if not batch:
+            break
+        cursor.executemany('INSERT OR REPLACE INTO files_staging VALUES (?, ?, ?, ?, ?)', [row for _, row in batch])
+        loaded += len(batch)
+    conn.commit()
+    return loaded
+
+# Set-based diff between the staging table and files: counts of added, changed and removed rows
+def diff_staging(conn):
+    added = conn.execute('''
+        SELECT COUNT(*) FROM files_staging s
+        WHERE NOT EXISTS (SELECT 1 FROM files WHERE files.file_id = s.file_id)
+    ''').fetchone()[0]
+    changed = conn.execute('''
+        SELECT COUNT(*) FROM files JOIN files_staging s ON s.file_id = files.file_id
+        WHERE ''' + CHANGED_CONDITION.format(other='s')).fetchone()[0]
+    removed = conn.execute('''
+        SELECT COUNT(*) FROM files
+        WHERE NOT EXISTS (SELECT 1 FROM files_staging s WHERE s.file_id = files.file_id)
+    ''').fetchone()[0]
+    return {'added': added, 'changed': changed, 'removed': removed}
+
+# Merge staging into files in one transaction: insert new rows, update only rows that changed,
+# and optionally delete rows that are missing from the CSV
+def merge_staging(conn, delete_missing=False):
+    with conn:
+        conn.execute('''
+            INSERT INTO files (file_id, file_name, file_size, md5sum, signedUrl)
+            SELECT file_id, file_name, file_size, md5sum, signedUrl FROM files_staging WHERE true
+            ON CONFLICT(file_id) DO UPDATE SET file_name=excluded.file_name, file_size=excluded.file_size,
+                md5sum=excluded.md5sum, signedUrl=excluded.signedUrl
+            WHERE ''' + CHANGED_CONDITION.format(other='excluded'))
+        if delete_missing:
+            conn.execute('''
+                DELETE FROM files
+                WHERE NOT EXISTS (SELECT 1 FROM files_staging s WHERE s.file_id = files.file_id)
+            ''')
+            conn.execute('''
+                DELETE FROM study_files
+                WHERE NOT EXISTS (SELECT 1 FROM files WHERE files.file_id = study_files.file_id)
+            ''')
+    conn.execute('DROP TABLE IF EXISTS temp.files_staging')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk load a file manifest CSV into file_metadata_database.db")
+    parser.add_argument("--csv", default=CSV_FILE, help="CSV file to import")
+    parser.add_argument("--db", default=DB_FILE, help="SQLite database to load into")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_ROWS, help="rows per executemany call")
+    parser.add_argument("--merge", action="store_true",
+                        help="load into a staging table and merge, updating only rows that changed")
+    parser.add_argument("--delete-missing", action="store_true",
+                        help="with --merge, delete rows that are not in the CSV")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report added/changed/removed counts without modifying the database")
+    args = parser.parse_args()
+
+    # Step 1: Connect to (or create) the SQLite database; a dry run opens it read-only and changes nothing
+    if args.dry_run:
+        if not os.path.exists(args.db):
+            parser.error(f"--dry-run needs an existing database, {args.db} does not exist")
+        conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(args.db)
+
+        # Step 2: Create the tables and set up the connection for bulk loading
+        create_tables(conn)
+        configure_for_bulk_load(conn)
+
+    # Step 3: Read the CSV file and insert data into the SQLite database
+    start = time.time()
+    if args.merge or args.dry_run:
+        row_count = load_staging(conn, args.csv, batch_rows=args.chunk_size)
+        diff = diff_staging(conn)
+        print(f"added={diff['added']} changed={diff['changed']} removed={diff['removed']}"
+              + ("" if args.delete_missing or args.dry_run else " (removed rows are kept without --delete-missing)"))
+        if not args.dry_run:
+            merge_staging(conn, delete_missing=args.delete_missing)
+            create_indexes(conn)
+            conn.execute('ANALYZE')
+    else:
+        row_count = import_csv(conn, args.csv, batch_rows=args.chunk_size)
+    elapsed = time.time() - start
 
-# Step 4: Commit the changes and close the connection
-conn.commit()
-conn.close()
+    # Step 4: Close the connection
+    conn.close()
 
-print("CSV data has been successfully inserted into the SQLite database.")
+    print(f"{'Read' if args.dry_run else 'Imported'} {row_count} rows in {elapsed:.2f}s ({row_count / max(elapsed, 1e-9):,.0f} rows/sec)")
@@ -1,10 +1,21 @@
 import requests
+import base64
 import hashlib
 import os
 import sqlite3
-from concurrent.futures import ThreadPoolExecutor
-from flask import Flask, render_template, request, redirect, url_for
+from concurrent.futures import ThreadPoolExecutor, Future
+from flask import Flask, Response, render_template, request, redirect, url_for
+from prometheus_client import Counter, Gauge, Histogram, make_wsgi_app
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
 import threading
+import time
+import socket
+import json
+import queue
+import re
+import sys
+from fetch_study_files import fetch_files_batched, iter_study_files, FILE_FIELDS
+from signed_urls import UrlBroker
 
 # PDC API endpoint
 url = "https://pdc.cancer.gov/graphql"
@@ -12,8 +23,128 @@ url = "https://pdc.cancer.gov/graphql"
 # SQLite Database setup
 DB_FILE = 'download_progress.db'
 
+# Folder the downloaded files are written to
+DOWNLOAD_FOLDER = "smallest_files_folder"
+
+# Content-addressed store: each distinct (md5sum, file_size) is kept once under DOWNLOAD_FOLDER/CONTENT_FOLDER
+# and hardlinked to the file name of every study version that lists it
+CONTENT_FOLDER = "objects"
+
+# Streaming download settings: bytes read from the response and written to disk at a time
+CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+
+# Resume settings: how often bytes received are persisted, and when an in_progress row whose
+# owner cannot be checked (another host) is considered abandoned
+PROGRESS_PERSIST_BYTES = 64 * 1024 * 1024
+STALE_AFTER_SECONDS = 15 * 60
+
+# Segmented download settings: files of at least SEGMENT_THRESHOLD bytes are fetched as concurrent
+# byte-range segments of SEGMENT_SIZE bytes, each retried up to SEGMENT_RETRIES times
+SEGMENT_THRESHOLD = 512 * 1024 * 1024
+SEGMENT_SIZE = 64 * 1024 * 1024
+SEGMENT_WORKERS = 4
+SEGMENT_RETRIES = 3
+
+# Progress DB settings: seconds a connection waits on a lock before failing, and the most
+# queued statements the writer thread commits in one transaction
+DB_TIMEOUT = 30
+WRITE_BATCH_SIZE = 500
+# Attempts at committing a batch (e.g. while other processes hold the lock) before it is written statement by statement
+WRITE_RETRIES = 3
+WRITE_RETRY_BACKOFF = 0.5
+
+# Optional shared limiter every downloaded chunk passes through (set by download_scheduler.py);
+# it must provide consume(nbytes), which blocks while the aggregate bandwidth budget is used up
+bandwidth_limiter = None
+
+# Optional signed URL broker (signed_urls.UrlBroker, set in __main__): URLs are refreshed just before a
+# download starts, and a download rejected for an expired URL is retried up to SIGNED_URL_RETRIES times
+url_broker = None
+SIGNED_URL_RETRIES = 1
+
+# Leases: a claimed download belongs to its owner until lease_expires. Each process renews the leases
+# it holds every HEARTBEAT_SECONDS; a lease that was not renewed in LEASE_SECONDS can be claimed by anyone
+LEASE_SECONDS = 120
+HEARTBEAT_SECONDS = 30
+
+# Identifies this process in download_progress.owner
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Prometheus metrics, exposed at /metrics on the dashboard app.
+# Bytes are counted once per chunk (CHUNK_SIZE), so the chunk loops pay one counter increment per MB
+DOWNLOAD_BYTES = Counter(
+    'download_bytes_total',
+    'Bytes received by downloads'
+)
+
+DOWNLOAD_RATE = Gauge(
+    'download_rate_bytes_per_second',
+    'Aggregate download rate over the last scheduler sample'
+)
+
+DOWNLOAD_DURATION = Histogram(
+    'download_file_duration_seconds',
+    'Time taken to download one file',
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200)
+)
+
+DOWNLOAD_FILE_SIZE = Histogram(
+    'download_file_size_bytes',
+    'Size of downloaded files',
+    buckets=tuple(10 ** exponent for exponent in range(3, 12))
+)
+
+DOWNLOADS_IN_FLIGHT = Gauge(
+    'downloads_in_flight',
+    'Downloads currently being transferred'
+)
+
+DOWNLOADS_QUEUED = Gauge(
+    'downloads_queued',
+    'Files waiting in the scheduler queues'
+)
+
+DOWNLOAD_RETRIES = Counter(
+    'download_retries_total',
+    'Download attempts repeated after an error',
+    ['kind']
+)
+
+DOWNLOAD_FAILURES = Counter(
+    'download_failures_total',
+    'Downloads recorded as failed',
+    ['reason']
+)
+
+CHECKSUM_MISMATCHES = Counter(
+    'download_checksum_mismatches_total',
+    'Downloads whose MD5 did not match the catalog'
+)
+
+PROGRESS_WRITE_LATENCY = Histogram(
+    'progress_db_write_seconds',
+    'Time taken to commit one batch of progress updates'
+)
+
+# Columns added to download_progress after the original schema, in the order they were introduced.
+# init_db adds whichever are missing, so older databases are upgraded in place
+PROGRESS_EXTRA_COLUMNS = [
+    ('bytes_downloaded', 'INTEGER'),
+    ('download_seconds', 'REAL'),
+    ('throughput_bps', 'REAL'),
+    ('bytes_received', 'INTEGER'),
+    ('partial_path', 'TEXT'),
+    ('owner', 'TEXT'),
+    ('updated_at', 'REAL'),
+    ('lease_expires', 'REAL'),
+    ('content_path', 'TEXT'),
+]
+
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    # WAL lets the dashboard and the skip checks read while the writer thread commits
+    conn.execute('PRAGMA journal_mode=WAL')
     c = conn.cursor()
     # Create a table to store download progress
     c.execute('''
@@ -30,24 +161,265 @@ def init_db():
             status TEXT
         )
     ''')
+    existing_columns = {row[1] for row in c.execute("PRAGMA table_info(download_progress)")}
+    for column, column_type in PROGRESS_EXTRA_COLUMNS:
+        if column not in existing_columns:
+            c.execute(f"ALTER TABLE download_progress ADD COLUMN {column} {column_type}")
+    # Dashboard indexes: keyset pages in file_size order, per-status lookups, and rows changed since a time
+    c.execute("CREATE INDEX IF NOT EXISTS idx_progress_size ON download_progress (file_size, unique_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_progress_status ON download_progress (status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_progress_updated ON download_progress (updated_at)")
+    init_summary(c)
     conn.commit()
     conn.close()
 
-    # Function to add or update download progress in the SQLite database
-def update_download_progress(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, generated_md5sum, download_url, status):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+# Files and bytes per status, kept up to date by triggers on download_progress so the dashboard never
+# counts the table. Filled from one scan of download_progress when the table is first created
+def init_summary(c):
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'download_summary'").fetchone()
     c.execute('''
-        INSERT INTO download_progress (unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, generated_md5sum, download_url, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(unique_id) DO UPDATE SET status=excluded.status, generated_md5sum=excluded.generated_md5sum
-    ''', (unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, generated_md5sum, download_url, status))
-    conn.commit()
+        CREATE TABLE IF NOT EXISTS download_summary (
+            status TEXT PRIMARY KEY,
+            files INTEGER NOT NULL,
+            bytes INTEGER NOT NULL
+        )
+    ''')
+    if not exists:
+        c.execute('''
+            INSERT INTO download_summary (status, files, bytes)
+            SELECT IFNULL(status, ''), COUNT(*), IFNULL(SUM(file_size), 0) FROM download_progress GROUP BY 1
+        ''')
+    add = '''
+        INSERT INTO download_summary (status, files, bytes) VALUES (IFNULL(NEW.status, ''), 1, IFNULL(NEW.file_size, 0))
+        ON CONFLICT(status) DO UPDATE SET files = files + 1, bytes = bytes + excluded.bytes;
+    '''
+    remove = '''
+        UPDATE download_summary SET files = files - 1, bytes = bytes - IFNULL(OLD.file_size, 0)
+        WHERE status = IFNULL(OLD.status, '');
+    '''
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS summary_insert AFTER INSERT ON download_progress BEGIN {add} END")
+    c.execute(f"CREATE TRIGGER IF NOT EXISTS summary_delete AFTER DELETE ON download_progress BEGIN {remove} END")
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS summary_update AFTER UPDATE OF status, file_size ON download_progress
+        WHEN OLD.status IS NOT NEW.status OR OLD.file_size IS NOT NEW.file_size
+        BEGIN {remove} {add} END
+    ''')
+
+# Lock contention from another connection or process: worth waiting out, unlike other database errors
+def is_busy_error(e):
+    return isinstance(e, sqlite3.OperationalError) and ('locked' in str(e) or 'busy' in str(e))
+
+# Single writer for download_progress: statements are queued by the download threads and committed
+# by this thread in batched transactions, so workers never wait on (or fight over) the database lock.
+# Statements submitted with a key replace an earlier queued statement with the same key (e.g. repeated
+# bytes_received updates for one file), so only the latest one is written, at its own place in the order.
+# call(fn) runs fn(conn) in order with the queued statements and returns its result once committed,
+# or raises what fn raised. A batch that cannot be committed is retried with backoff, then written one
+# statement at a time; a statement that still fails is kept, with everything queued after it, at the head
+# of the next batch, so updates are never dropped or reordered (and flush() waits until they are written)
+class ProgressWriter(threading.Thread):
+    STOP = object()
+
+    def __init__(self, db_file, batch_size=WRITE_BATCH_SIZE):
+        super().__init__(name='progress-writer', daemon=True)
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+
+    def submit(self, sql, params, key=None):
+        self.queue.put((sql, params, key))
+
+    def call(self, fn):
+        future = Future()
+        self.queue.put((fn, future, None))
+        return future.result()
+
+    # Block until everything submitted so far is committed
+    def flush(self):
+        done = threading.Event()
+        self.queue.put((None, done, None))
+        done.wait()
+
+    def close(self):
+        self.queue.put(self.STOP)
+        self.join()
+
+    def run(self):
+        conn = sqlite3.connect(self.db_file, timeout=DB_TIMEOUT)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        pending, events = [], []
+        stopping = False
+        while not stopping or pending:
+            batch = []
+            if not stopping:
+                # wait for work unless statements are left over from the last batch
+                if not pending:
+                    batch.append(self.queue.get())
+                # take whatever else is already queued, without waiting for more
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if self.STOP in batch:
+                    stopping = True
+                    batch = [item for item in batch if item is not self.STOP]
+            pending, events = self.write_batch(conn, pending + batch, events)
+        conn.close()
+
+    # Write queued items in order. Returns the statements that could not be written yet, in order, and the
+    # flush events waiting behind them; both go back into the next call
+    def write_batch(self, conn, batch, events=()):
+        statements = []
+        positions = {}
+        events = list(events)
+        for sql, params, key in batch:
+            if sql is None:
+                events.append(params)
+                continue
+            if key is not None:
+                if key in positions:
+                    statements[positions[key]] = None
+                positions[key] = len(statements)
+            statements.append((sql, params, key))
+        statements = [statement for statement in statements if statement is not None]
+
+        remaining = []
+        if statements:
+            start = time.perf_counter()
+            for attempt in range(WRITE_RETRIES):
+                try:
+                    outcomes = self.execute(conn, statements)
+                    break
+                except sqlite3.Error as e:
+                    print(f"Failed to write {len(statements)} progress updates (attempt {attempt + 1}): {e}")
+                    time.sleep(WRITE_RETRY_BACKOFF * 2 ** attempt)
+            else:
+                # one statement per transaction, so only what really cannot be written waits for the next batch
+                outcomes = []
+                for index, statement in enumerate(statements):
+                    sql, params, _ = statement
+                    try:
+                        outcomes += self.execute(conn, [statement])
+                    except sqlite3.Error as e:
+                        if callable(sql) and not is_busy_error(e):
+                            outcomes.append((params, e, True))
+                            continue
+                        remaining = statements[index:]
+                        print(f"Could not write progress update {sql if callable(sql) else sql.split()[0]}: {e}; "
+                              f"keeping it and {len(remaining) - 1} later updates queued")
+                        break
+            for future, value, failed in outcomes:
+                if failed:
+                    future.set_exception(value)
+                else:
+                    future.set_result(value)
+            PROGRESS_WRITE_LATENCY.observe(time.perf_counter() - start)
+        if remaining:
+            return remaining, events
+        for event in events:
+            event.set()
+        return [], []
+
+    # Run statements in one transaction; returns (future, result or exception, failed) for each callable.
+    # A callable that raises is rolled back to its savepoint and the rest of the batch still commits;
+    # a lock or I/O error (OperationalError) rolls back the whole transaction for the caller to retry
+    def execute(self, conn, statements):
+        outcomes = []
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for sql, params, _ in statements:
+                if not callable(sql):
+                    conn.execute(sql, params)
+                    continue
+                conn.execute('SAVEPOINT progress_call')
+                try:
+                    outcomes.append((params, sql(conn), False))
+                except sqlite3.OperationalError:
+                    raise
+                except Exception as e:
+                    conn.execute('ROLLBACK TO progress_call')
+                    outcomes.append((params, e, True))
+                conn.execute('RELEASE progress_call')
+        return outcomes
+
+# The writer thread, once start_progress_writer() has been called; without it updates are written directly
+progress_writer = None
+
+def start_progress_writer():
+    global progress_writer
+    if progress_writer is None:
+        progress_writer = ProgressWriter(DB_FILE)
+        progress_writer.start()
+    return progress_writer
+
+def stop_progress_writer():
+    global progress_writer
+    if progress_writer is not None:
+        progress_writer.close()
+        progress_writer = None
+
+# Queue a statement for the writer thread, or execute it right away if there is no writer
+def write_progress(sql, params, key=None):
+    if progress_writer is not None:
+        progress_writer.submit(sql, params, key)
+        return
+    with PROGRESS_WRITE_LATENCY.time():
+        conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+        conn.execute(sql, params)
+        conn.commit()
+        conn.close()
+
+# Run fn(conn) inside a transaction, through the writer thread if there is one so it stays in order with queued updates
+def run_in_transaction(fn):
+    if progress_writer is not None:
+        return progress_writer.call(fn)
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    try:
+        with conn:
+            return fn(conn)
+    finally:
+        conn.close()
+
+# unique_ids of completed downloads, loaded once by load_completed_ids() and kept up to date as files complete
+completed_ids = None
+
+def load_completed_ids():
+    global completed_ids
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    completed_ids = {row[0] for row in conn.execute("SELECT unique_id FROM download_progress WHERE status = 'completed'")}
     conn.close()
+    return completed_ids
+
+    # Function to add or update download progress in the SQLite database
+    # Extra columns (bytes_downloaded, throughput, ...) are passed as keyword arguments and only overwritten when given
+def update_download_progress(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, generated_md5sum, download_url, status, **extra):
+    columns = ['unique_id', 'study_id', 'pdc_study_id', 'file_id', 'file_name', 'file_size', 'md5sum', 'generated_md5sum', 'download_url', 'status']
+    values = [unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, generated_md5sum, download_url, status]
+    updated = ['status', 'generated_md5sum']
+    for column, _ in PROGRESS_EXTRA_COLUMNS:
+        if column in extra:
+            columns.append(column)
+            values.append(extra[column])
+            updated.append(column)
+
+    write_progress(f'''
+        INSERT INTO download_progress ({', '.join(columns)})
+        VALUES ({', '.join('?' * len(columns))})
+        ON CONFLICT(unique_id) DO UPDATE SET {', '.join(f'{column}=excluded.{column}' for column in updated)}
+    ''', values)
+    if completed_ids is not None:
+        if status == 'completed':
+            completed_ids.add(unique_id)
+        else:
+            completed_ids.discard(unique_id)
 
     # Function to check if a file has already been downloaded
+    # Answered from the in-memory set once load_completed_ids() has run, otherwise from the database
 def is_file_downloaded(unique_id):
-    conn = sqlite3.connect(DB_FILE)
+    if completed_ids is not None:
+        return unique_id in completed_ids
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
     c = conn.cursor()
     c.execute("SELECT status FROM download_progress WHERE unique_id = ?", (unique_id,))
     result = c.fetchone()
@@ -70,25 +442,33 @@ def fetch_study_catalog(acceptDUA):
     print(response.json)
     return response.json()['data']['studyCatalog']
 
-# Fetch files per study_id
-def fetch_files_per_study(study_id):
-    query = f"""
-    {{
-        filesPerStudy(study_id: "{study_id}") {{
-            study_id
-            pdc_study_id
-            file_id
-            file_name
-            file_size
-            md5sum
-            signedUrl {{
-                url
-            }}
-        }}
-    }}
-    """
-    response = requests.get(url, params={"query": query})
-    return response.json().get('data', {}).get('filesPerStudy', [])
+# Fields requested per file when fetching study files in aliased batches
+DOWNLOAD_FILE_FIELDS = ['study_id', 'pdc_study_id'] + FILE_FIELDS
+
+# Fetch files for many study_ids, several studies per GraphQL round trip
+def fetch_files_for_studies(study_ids, batch_size=10, max_workers=4):
+    files_by_study = fetch_files_batched(study_ids, batch_size=batch_size, max_workers=max_workers,
+                                         fields=DOWNLOAD_FILE_FIELDS, endpoint=url)
+    return [file for study_id in study_ids for file in files_by_study[study_id]]
+
+# Fields requested when refreshing signed URLs
+SIGNED_URL_FIELDS = ['file_id', 'signedUrl { url }']
+
+# Fresh signed URLs for a few studies, one aliased query; used by the URL broker
+def fetch_signed_urls(study_ids):
+    return fetch_files_batched(study_ids, batch_size=len(study_ids), fields=SIGNED_URL_FIELDS, endpoint=url)
+
+# Yield file records as the crawl returns them, for the download pipeline in __main__. The crawl window is
+# one round of batches, so the first files are handed on after one round trip. Stops after `limit` files if given
+def iter_files_for_studies(study_ids, batch_size=10, max_workers=4, limit=None):
+    count = 0
+    for _, files in iter_study_files(study_ids, max_workers=max_workers, batch_size=batch_size, window=batch_size * max_workers,
+                                     fields=DOWNLOAD_FILE_FIELDS, endpoint=url):
+        for file in files:
+            if limit is not None and count >= limit:
+                return
+            count += 1
+            yield file
 
 # Function to generate MD5 checksum from raw data
 def generate_md5_from_data(data):
@@ -100,7 +480,389 @@ def generate_md5_from_data(data):
 def create_unique_identifier(file):
     return f"{file['study_id']}_{file['file_id']}_{file['file_name']}"
 
+# Count downloaded bytes and account them against the shared bandwidth limiter, if one is installed
+def throttle(nbytes):
+    DOWNLOAD_BYTES.inc(nbytes)
+    if bandwidth_limiter is not None:
+        bandwidth_limiter.consume(nbytes)
+
+# MD5 state of an existing partial file, so a resumed download can keep hashing where it stopped
+def md5_of_partial(part_path, chunk_size=CHUNK_SIZE):
+    md5_hash = hashlib.md5()
+    with open(part_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            md5_hash.update(chunk)
+    return md5_hash
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-\d+/(?:\d+|\*)$')
+
+# First byte of a 206 response according to its Content-Range header, or None if it has none
+def content_range_start(response):
+    match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', '').strip())
+    return int(match.group(1)) if match else None
+
+# Stream a URL to file_path in CHUNK_SIZE pieces, hashing as bytes arrive.
+# Data goes to a .part file that is renamed into place only once the download is complete,
+# so memory per download is one chunk and a failed download never leaves a truncated file behind.
+# If a .part file is already there, the download resumes with a Range request and the MD5 state is
+# rebuilt from the bytes on disk; the .part file is kept on failure so the next attempt can resume.
+# A partial file longer than the file, a 416 answer, or a 206 whose Content-Range does not start at
+# the partial file's end means the partial file cannot be resumed: it is discarded and the download restarts.
+# on_progress(bytes_received) is called about every PROGRESS_PERSIST_BYTES.
+# Returns (md5 hex digest, bytes written in this attempt, seconds taken)
+def stream_download(download_url, file_path, chunk_size=CHUNK_SIZE, expected_size=None, on_progress=None):
+    start = time.monotonic()
+    part_path = file_path + '.part'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    # a partial file that already holds every byte only needs to be finalised
+    if offset and expected_size is not None and offset == expected_size:
+        md5_hash = md5_of_partial(part_path, chunk_size)
+        os.replace(part_path, file_path)
+        return md5_hash.hexdigest(), 0, time.monotonic() - start
+    if offset and expected_size is not None and offset > expected_size:
+        print(f"Discarding {part_path}: {offset} bytes for a {expected_size} byte file")
+        os.remove(part_path)
+        offset = 0
+
+    while True:
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        response = requests.get(download_url, stream=True, timeout=DOWNLOAD_TIMEOUT, headers=headers)
+        if offset and (response.status_code == 416 or
+                       (response.status_code == 206 and content_range_start(response) != offset)):
+            print(f"Discarding {part_path}: the server cannot resume it at byte {offset} "
+                  f"(HTTP {response.status_code}, Content-Range {response.headers.get('Content-Range')})")
+            response.close()
+            os.remove(part_path)
+            offset = 0
+            continue
+        break
+
+    with response:
+        if offset and response.status_code == 206:
+            md5_hash = md5_of_partial(part_path, chunk_size)
+            mode = 'ab'
+        elif response.status_code == 200:
+            # fresh download, or the server ignored the Range header: start from byte zero
+            offset = 0
+            md5_hash = hashlib.md5()
+            mode = 'wb'
+        else:
+            raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+
+        bytes_written = 0
+        next_report = PROGRESS_PERSIST_BYTES
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                throttle(len(chunk))
+                f.write(chunk)
+                md5_hash.update(chunk)
+                bytes_written += len(chunk)
+                if on_progress is not None and bytes_written >= next_report:
+                    f.flush()
+                    on_progress(offset + bytes_written)
+                    next_report += PROGRESS_PERSIST_BYTES
+
+    if expected_size is not None and offset + bytes_written != expected_size:
+        raise IOError(f"incomplete download: {offset + bytes_written} of {expected_size} bytes")
+    os.replace(part_path, file_path)
+    return md5_hash.hexdigest(), bytes_written, time.monotonic() - start
+
+# Raised when the server does not honour Range requests, so a file cannot be fetched in segments
+class RangeNotSupported(Exception):
+    pass
+
+# Download one byte range [start, end] into the preallocated file with positional writes.
+# Connection errors, truncated segments and 429 / 5xx answers are retried; other 4xx answers (an expired
+# signed URL) and a lost lease go straight to the caller
+def download_segment(download_url, fd, start, end, chunk_size, on_bytes):
+    for attempt in range(SEGMENT_RETRIES):
+        position = start
+        try:
+            headers = {'Range': f'bytes={start}-{end}'}
+            with requests.get(download_url, stream=True, timeout=DOWNLOAD_TIMEOUT, headers=headers) as response:
+                if response.status_code == 200:
+                    raise RangeNotSupported(download_url)
+                if response.status_code != 206:
+                    raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    throttle(len(chunk))
+                    os.pwrite(fd, chunk, position)
+                    position += len(chunk)
+                    on_bytes(len(chunk))
+            if position != end + 1:
+                raise IOError(f"segment {start}-{end} ended at byte {position}")
+            return
+        except (RangeNotSupported, LeaseLost):
+            raise
+        except Exception as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            if isinstance(e, requests.HTTPError) and status is not None and status != 429 and status < 500:
+                raise
+            on_bytes(start - position)  # the segment is fetched again from its start
+            if attempt + 1 == SEGMENT_RETRIES:
+                raise
+            DOWNLOAD_RETRIES.labels(kind='segment').inc()
+            print(f"Retrying segment {start}-{end} after error: {e}")
+            time.sleep(2 ** attempt)
+
+# Download a large file as concurrent byte-range segments into a preallocated .part file.
+# Finished segments are listed in a .segments sidecar so an interrupted download only refetches the rest.
+# The MD5 is computed once all segments are on disk. Returns (md5 hex digest, bytes written, seconds taken)
+def segmented_download(download_url, file_path, expected_size, chunk_size=CHUNK_SIZE, on_progress=None):
+    start_time = time.monotonic()
+    part_path = file_path + '.part'
+    sidecar_path = file_path + '.segments'
+
+    segments = [(start, min(start + SEGMENT_SIZE, expected_size) - 1) for start in range(0, expected_size, SEGMENT_SIZE)]
+    done = set()
+    if os.path.exists(sidecar_path) and os.path.exists(part_path):
+        with open(sidecar_path) as f:
+            done = set(json.load(f))
+    else:
+        with open(part_path, 'wb') as f:
+            f.truncate(expected_size)
+
+    lock = threading.Lock()
+    progress = {'received': sum(segments[i][1] - segments[i][0] + 1 for i in done), 'written': 0,
+                'next_report': PROGRESS_PERSIST_BYTES}
+
+    def on_bytes(count):
+        with lock:
+            progress['received'] += count
+            progress['written'] += count
+            if on_progress is not None and progress['written'] >= progress['next_report']:
+                on_progress(progress['received'])
+                progress['next_report'] += PROGRESS_PERSIST_BYTES
+
+    def fetch(index):
+        start, end = segments[index]
+        download_segment(download_url, fd, start, end, chunk_size, on_bytes)
+        with lock:
+            done.add(index)
+            with open(sidecar_path, 'w') as f:
+                json.dump(sorted(done), f)
+
+    fd = os.open(part_path, os.O_RDWR)
+    try:
+        with ThreadPoolExecutor(max_workers=SEGMENT_WORKERS) as executor:
+            futures = [executor.submit(fetch, index) for index in range(len(segments)) if index not in done]
+            for future in futures:
+                future.result()
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    md5_hash = md5_of_partial(part_path, chunk_size)
+    os.replace(part_path, file_path)
+    os.remove(sidecar_path)
+    return md5_hash.hexdigest(), progress['written'], time.monotonic() - start_time
+
+# Pick segmented or single-stream download for a file; falls back to one stream if ranges are not supported
+def download_file(download_url, file_path, expected_size, on_progress=None):
+    sidecar_path = file_path + '.segments'
+    if expected_size is not None and (expected_size >= SEGMENT_THRESHOLD or os.path.exists(sidecar_path)):
+        try:
+            return segmented_download(download_url, file_path, expected_size, on_progress=on_progress)
+        except RangeNotSupported:
+            print(f"Server does not support Range requests, downloading {file_path} as one stream")
+            # the preallocated .part file is not a valid prefix for a resumed stream
+            for path in (file_path + '.part', sidecar_path):
+                if os.path.exists(path):
+                    os.remove(path)
+    return stream_download(download_url, file_path, expected_size=expected_size, on_progress=on_progress)
+
+# Is the process that owns an in_progress row still running? Only answerable for owners on this host
+def owner_is_alive(owner):
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+# At startup, mark in_progress rows left behind by dead processes as failed so they are retried,
+# recording how many bytes their partial files hold so the retry resumes from there.
+# Owners on other hosts are judged by their lease (or, for rows without one, by the last update)
+def reclaim_stale_downloads():
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    c = conn.cursor()
+    c.execute("SELECT unique_id, owner, updated_at, lease_expires, partial_path FROM download_progress WHERE status = 'in_progress'")
+    reclaimed = 0
+    now = time.time()
+    for unique_id, owner, updated_at, lease_expires, partial_path in c.fetchall():
+        if owner == OWNER_ID:
+            continue
+        alive = owner_is_alive(owner)
+        if alive is None and lease_expires is not None:
+            alive = now < lease_expires
+        elif alive is None:
+            alive = updated_at is not None and now - updated_at < STALE_AFTER_SECONDS
+        if alive:
+            continue
+        bytes_received = partial_size(partial_path) if partial_path else 0
+        c.execute('''
+            UPDATE download_progress SET status = 'failed', bytes_received = ?, owner = NULL, lease_expires = NULL, updated_at = ?
+            WHERE unique_id = ? AND status = 'in_progress' AND owner IS ?
+        ''', (bytes_received, now, unique_id, owner))
+        reclaimed += c.rowcount
+    conn.commit()
+    conn.close()
+    return reclaimed
+
+# Record bytes received so far for a download in progress (only the latest queued value is written)
+def record_bytes_received(unique_id, bytes_received):
+    write_progress("UPDATE download_progress SET bytes_received = ?, updated_at = ? WHERE unique_id = ?",
+                   (bytes_received, time.time(), unique_id), key=('bytes_received', unique_id))
+
+# Location of a file's content in the store, keyed by the catalog md5sum and file_size (None if either is missing)
+def content_path_for(md5sum, file_size):
+    if not md5sum or not file_size:
+        return None
+    return os.path.join(DOWNLOAD_FOLDER, CONTENT_FOLDER, md5sum[:2], f"{md5sum}_{int(file_size)}")
+
+# Hardlink stored content to a study version's file name. Where hardlinks are not possible the
+# download_progress row's content_path is the only pointer (a manifest entry); returns True if linked
+def link_content(content_path, file_path):
+    if os.path.exists(file_path):
+        if os.path.samefile(content_path, file_path):
+            return True
+        os.remove(file_path)
+    try:
+        os.link(content_path, file_path)
+        return True
+    except OSError:
+        return False
+
+# Move a verified download into the store and link it back to its file name.
+# If another worker stored the same content meanwhile, the new copy is dropped
+def store_content(file_path, content_path):
+    os.makedirs(os.path.dirname(content_path), exist_ok=True)
+    if os.path.exists(content_path):
+        os.remove(file_path)
+    else:
+        os.replace(file_path, content_path)
+    link_content(content_path, file_path)
+
+# Passes file records through while adding up total catalog bytes and bytes of distinct content
+# (by md5sum and file_size) in savings, so a streamed listing is counted without being kept
+def count_content(records, savings):
+    distinct = set()
+    for record in records:
+        size = int(record['file_size']) if record.get('file_size') else 0
+        savings['total'] += size
+        key = (record['md5sum'], size) if record.get('md5sum') else None
+        if key is None or key not in distinct:
+            savings['distinct'] += size
+            if key is not None:
+                distinct.add(key)
+        yield record
+
+# Raised inside a download whose lease was taken over by another worker
+class LeaseLost(Exception):
+    pass
+
+# Renews, in one statement per heartbeat, the leases of every download this process holds,
+# and notices leases that another worker has taken over after they expired.
+# held maps each lease to the claim it came from, so only leases held since before a heartbeat's renew
+# are judged by it; a lease claimed while the heartbeat runs is not mistaken for a lost one
+class LeaseKeeper(threading.Thread):
+    def __init__(self):
+        super().__init__(name='lease-keeper', daemon=True)
+        self.held = {}
+        self.lost = set()
+        self.claims = 0
+        self.lock = threading.Lock()
+
+    def add(self, unique_id):
+        with self.lock:
+            self.claims += 1
+            self.held[unique_id] = self.claims
+            self.lost.discard(unique_id)
+
+    def release(self, unique_id):
+        with self.lock:
+            self.held.pop(unique_id, None)
+            self.lost.discard(unique_id)
+
+    def is_lost(self, unique_id):
+        with self.lock:
+            return unique_id in self.lost
+
+    def renew(self, conn):
+        conn.execute("UPDATE download_progress SET lease_expires = ? WHERE owner = ? AND status = 'in_progress'",
+                     (time.time() + LEASE_SECONDS, OWNER_ID))
+        return {row[0] for row in conn.execute(
+            "SELECT unique_id FROM download_progress WHERE owner = ? AND status = 'in_progress'", (OWNER_ID,))}
+
+    def run(self):
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            with self.lock:
+                held = dict(self.held)
+            try:
+                owned = run_in_transaction(self.renew)
+            except sqlite3.Error as e:
+                print(f"Lease heartbeat failed: {e}")
+                continue
+            with self.lock:
+                self.lost |= {unique_id for unique_id, claim in held.items()
+                              if unique_id not in owned and self.held.get(unique_id) == claim}
+
+lease_keeper = None
+
+def get_lease_keeper():
+    global lease_keeper
+    if lease_keeper is None:
+        lease_keeper = LeaseKeeper()
+        lease_keeper.start()
+    return lease_keeper
+
+# Atomically claim a download for this process: succeeds for a new file, a failed one, or one whose
+# lease has expired, and never for a completed file or one leased to a live worker.
+# Returns True if this process now holds the lease
+def claim_download(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, download_url, partial_path):
+    now = time.time()
+    params = (unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, download_url,
+              partial_path, OWNER_ID, now + LEASE_SECONDS, now, now)
+
+    def claim(conn):
+        cursor = conn.execute('''
+            INSERT INTO download_progress (unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum,
+                                           download_url, status, partial_path, owner, lease_expires, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'in_progress', ?, ?, ?, ?)
+            ON CONFLICT(unique_id) DO UPDATE SET status = 'in_progress', generated_md5sum = NULL,
+                download_url = excluded.download_url, partial_path = excluded.partial_path, owner = excluded.owner,
+                lease_expires = excluded.lease_expires, updated_at = excluded.updated_at
+            WHERE download_progress.status != 'completed'
+              AND (download_progress.status != 'in_progress' OR download_progress.owner = excluded.owner
+                   OR download_progress.lease_expires IS NULL OR download_progress.lease_expires < ?)
+        ''', params)
+        return cursor.rowcount == 1
+
+    claimed = run_in_transaction(claim)
+    if claimed:
+        get_lease_keeper().add(unique_id)
+    return claimed
+
+# Give up a download this process still holds: mark it failed and clear the lease so any worker can
+# claim it again. A row another worker has taken over is left alone
+def release_download(unique_id, bytes_received):
+    write_progress('''
+        UPDATE download_progress SET status = 'failed', owner = NULL, lease_expires = NULL,
+            bytes_received = ?, updated_at = ?
+        WHERE unique_id = ? AND owner = ? AND status = 'in_progress'
+    ''', (bytes_received, time.time(), unique_id, OWNER_ID))
+
 # Function to download and process a file
+# Returns the status recorded for the file ('completed', 'checksum_mismatch', 'failed'), or None if it was skipped
 def download_and_process_file(file):
     study_id = file['study_id']
     pdc_study_id = file['pdc_study_id']
@@ -114,68 +876,188 @@ def download_and_process_file(file):
     # Check if the file is already downloaded
     if is_file_downloaded(unique_id):
         print(f"File {file_name} is already downloaded.")
-        return
+        return None
+
+    os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+    file_path = os.path.join(DOWNLOAD_FOLDER, unique_id)
+    part_path = file_path + '.part'
+
+    # Claim the file: mark it in progress under a lease owned by this process, unless another worker holds it
+    if not claim_download(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, download_url, part_path):
+        print(f"File {file_name} is claimed by another worker.")
+        return None
 
-    # Log the file as in progress
-    update_download_progress(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, None, download_url, 'in_progress')
+    def on_progress(received):
+        if lease_keeper.is_lost(unique_id):
+            raise LeaseLost(unique_id)
+        record_bytes_received(unique_id, received)
 
+    DOWNLOADS_IN_FLIGHT.inc()
     try:
+        # Content already in the store (e.g. the same file listed by another study version): link it, no transfer
+        content_path = content_path_for(md5sum, file_size)
+        if content_path is not None and os.path.exists(content_path):
+            link_content(content_path, file_path)
+            print(f"File {file_name} is already stored as {content_path}.")
+            update_download_progress(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, md5sum, download_url, 'completed',
+                                     bytes_downloaded=0, download_seconds=0, throughput_bps=None, bytes_received=int(file_size),
+                                     partial_path=None, owner=None, lease_expires=None, content_path=content_path, updated_at=time.time())
+            return 'completed'
+
+        # Swap in a fresh signed URL if the catalog one is about to expire; only now that a transfer is needed,
+        # since the broker may re-fetch a whole study's URLs
+        if url_broker is not None:
+            download_url = url_broker.url_for(file)
+
         print("file downloading starting")
-        # Download the file
-        download_response = requests.get(download_url)
-        if download_response.status_code == 200:
-            file_path = os.path.join("smallest_files_folder", unique_id)
-            os.makedirs("smallest_files_folder", exist_ok=True)
-            with open(file_path, 'wb') as f:
-                f.write(download_response.content)
-            
-            # Generate md5 checksum
-            generated_md5 = generate_md5_from_data(download_response.content)
-
-            # Log the file as completed
-            update_download_progress(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, generated_md5, download_url, 'completed')
-        else:
-            print(f"Failed to download {file_name}: {download_response.status_code}")
-            update_download_progress(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, None, download_url, 'failed')
+        # Download the file in chunks (resuming a partial file if there is one), generating the md5 checksum as it streams
+        # Files above SEGMENT_THRESHOLD are fetched as concurrent byte-range segments
+        # A URL that expired anyway is refreshed and the download retried at once, resuming the partial file
+        for attempt in range(SIGNED_URL_RETRIES + 1):
+            try:
+                generated_md5, bytes_downloaded, seconds = download_file(
+                    download_url, file_path, int(file_size) if file_size else None, on_progress=on_progress)
+                break
+            except requests.HTTPError as e:
+                if url_broker is None or attempt == SIGNED_URL_RETRIES or not url_broker.is_expired_error(e):
+                    raise
+                print(f"Signed URL for {file_name} was rejected ({e}), retrying with a refreshed URL")
+                DOWNLOAD_RETRIES.labels(kind='expired_url').inc()
+                download_url = url_broker.url_for(file, expired_url=download_url)
+        bytes_received = os.path.getsize(file_path)
+
+        # Verify against the catalog checksum. A corrupt copy is deleted, so the retry starts from byte zero
+        # instead of resuming it, and recorded as checksum_mismatch, which the scheduler re-queues
+        if md5sum and generated_md5 != md5sum:
+            print(f"Checksum mismatch for {file_name}: expected {md5sum}, got {generated_md5}")
+            CHECKSUM_MISMATCHES.inc()
+            os.remove(file_path)
+            update_download_progress(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, generated_md5, download_url, 'checksum_mismatch',
+                                     bytes_downloaded=bytes_downloaded, download_seconds=seconds, bytes_received=0,
+                                     partial_path=None, owner=None, lease_expires=None, updated_at=time.time())
+            return 'checksum_mismatch'
+
+        # Only verified content goes into the store, so a bad copy is never shared
+        if content_path is not None:
+            store_content(file_path, content_path)
+
+        DOWNLOAD_DURATION.observe(seconds)
+        if file_size:
+            DOWNLOAD_FILE_SIZE.observe(int(file_size))
+
+        # Log the file as completed, with its throughput
+        update_download_progress(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, generated_md5, download_url, 'completed',
+                                 bytes_downloaded=bytes_downloaded, download_seconds=seconds,
+                                 throughput_bps=bytes_downloaded / seconds if seconds > 0 else None,
+                                 bytes_received=bytes_received, partial_path=None, owner=None,
+                                 lease_expires=None, content_path=content_path, updated_at=time.time())
+        return 'completed'
+
+    except LeaseLost:
+        # another worker owns the file now, so its row is not touched; if the row is still ours after all,
+        # release it instead of leaving it in_progress under this (live) owner forever
+        print(f"Lease on {file_name} was lost, abandoning the download.")
+        release_download(unique_id, partial_size(part_path))
+        return None
+
+    except requests.HTTPError as e:
+        print(f"Failed to download {file_name}: {e}")
+        DOWNLOAD_FAILURES.labels(reason='http').inc()
+        update_download_progress(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, None, download_url, 'failed',
+                                 bytes_received=partial_size(part_path), owner=None, lease_expires=None, updated_at=time.time())
+        return 'failed'
 
     except Exception as e:
         print(f"Error downloading {file_name}: {str(e)}")
-        update_download_progress(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, None, download_url, 'failed')
+        DOWNLOAD_FAILURES.labels(reason='error').inc()
+        update_download_progress(unique_id, study_id, pdc_study_id, file_id, file_name, file_size, md5sum, None, download_url, 'failed',
+                                 bytes_received=partial_size(part_path), owner=None, lease_expires=None, updated_at=time.time())
+        return 'failed'
+
+    finally:
+        DOWNLOADS_IN_FLIGHT.dec()
+        lease_keeper.release(unique_id)
+
+# Bytes held by a partial download file (0 if there is none). A segmented download preallocates
+# the whole file, so its progress is counted from the finished segments listed in the sidecar
+def partial_size(part_path):
+    if not os.path.exists(part_path):
+        return 0
+    sidecar_path = part_path[:-len('.part')] + '.segments'
+    if os.path.exists(sidecar_path):
+        with open(sidecar_path) as f:
+            return min(len(json.load(f)) * SEGMENT_SIZE, os.path.getsize(part_path))
+    return os.path.getsize(part_path)
 
 # Flask web app to display download status
 app = Flask(__name__)
 PER_PAGE = 8
 
+# Expose Prometheus metrics at /metrics
+app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {
+    '/metrics': make_wsgi_app()
+})
+
+# Dashboard pages are keyset pages in (file_size, unique_id) descending order, served by idx_progress_size,
+# so a deep page costs the same as the first. Cursors are the position of a page's first or last row
+def encode_cursor(file_size, unique_id):
+    return base64.urlsafe_b64encode(json.dumps([file_size, unique_id]).encode()).decode()
+
+def decode_cursor(token):
+    file_size, unique_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+    return file_size, str(unique_id)
+
+# One dashboard page after (or, going back, before) a cursor position.
+# Returns (rows, whether there is a page beyond them in the direction travelled)
+def progress_page(conn, after=None, before=None, limit=PER_PAGE):
+    if before is not None:
+        rows = conn.execute("""
+            SELECT * FROM download_progress WHERE (file_size, unique_id) > (?, ?)
+            ORDER BY file_size, unique_id LIMIT ?
+        """, (*before, limit + 1)).fetchall()
+        return rows[:limit][::-1], len(rows) > limit
+    where, params = ("WHERE (file_size, unique_id) < (?, ?)", after) if after is not None else ("", ())
+    rows = conn.execute(f"""
+        SELECT * FROM download_progress {where}
+        ORDER BY file_size DESC, unique_id DESC LIMIT ?
+    """, (*params, limit + 1)).fetchall()
+    return rows[:limit], len(rows) > limit
+
+# Files and bytes per status from the maintained download_summary table
+def read_summary(conn):
+    return {status: {'files': files, 'bytes': total}
+            for status, files, total in conn.execute("SELECT status, files, bytes FROM download_summary WHERE files > 0")}
+
 @app.route('/')
 def index():
-    # 1) What page are we on?  Default to 1
+    # Page number is only displayed; the position comes from the after/before cursor
     page = request.args.get('page', 1, type=int)
+    try:
+        after = decode_cursor(request.args['after']) if 'after' in request.args else None
+        before = decode_cursor(request.args['before']) if 'before' in request.args else None
+    except (ValueError, TypeError):
+        return redirect(url_for('index'))
 
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-
-    # 2) How many rows total?
-    c.execute("SELECT COUNT(*) FROM download_progress")
-    total_rows = c.fetchone()[0]
-
-    # 3) Grab only the rows for this page
-    offset = (page - 1) * PER_PAGE
-    c.execute("""
-        SELECT * FROM download_progress
-        ORDER BY file_size DESC      -- pick your sort column(s)
-        LIMIT ? OFFSET ?
-    """, (PER_PAGE, offset))
-    downloads = c.fetchall()
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    downloads, more = progress_page(conn, after=after, before=before)
+    summary = read_summary(conn)
     conn.close()
 
-    # 4) Compute how many pages
-    total_pages = (total_rows + PER_PAGE - 1) // PER_PAGE
+    total_rows = sum(counts['files'] for counts in summary.values())
+    total_pages = max((total_rows + PER_PAGE - 1) // PER_PAGE, 1)
+    has_previous = more if before is not None else after is not None
+    has_next = more if before is None else True
+    first = encode_cursor(downloads[0][5], downloads[0][0]) if downloads else None
+    last = encode_cursor(downloads[-1][5], downloads[-1][0]) if downloads else None
 
     return render_template(
         'index.html',
         downloads=downloads,
+        summary=summary,
         page=page,
-        total_pages=total_pages
+        total_pages=total_pages,
+        previous_cursor=first if has_previous else None,
+        next_cursor=last if has_next and downloads else None
     )
 
 @app.route('/refresh')
@@ -183,6 +1065,115 @@ def refresh():
     # Logic to refresh download status (if needed)
     return redirect(url_for('index'))
 
+# Live updates for the dashboard. One thread polls download_progress for rows changed since its last
+# poll (idx_progress_updated) and the summary table, every FEED_INTERVAL seconds while anyone is
+# listening, and hands each delta to every subscriber's queue. Rows written by other processes sharing
+# the database are picked up the same way. Each poll looks FEED_OVERLAP seconds further back than the
+# last row it saw, so rows committed by the writer thread after their updated_at was taken are not missed
+FEED_INTERVAL = 1.0
+FEED_OVERLAP = 5.0
+FEED_MAX_ROWS = 500
+
+class StatusFeed(threading.Thread):
+    def __init__(self, interval=FEED_INTERVAL):
+        super().__init__(name='status-feed', daemon=True)
+        self.interval = interval
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.since = time.time()
+        self.sent = {}
+        self.summary = None
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=100)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    # Rows changed since the last poll (at most FEED_MAX_ROWS not sent yet), and the summary if it changed;
+    # None if nothing did. The look-back window is read in (updated_at, unique_id) keyset pages and rows
+    # already sent are skipped without counting against the limit, so a burst of updates larger than
+    # FEED_MAX_ROWS is sent over the next polls instead of pinning every poll to the same rows
+    def poll(self, conn):
+        rows = []
+        cursor = (self.since - FEED_OVERLAP, '')
+        while len(rows) < FEED_MAX_ROWS:
+            page = conn.execute("""
+                SELECT unique_id, status, bytes_received, file_size, throughput_bps, updated_at FROM download_progress
+                WHERE (updated_at, unique_id) > (?, ?) ORDER BY updated_at, unique_id LIMIT ?
+            """, (*cursor, FEED_MAX_ROWS)).fetchall()
+            for row in page:
+                if len(rows) == FEED_MAX_ROWS:
+                    break
+                self.since = max(self.since, row[5])
+                if self.sent.get(row[0]) != row[5]:
+                    rows.append(row)
+            if len(page) < FEED_MAX_ROWS:
+                break
+            cursor = (page[-1][5], page[-1][0])
+        self.sent.update((row[0], row[5]) for row in rows)
+        self.sent = {unique_id: updated for unique_id, updated in self.sent.items() if updated > self.since - FEED_OVERLAP}
+        summary = read_summary(conn)
+        if not rows and summary == self.summary:
+            return None
+        self.summary = summary
+        return {'rows': [dict(zip(('unique_id', 'status', 'bytes_received', 'file_size', 'throughput_bps'), row[:5]))
+                         for row in rows],
+                'summary': summary}
+
+    def run(self):
+        conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT, check_same_thread=False)
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                subscribers = list(self.subscribers)
+            if not subscribers:
+                continue
+            try:
+                delta = self.poll(conn)
+            except sqlite3.Error as e:
+                print(f"Status feed poll failed: {e}")
+                continue
+            if delta is None:
+                continue
+            event = json.dumps(delta)
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(event)
+                except queue.Full:
+                    pass  # a stalled client misses deltas; the summary in the next one catches it up
+
+status_feed = None
+
+def get_status_feed():
+    global status_feed
+    if status_feed is None:
+        status_feed = StatusFeed()
+        status_feed.start()
+    return status_feed
+
+# Server-Sent Events stream of status deltas for templates/index.html
+@app.route('/events')
+def events():
+    feed = get_status_feed()
+    subscriber = feed.subscribe()
+
+    def stream():
+        try:
+            while True:
+                try:
+                    yield f"data: {subscriber.get(timeout=15)}\n\n"
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            feed.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 # Function to process files in parallel
 def download_files_in_parallel(files, max_workers=4):
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
@@ -191,24 +1182,41 @@ def download_files_in_parallel(files, max_workers=4):
             future.result()
 
 if __name__ == "__main__":
-    # Initialize the database
+    # Initialize the database and reclaim downloads left in_progress by a process that died
     init_db()
     print("database initialized")
-    # Example flow: fetch files, sort by size, and download
+    reclaimed = reclaim_stale_downloads()
+    if reclaimed:
+        print(f"reclaimed {reclaimed} stale in_progress downloads")
+    # One query for everything already completed, then all progress writes go through the writer thread
+    print(f"{len(load_completed_ids())} files already downloaded")
+    start_progress_writer()
+    # Example flow: crawl the studies and download the files as the crawl returns them
     acceptDUA = True
-    study_catalog = fetch_study_catalog(acceptDUA) 
-    study_id_list = [version['study_id'] for study in study_catalog for version in study['versions']][12:14]  # test 1 study
-    print(study_id_list)
-    all_files = [file for study_id in study_id_list for file in fetch_files_per_study(study_id)]
-    print("sorting files")
-    files_sorted = sorted(all_files, key=lambda x: int(x['file_size']))[:500]
-    print(files_sorted)
-    
-    # Start downloading files in parallel
-    #download_files_in_parallel(files_sorted)
 
-    # Start the file downloads in a background thread
-    download_thread = threading.Thread(target=download_files_in_parallel, args=(files_sorted,))
+    # Pipeline: the crawl runs on a producer thread feeding a bounded queue, and the scheduler's workers
+    # start on the first records instead of waiting for every study's file list (smallest-first within
+    # a reorder window of upcoming files, see download_scheduler.py). The dashboard starts right away.
+    # (the scheduler imports this module by name, so register this script under that name to share its state)
+    sys.modules.setdefault('download_files_with_progress_DB', sys.modules[__name__])
+    # Signed URLs are renewed per study just before dispatch, so files late in the queue do not expire
+    url_broker = UrlBroker(fetch_signed_urls)
+    from download_scheduler import schedule_stream, format_timeline
+    def run_downloads():
+        study_catalog = fetch_study_catalog(acceptDUA)
+        study_id_list = [version['study_id'] for study in study_catalog for version in study['versions']][12:14]  # test 1 study
+        print(study_id_list)
+        savings = {'total': 0, 'distinct': 0}
+        records = count_content(iter_files_for_studies(study_id_list, limit=500), savings)
+        summary, timeline = schedule_stream(records, policy='smallest-first')
+        progress_writer.flush()
+        print(format_timeline(timeline))
+        if summary['first_download_seconds'] is not None:
+            print(f"first download completed after {summary['first_download_seconds']:.1f}s")
+        print(f"downloaded {summary['files']} files, {summary['bytes']} bytes in {summary['seconds']:.1f}s")
+        total, unique = savings['total'], savings['distinct']
+        print(f"listed {total} bytes, {unique} bytes of distinct content ({total - unique} bytes shared between study versions)")
+    download_thread = threading.Thread(target=run_downloads)
     download_thread.start()
 
     # Start the Flask web server, on remote server
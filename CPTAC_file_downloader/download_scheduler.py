@@ -0,0 +1,300 @@
+import asyncio
+import bisect
+import heapq
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import download_files_with_progress_DB as downloader
+
+'''
+asyncio download scheduler for download_files_with_progress_DB.py
+replaces the fixed ThreadPoolExecutor(max_workers=4) with
+  - a global concurrency cap (MAX_CONCURRENCY) and a per-host cap (PER_HOST_CONCURRENCY)
+  - an optional aggregate bandwidth limit shared by every download (token bucket)
+  - a scheduling policy: smallest-first, largest-first, or balanced
+    (LPT bin-packing of the files across the workers to minimise makespan)
+and samples a queue-depth / throughput timeline while it runs.
+files come either as a list (run) or as a stream (run_stream), e.g. straight from the catalog crawl
+through a bounded queue, so downloads start while the crawl is still going.
+the transfers themselves still run download_and_process_file in worker threads
+'''
+
+MAX_CONCURRENCY = 8
+PER_HOST_CONCURRENCY = 4
+SAMPLE_INTERVAL = 1.0
+
+# Fixed cost of one request expressed in bytes, so the balanced policy does not treat small files as free
+REQUEST_OVERHEAD_BYTES = 1024 * 1024
+
+POLICIES = ('smallest-first', 'largest-first', 'balanced')
+
+# Times a file whose download failed checksum verification is put back on the queue
+CHECKSUM_REQUEUES = 2
+
+# Streaming input: most records buffered between the producer and the scheduler, and how many of the
+# next queued files are kept in policy order as records arrive (None keeps arrival order)
+FEED_QUEUE_SIZE = 1000
+REORDER_WINDOW = 256
+
+
+# Token bucket shared by all download threads. With rate_bps=None it only counts bytes.
+# consume() takes the bytes immediately and sleeps off any debt, so the bucket never holds more
+# than one second of burst
+class BandwidthLimiter:
+    def __init__(self, rate_bps=None):
+        self.rate_bps = rate_bps
+        self.tokens = rate_bps or 0
+        self.updated = time.monotonic()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes):
+        with self.lock:
+            self.total_bytes += nbytes
+            if not self.rate_bps:
+                return
+            now = time.monotonic()
+            self.tokens = min(self.rate_bps, self.tokens + (now - self.updated) * self.rate_bps)
+            self.updated = now
+            self.tokens -= nbytes
+            wait = -self.tokens / self.rate_bps if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def file_size_of(file):
+    return int(file['file_size']) if file.get('file_size') else 0
+
+def host_of(file):
+    return urlparse(file['signedUrl']['url']).netloc
+
+# Files with the same content key are the same bytes (see the content store in download_files_with_progress_DB.py)
+def content_key(file):
+    if not file.get('md5sum') or not file.get('file_size'):
+        return None
+    return file['md5sum'], int(file['file_size'])
+
+# Longest-processing-time bin packing: hand each file, largest first, to the least loaded worker.
+# Each bin keeps its files largest first
+def lpt_bins(files, workers):
+    bins = [deque() for _ in range(workers)]
+    loads = [(0, index) for index in range(workers)]
+    for file in sorted(files, key=file_size_of, reverse=True):
+        load, index = heapq.heappop(loads)
+        bins[index].append(file)
+        heapq.heappush(loads, (load + file_size_of(file) + REQUEST_OVERHEAD_BYTES, index))
+    return bins
+
+
+class DownloadScheduler:
+    # returned by take() once a worker has nothing left to download
+    DONE = object()
+
+    def __init__(self, download=None, max_concurrency=MAX_CONCURRENCY, per_host_concurrency=PER_HOST_CONCURRENCY,
+                 bandwidth_bps=None, policy='smallest-first', sample_interval=SAMPLE_INTERVAL,
+                 reorder_window=REORDER_WINDOW, feed_queue_size=FEED_QUEUE_SIZE):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        self.download = download or downloader.download_and_process_file
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.limiter = BandwidthLimiter(bandwidth_bps)
+        self.policy = policy
+        self.sample_interval = sample_interval
+        self.reorder_window = reorder_window
+        self.feed_queue_size = feed_queue_size
+        self.timeline = []
+
+    # Queues the workers take from: one shared queue, or one LPT bin per worker for the balanced policy
+    def build_queues(self, files):
+        if self.policy == 'balanced':
+            return lpt_bins(files, self.max_concurrency)
+        ordered = sorted(files, key=file_size_of, reverse=self.policy == 'largest-first')
+        return [deque(ordered)] * self.max_concurrency
+
+    # Streaming: place one arriving file. The balanced policy gives it to the least loaded worker (online LPT);
+    # within the queue it is inserted in policy order among the first reorder_window files, else appended
+    def add_file(self, file):
+        queue = self.queues[0]
+        if self.policy == 'balanced':
+            load, index = heapq.heappop(self.loads)
+            heapq.heappush(self.loads, (load + file_size_of(file) + REQUEST_OVERHEAD_BYTES, index))
+            queue = self.queues[index]
+        if self.reorder_window:
+            order = -1 if self.policy in ('largest-first', 'balanced') else 1
+            key = lambda f: order * file_size_of(f)
+            window = min(len(queue), self.reorder_window)
+            position = bisect.bisect_right(queue, key(file), 0, window, key=key)
+            if position < window or window < self.reorder_window:
+                queue.insert(position, file)
+                return
+        queue.append(file)
+
+    # Next file for a worker: the first one in its queue whose host is below its cap and whose content
+    # is not being transferred already (a later copy of the same content is then linked from the store).
+    # A balanced worker whose bin is empty takes the smallest file of the most loaded bin.
+    # Returns None if every candidate's host is busy, or a sentinel when there is nothing left to do
+    def take(self, queue):
+        candidates = [queue]
+        if not queue and self.policy == 'balanced':
+            candidates = sorted((q for q in self.queues if q), key=lambda q: -sum(map(file_size_of, q)))
+        if not any(candidates):
+            return None if self.feeding else self.DONE
+        for candidate in candidates:
+            order = reversed(range(len(candidate))) if candidate is not queue else range(len(candidate))
+            for index in order:
+                host = host_of(candidate[index])
+                key = content_key(candidate[index])
+                if self.host_active.get(host, 0) < self.per_host_concurrency and key not in self.content_active:
+                    file = candidate[index]
+                    del candidate[index]
+                    self.host_active[host] = self.host_active.get(host, 0) + 1
+                    if key is not None:
+                        self.content_active.add(key)
+                    self.in_flight += 1
+                    return file
+        return None
+
+    async def worker(self, queue):
+        while True:
+            async with self.condition:
+                file = await self.condition.wait_for(lambda: self.take(queue))
+            if file is self.DONE:
+                return
+            status = None
+            try:
+                status = await asyncio.to_thread(self.download, file)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error downloading {file.get('file_name')}: {e}")
+            async with self.condition:
+                self.host_active[host_of(file)] -= 1
+                self.content_active.discard(content_key(file))
+                self.in_flight -= 1
+                key = (file.get('study_id'), file.get('file_id'))
+                if status == 'checksum_mismatch' and self.requeues.get(key, 0) < CHECKSUM_REQUEUES:
+                    self.requeues[key] = self.requeues.get(key, 0) + 1
+                    downloader.DOWNLOAD_RETRIES.labels(kind='checksum_requeue').inc()
+                    queue.append(file)
+                else:
+                    self.completed += 1
+                if status == 'completed' and self.first_download is None:
+                    self.first_download = time.monotonic() - self.start
+                self.condition.notify_all()
+
+    def queued(self):
+        return sum(len(q) for q in {id(q): q for q in self.queues}.values())
+
+    # Append (seconds, queued, in flight, completed, bytes, MB/s since the previous sample) to the timeline,
+    # and publish the queue depth and rate as Prometheus gauges
+    def sample(self, start):
+        now = time.monotonic()
+        total = self.limiter.total_bytes
+        last_time, last_bytes = start, 0
+        if self.timeline:
+            last_time, last_bytes = start + self.timeline[-1][0], self.timeline[-1][4]
+        rate = (total - last_bytes) / max(now - last_time, 1e-9) / 1e6
+        self.timeline.append((now - start, self.queued(), self.in_flight, self.completed, total, rate))
+        downloader.DOWNLOADS_QUEUED.set(self.queued())
+        downloader.DOWNLOAD_RATE.set(rate * 1e6)
+
+    async def sampler(self, start):
+        while True:
+            await asyncio.sleep(self.sample_interval)
+            self.sample(start)
+
+    # Download every file in a list; returns a summary dict (the timeline is also kept on self.timeline)
+    async def run(self, files):
+        return await self.execute(self.build_queues(files), None)
+
+    # Download files as they arrive from a (blocking) iterable, which is consumed on its own thread
+    async def run_stream(self, records):
+        if self.policy == 'balanced':
+            queues = [deque() for _ in range(self.max_concurrency)]
+        else:
+            queues = [deque()] * self.max_concurrency
+        self.loads = [(0, index) for index in range(self.max_concurrency)]
+        return await self.execute(queues, records)
+
+    # Producer thread: push records into the bounded asyncio queue, blocking while it is full
+    def produce(self, records, feed, loop):
+        try:
+            for file in records:
+                asyncio.run_coroutine_threadsafe(feed.put(file), loop).result()
+        except Exception as e:
+            self.feed_error = e
+        finally:
+            asyncio.run_coroutine_threadsafe(feed.put(self.DONE), loop).result()
+
+    async def consume(self, feed):
+        while True:
+            file = await feed.get()
+            async with self.condition:
+                if file is self.DONE:
+                    self.feeding = False
+                else:
+                    self.add_file(file)
+                    self.total_files += 1
+                self.condition.notify_all()
+            if file is self.DONE:
+                return
+
+    async def execute(self, queues, records):
+        self.queues = queues
+        self.feeding = records is not None
+        self.feed_error = None
+        self.total_files = 0 if records is not None else self.queued()
+        self.first_download = None
+        self.host_active = {}
+        self.content_active = set()
+        self.requeues = {}
+        self.in_flight = self.completed = self.errors = 0
+        self.condition = asyncio.Condition()
+        self.timeline = []
+
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.max_concurrency))
+        previous_limiter = downloader.bandwidth_limiter
+        downloader.bandwidth_limiter = self.limiter
+        start = self.start = time.monotonic()
+        sampler = asyncio.create_task(self.sampler(start))
+        tasks = [self.worker(queue) for queue in self.queues]
+        if records is not None:
+            feed = asyncio.Queue(maxsize=self.feed_queue_size)
+            threading.Thread(target=self.produce, args=(records, feed, loop), name='download-feed', daemon=True).start()
+            tasks.append(self.consume(feed))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            sampler.cancel()
+            downloader.bandwidth_limiter = previous_limiter
+        if self.feed_error is not None:
+            raise self.feed_error
+        self.sample(start)
+        downloader.DOWNLOAD_RATE.set(0)
+        elapsed = time.monotonic() - start
+        return {'policy': self.policy, 'files': self.total_files, 'errors': self.errors, 'requeued': sum(self.requeues.values()),
+                'first_download_seconds': self.first_download, 'seconds': elapsed,
+                'bytes': self.limiter.total_bytes, 'mb_per_sec': self.limiter.total_bytes / max(elapsed, 1e-9) / 1e6}
+
+
+# Synchronous entry point, e.g. for a background thread
+def schedule_downloads(files, **kwargs):
+    scheduler = DownloadScheduler(**kwargs)
+    summary = asyncio.run(scheduler.run(files))
+    return summary, scheduler.timeline
+
+# Same for a stream of file records, e.g. a generator over the catalog crawl
+def schedule_stream(records, **kwargs):
+    scheduler = DownloadScheduler(**kwargs)
+    summary = asyncio.run(scheduler.run_stream(records))
+    return summary, scheduler.timeline
+
+def format_timeline(timeline):
+    lines = [f"{'seconds':>8} {'queued':>7} {'in_flight':>10} {'completed':>10} {'MB':>10} {'MB/s':>8}"]
+    for elapsed, queued, in_flight, completed, total, rate in timeline:
+        lines.append(f"{elapsed:>8.1f} {queued:>7} {in_flight:>10} {completed:>10} {total / 1e6:>10.1f} {rate:>8.1f}")
+    return "\n".join(lines)
@@ -0,0 +1,270 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import zlib
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency, only needed for the columnar export
+    pa = None
+
+'''
+columnar export of file_metadata_database.db and download_progress.db for analytics
+writes each table as hive-partitioned Parquet
+  - catalog:  files joined with study_files, one partition per study_id (study_id=<id>/part-0.parquet);
+              a file listed by several study versions appears in each, files without a study
+              (CSV imports) go to the null partition
+  - progress: download_progress, one partition per status
+low-cardinality strings (study, status, extension, owner) are stored as Arrow dictionary columns and every
+string column is dictionary-encoded in Parquet where that pays off.
+exports are incremental: a per-partition row count and checksum computed inside SQLite is compared with
+manifest.json from the previous export, and only partitions that changed are rewritten (or removed).
+after each export <table>.arrow holds the whole table as an uncompressed Arrow IPC file, which load_table()
+memory-maps, so loading the full catalog costs a page-in rather than a parse
+'''
+
+EXPORT_DIR = 'export'
+CATALOG_DB = 'file_metadata_database.db'
+PROGRESS_DB = 'download_progress.db'
+MANIFEST = 'manifest.json'
+
+# Rows fetched from SQLite per Arrow record batch (and Parquet row group)
+EXPORT_BATCH_ROWS = 100_000
+
+# String columns stored as Arrow dictionaries
+DICTIONARY_COLUMNS = {'study_id', 'pdc_study_id', 'status', 'extension', 'owner'}
+
+# Arrow type per declared SQLite column type
+ARROW_TYPES = {'INTEGER': 'int64', 'REAL': 'float64', 'TEXT': 'string'}
+
+# Directory name hive partitioning uses for a NULL partition value
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# Exported tables: source database, SQLite table(s) the columns come from, partition column,
+# exported columns (partition column excluded), FROM clause and sort order within a partition
+TABLES = {
+    'catalog': {
+        'db': CATALOG_DB,
+        'partition': 'study_id',
+        'columns': ['file_id', 'file_name', 'extension', 'file_size', 'md5sum', 'signedUrl'],
+        'types_from': ['files', 'study_files'],
+        'source': 'files LEFT JOIN study_files ON study_files.file_id = files.file_id',
+        'qualify': {'file_id': 'files.file_id', 'study_id': 'study_files.study_id'},
+        'order': 'files.file_size, files.file_id',
+    },
+    'progress': {
+        'db': PROGRESS_DB,
+        'partition': 'status',
+        'columns': None,  # every column of download_progress
+        'types_from': ['download_progress'],
+        'source': 'download_progress',
+        'qualify': {},
+        'order': 'unique_id',
+    },
+}
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("the Parquet/Arrow export needs pyarrow installed")
+
+# SQL for the CRC-32 of a row: its values joined with a unit separator (NULL written as a record separator,
+# so it differs from ''). Summed per partition, any changed value changes the partition's checksum
+def row_checksum_sql(expressions):
+    joined = ' || char(31) || '.join(f'IFNULL({expression}, char(30))' for expression in expressions)
+    return f'row_checksum(CAST({joined} AS BLOB))'
+
+# {column: declared SQLite type} of the given tables (later tables do not override earlier ones)
+def declared_types(conn, tables):
+    types = {}
+    for table in tables:
+        for row in conn.execute(f'PRAGMA table_xinfo({table})'):
+            types.setdefault(row[1], row[2].upper() or 'TEXT')
+    return types
+
+def arrow_type(column, declared):
+    if column in DICTIONARY_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    return getattr(pa, ARROW_TYPES.get(declared, 'string'))()
+
+# Exported columns and Arrow schema of a table as the database currently has it
+def table_layout(conn, spec):
+    types = declared_types(conn, spec['types_from'])
+    columns = [column for column in spec['columns'] or types if column in types and column != spec['partition']]
+    schema = pa.schema([(column, arrow_type(column, types[column])) for column in columns])
+    return columns, schema
+
+def partition_dir_name(column, value):
+    return f"{column}={NULL_PARTITION if value in (None, '') else quote(str(value), safe='')}"
+
+# {partition directory name: (partition value, rows, checksum)} for every partition in the database
+def partition_fingerprints(conn, spec, columns):
+    conn.create_function('row_checksum', 1, zlib.crc32, deterministic=True)
+    qualify = spec['qualify']
+    partition = qualify.get(spec['partition'], spec['partition'])
+    checksum_sql = row_checksum_sql([qualify.get(column, column) for column in columns])
+    fingerprints = {}
+    for value, rows, checksum in conn.execute(f'''
+        SELECT {partition}, COUNT(*), SUM({checksum_sql})
+        FROM {spec['source']} GROUP BY 1
+    '''):
+        name = partition_dir_name(spec['partition'], value)
+        previous = fingerprints.get(name, (value, 0, 0))  # NULL and '' share the null partition
+        fingerprints[name] = (value, previous[1] + rows, previous[2] + checksum)
+    return fingerprints
+
+# Stream one partition into a Parquet file, one row group per EXPORT_BATCH_ROWS rows. Written to a temporary
+# file and renamed into place, so readers never see a half-written partition
+def write_partition(conn, spec, columns, schema, value, path, batch_rows=EXPORT_BATCH_ROWS):
+    qualify = spec['qualify']
+    partition = qualify.get(spec['partition'], spec['partition'])
+    if value in (None, ''):
+        where, params = f"({partition} IS NULL OR {partition} = '')", ()
+    else:
+        where, params = f'{partition} = ?', (value,)
+    cursor = conn.execute(f'''
+        SELECT {', '.join(qualify.get(column, column) for column in columns)}
+        FROM {spec['source']} WHERE {where} ORDER BY {spec['order']}
+    ''', params)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')  # hidden from dataset discovery
+    os.close(fd)
+    try:
+        with pq.ParquetWriter(tmp_path, schema, use_dictionary=True, compression='zstd') as writer:
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def read_manifest(export_dir):
+    try:
+        with open(os.path.join(export_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(export_dir, manifest):
+    fd, tmp_path = tempfile.mkstemp(dir=export_dir, prefix='.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(export_dir, MANIFEST))
+
+# The Parquet partitions of an exported table as a pyarrow dataset; filters on the partition column
+# read only the matching partitions
+def open_dataset(export_dir, table):
+    require_pyarrow()
+    partitioning = ds.partitioning(pa.schema([(TABLES[table]['partition'], pa.string())]), flavor='hive')
+    return ds.dataset(os.path.join(export_dir, table), format='parquet', partitioning=partitioning)
+
+# Read (a filtered subset of) an exported table from its Parquet partitions into one table whose dictionary
+# columns, the partition column included, share one dictionary each, as Arrow compute and group_by expect,
+# e.g. read_partitions('export', 'progress', filter=ds.field('status') == 'failed')
+def read_partitions(export_dir, table, columns=None, filter=None):
+    data = open_dataset(export_dir, table).to_table(columns=columns, filter=filter)
+    column = TABLES[table]['partition']
+    if column in data.column_names:
+        data = data.set_column(data.schema.get_field_index(column), column,
+                               pc.dictionary_encode(data.column(column).combine_chunks()))
+    return data.unify_dictionaries()
+
+# Rewrite <table>.arrow from the Parquet partitions: one uncompressed Arrow IPC file that can be memory-mapped as is
+def write_snapshot(export_dir, table):
+    data = read_partitions(export_dir, table)
+    fd, tmp_path = tempfile.mkstemp(dir=export_dir, prefix='.', suffix='.tmp')
+    os.close(fd)
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, data.schema) as writer:
+        writer.write_table(data, max_chunksize=EXPORT_BATCH_ROWS)
+    os.replace(tmp_path, os.path.join(export_dir, f'{table}.arrow'))
+    return data.num_rows
+
+# Load an exported table from its memory-mapped Arrow snapshot. Column buffers point into the page cache,
+# so only the pages a computation touches are read and the same file is shared by every process that maps it
+def load_table(export_dir, table):
+    require_pyarrow()
+    return pa.ipc.open_file(pa.memory_map(os.path.join(export_dir, f'{table}.arrow'))).read_all()
+
+# Export one table incrementally; returns counts of partitions written, unchanged and removed.
+# A changed column list (e.g. a download_progress schema upgrade) rewrites every partition
+def export_table(conn, export_dir, table, full=False, batch_rows=EXPORT_BATCH_ROWS):
+    require_pyarrow()
+    spec = TABLES[table]
+    columns, schema = table_layout(conn, spec)
+    manifest = read_manifest(export_dir)
+    previous = manifest.get(table, {})
+    if previous.get('columns') != columns:
+        full = True
+    old = {} if full else previous.get('partitions', {})
+    table_dir = os.path.join(export_dir, table)
+
+    stats = {'written': 0, 'unchanged': 0, 'removed': 0, 'rows': 0}
+    partitions = {}
+    for name, (value, rows, checksum) in partition_fingerprints(conn, spec, columns).items():
+        partitions[name] = {'rows': rows, 'checksum': checksum}
+        stats['rows'] += rows
+        path = os.path.join(table_dir, name, 'part-0.parquet')
+        if old.get(name) == partitions[name] and os.path.exists(path):
+            stats['unchanged'] += 1
+            continue
+        write_partition(conn, spec, columns, schema, value, path, batch_rows=batch_rows)
+        stats['written'] += 1
+    if os.path.isdir(table_dir):
+        for name in os.listdir(table_dir):
+            if name not in partitions:
+                shutil.rmtree(os.path.join(table_dir, name))
+                stats['removed'] += 1
+
+    snapshot = os.path.join(export_dir, f'{table}.arrow')
+    if stats['written'] or stats['removed'] or not os.path.exists(snapshot):
+        write_snapshot(export_dir, table)
+    manifest[table] = {'columns': columns, 'partitions': partitions, 'exported_at': time.time()}
+    write_manifest(export_dir, manifest)
+    return stats
+
+# Export every table whose database exists; returns {table: stats}
+def export_all(export_dir=EXPORT_DIR, databases=None, full=False, batch_rows=EXPORT_BATCH_ROWS):
+    os.makedirs(export_dir, exist_ok=True)
+    results = {}
+    for table, spec in TABLES.items():
+        db_file = (databases or {}).get(table, spec['db'])
+        if not os.path.exists(db_file):
+            continue
+        conn = sqlite3.connect(f"file:{quote(os.path.abspath(db_file))}?mode=ro", uri=True)
+        try:
+            start = time.time()
+            results[table] = export_table(conn, export_dir, table, full=full, batch_rows=batch_rows)
+            results[table]['seconds'] = time.time() - start
+        finally:
+            conn.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the file catalog and download progress to partitioned Parquet")
+    parser.add_argument("--out", default=EXPORT_DIR, help="export directory")
+    parser.add_argument("--catalog-db", default=CATALOG_DB)
+    parser.add_argument("--progress-db", default=PROGRESS_DB)
+    parser.add_argument("--full", action="store_true", help="rewrite every partition, even unchanged ones")
+    parser.add_argument("--batch-rows", type=int, default=EXPORT_BATCH_ROWS, help="rows per Parquet row group")
+    args = parser.parse_args()
+
+    results = export_all(args.out, {'catalog': args.catalog_db, 'progress': args.progress_db},
+                         full=args.full, batch_rows=args.batch_rows)
+    if not results:
+        print("Nothing to export: neither database exists")
+    for table, stats in results.items():
+        print(f"{table}: {stats['rows']} rows, {stats['written']} partitions written, {stats['unchanged']} unchanged, "
+              f"{stats['removed']} removed in {stats['seconds']:.2f}s")
@@ -1,14 +1,53 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+import argparse
 import json
-import csv
 import hashlib
 import os
+import sqlite3
+import time
+
+from create_DB_sqlite3 import DB_FILE, stream_into_db, export_sorted_csv
 
 # PDC API endpoint
 url = "https://pdc.cancer.gov/graphql"
 
+# Crawl settings: number of studies fetched concurrently and retry policy per request
+MAX_WORKERS = 8
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 0.5
+REQUEST_TIMEOUT = 60
+
+# Batched crawl settings: studies packed into one aliased GraphQL document.
+# The batch size adapts between 1 and MAX_BATCH_SIZE, aiming for responses of about TARGET_RESPONSE_BYTES
+BATCH_SIZE = 10
+MAX_BATCH_SIZE = 50
+TARGET_RESPONSE_BYTES = 4 * 1024 * 1024
+
+# Fields selected for every file returned by filesPerStudy
+FILE_FIELDS = ['file_id', 'file_name', 'file_size', 'md5sum', 'signedUrl { url }']
+
+# Build a keep-alive session whose connection pool is large enough for every worker,
+# retrying transient server errors with exponential backoff
+def make_session(pool_size=MAX_WORKERS, max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR):
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "POST"],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 # Step 1: Function to fetch studies with version information
-def fetch_study_catalog(acceptDUA):
+def fetch_study_catalog(acceptDUA, session=None):
     query = f"""
     {{
         studyCatalog(acceptDUA: {str(acceptDUA).lower()}) {{
@@ -20,23 +59,21 @@ def fetch_study_catalog(acceptDUA):
         }}
     }}
     """
-    response = requests.get(url, params={"query": query})
+    response = (session or requests).get(url, params={"query": query}, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
     return response.json()['data']['studyCatalog']
 
-# Step 2: Fetch study catalog with version information
-acceptDUA = True  # Set to True or False based on whether you accept DUA
-study_catalog = fetch_study_catalog(acceptDUA)
-
-# Step 3: Process the studies with version information
-study_id_list = []
-for study in study_catalog:
-    pdc_study_id = study['pdc_study_id']
-    for version in study['versions']:
-        study_id_list.append(version['study_id'])
-#print(study_id_list)
+# Step 2: Process the studies with version information
+def get_study_id_list(study_catalog):
+    study_id_list = []
+    for study in study_catalog:
+        pdc_study_id = study['pdc_study_id']
+        for version in study['versions']:
+            study_id_list.append(version['study_id'])
+    return study_id_list
 
 # Fetch files per study_id
-def fetch_files_per_study(study_id):
+def fetch_files_per_study(study_id, session=None):
     query = f"""
     {{
         filesPerStudy(study_id: "{study_id}") {{
@@ -50,32 +87,179 @@ def fetch_files_per_study(study_id):
         }}
     }}
     """
-    response = requests.get(url, params={"query": query})
+    response = (session or requests).get(url, params={"query": query}, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
     return response.json()['data']['filesPerStudy']
 
+# Build one GraphQL document selecting filesPerStudy for several studies, aliased s0, s1, ...
+def build_batch_query(study_ids, fields=FILE_FIELDS):
+    selection = " ".join(fields)
+    parts = [f's{i}: filesPerStudy(study_id: "{study_id}") {{ {selection} }}' for i, study_id in enumerate(study_ids)]
+    return "{ " + " ".join(parts) + " }"
+
+# Send one batched query and split the response back out per study.
+# Returns ({study_id: files}, [study_ids whose alias errored], response size in bytes)
+def fetch_files_batch(study_ids, session=None, fields=FILE_FIELDS, endpoint=None):
+    query = build_batch_query(study_ids, fields)
+    response = (session or requests).get(endpoint or url, params={"query": query}, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    payload = response.json()
+    data = payload.get('data') or {}
+
+    errored_aliases = set()
+    for error in payload.get('errors') or []:
+        path = error.get('path') or []
+        if path:
+            errored_aliases.add(path[0])
+
+    files_by_study = {}
+    failed = []
+    for i, study_id in enumerate(study_ids):
+        alias = f"s{i}"
+        files = data.get(alias)
+        if alias in errored_aliases or files is None:
+            failed.append(study_id)
+        else:
+            files_by_study[study_id] = files
+    return files_by_study, failed, len(response.content)
+
+# Batch size controller: grows while responses stay small, shrinks when they get large or the server errors
+class AdaptiveBatchSize:
+    def __init__(self, initial=BATCH_SIZE, maximum=MAX_BATCH_SIZE, target_bytes=TARGET_RESPONSE_BYTES):
+        self.maximum = maximum
+        self.target_bytes = target_bytes
+        self.size = max(1, min(initial, maximum))
+
+    def on_success(self, batch_len, response_bytes):
+        if response_bytes > self.target_bytes:
+            # scale down to the batch that would have fit the target
+            per_study = response_bytes / max(batch_len, 1)
+            self.size = max(1, int(self.target_bytes // per_study))
+        elif response_bytes < self.target_bytes / 2 and batch_len >= self.size:
+            self.size = min(self.maximum, self.size + max(1, self.size // 2))
+
+    def on_error(self):
+        self.size = max(1, self.size // 2)
+
+# Fetch files for many studies using aliased batch queries, with up to max_workers batches in flight.
+# A study whose alias errors is retried on its own; a batch the server rejects is split in half and re-queued.
+# Returns {study_id: files}
+def fetch_files_batched(study_ids, batch_size=BATCH_SIZE, max_workers=1, session=None, fields=FILE_FIELDS,
+                        endpoint=None, max_attempts=MAX_RETRIES):
+    session = session or make_session(pool_size=max(max_workers, 1))
+    controller = AdaptiveBatchSize(initial=batch_size)
+    pending = deque((study_id, 0) for study_id in dict.fromkeys(study_ids))
+    files_by_study = {}
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        in_flight = {}
+        while pending or in_flight:
+            while pending and len(in_flight) < max(max_workers, 1):
+                # studies being retried are always sent alone
+                if pending[0][1] > 0:
+                    batch = [pending.popleft()]
+                else:
+                    batch = []
+                    while pending and pending[0][1] == 0 and len(batch) < controller.size:
+                        batch.append(pending.popleft())
+                future = executor.submit(fetch_files_batch, [study_id for study_id, _ in batch], session, fields, endpoint)
+                in_flight[future] = batch
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                attempts = dict(batch)
+                try:
+                    fetched, failed, response_bytes = future.result()
+                except (requests.RequestException, ValueError) as e:
+                    if len(batch) == 1 and batch[0][1] + 1 >= max_attempts:
+                        raise
+                    print(f"Batch of {len(batch)} studies failed ({e}); shrinking batch size")
+                    controller.on_error()
+                    if len(batch) == 1:
+                        pending.appendleft((batch[0][0], batch[0][1] + 1))
+                    else:
+                        pending.extendleft(reversed(batch))
+                    continue
+
+                controller.on_success(len(batch), response_bytes)
+                files_by_study.update(fetched)
+                for study_id in failed:
+                    if attempts[study_id] + 1 >= max_attempts:
+                        raise RuntimeError(f"filesPerStudy failed for {study_id} after {max_attempts} attempts")
+                    pending.append((study_id, attempts[study_id] + 1))
+
+    return files_by_study
+
+# Fetch study_ids window by window and yield (study_id, files) in study_ids order.
+# With max_workers > 1 the studies are fetched concurrently over one pooled session;
+# with batch_size > 1 several studies share one aliased GraphQL round trip, requesting `fields`
+# from `endpoint` (the unbatched path uses fetch_files_per_study's fields and url).
+# Only one window of results is held in memory at a time
+def iter_study_files(study_ids, max_workers=1, session=None, batch_size=1, window=None, fields=FILE_FIELDS, endpoint=None):
+    session = session or make_session(pool_size=max(max_workers, 1))
+    window = window or max(max_workers, 1) * max(batch_size, 1) * 4
+
+    def fetch(study_id):
+        return fetch_files_per_study(study_id, session=session)
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        for i in range(0, len(study_ids), window):
+            chunk = study_ids[i:i + window]
+            if batch_size > 1:
+                files_by_study = fetch_files_batched(chunk, batch_size=batch_size, max_workers=max_workers, session=session,
+                                                     fields=fields, endpoint=endpoint)
+                results = (files_by_study[study_id] for study_id in chunk)
+            elif max_workers <= 1:
+                results = map(fetch, chunk)
+            else:
+                results = executor.map(fetch, chunk)
+            for study_id, files in zip(chunk, results):
+                print(study_id, len(files))
+                yield study_id, files
+
+# Stream individual file records as (study_id, file) pairs without building the full list
+def iter_file_records(study_ids, max_workers=1, session=None, batch_size=1):
+    for study_id, files in iter_study_files(study_ids, max_workers=max_workers, session=session, batch_size=batch_size):
+        for file in files:
+            yield study_id, file
+
 # Loop over each study_id and fetch file information - time consuming step
-def get_all_files_from_studies(study_ids):
+# Results are returned in study_ids order, same as the sequential crawl
+def get_all_files_from_studies(study_ids, max_workers=1, session=None, batch_size=1):
     all_files = []
-    for study_id in study_ids:
-        files = fetch_files_per_study(study_id)
-        print(study_id, len(files))
+    for study_id, files in iter_study_files(study_ids, max_workers=max_workers, session=session, batch_size=batch_size):
         all_files.extend(files)
-        
     return all_files
 
-# List all files from studies
-all_files = get_all_files_from_studies(study_id_list)
 
-files_sorted = sorted(all_files, key=lambda x: int(x['file_size']))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch PDC file metadata for every study version")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="number of studies fetched concurrently (1 = sequential)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="initial number of studies per aliased GraphQL query (1 = one query per study)")
+    parser.add_argument("--db", default=DB_FILE, help="SQLite database the file records are streamed into")
+    parser.add_argument("--csv", default=None, help="also export the catalog, sorted by file size, to this CSV file")
+    args = parser.parse_args()
 
-csv_all_sorted_files = "all_files_sorted.csv"
+    session = make_session(pool_size=max(args.workers, 1))
 
-with open(csv_all_sorted_files, mode='w', newline='') as csv_file:
-    fieldnames = ['file_id', 'file_name', 'file_size', 'md5sum', 'signedUrl']
-    writer = csv.DictWriter(csv_file, fieldnames = fieldnames)
-    writer.writeheader()
-    for file_data in files_sorted:
-        writer.writerow(file_data)
+    # Fetch study catalog with version information
+    acceptDUA = True  # Set to True or False based on whether you accept DUA
+    study_catalog = fetch_study_catalog(acceptDUA, session=session)
+    study_id_list = get_study_id_list(study_catalog)
+
+    # Stream all files from studies straight into SQLite
+    start = time.time()
+    conn = sqlite3.connect(args.db)
+    records = iter_file_records(study_id_list, max_workers=args.workers, session=session, batch_size=args.batch_size)
+    row_count = stream_into_db(conn, records)
+    elapsed = time.time() - start
+    print(f"Loaded {row_count} files from {len(study_id_list)} studies into {args.db} in {elapsed:.1f}s")
+
+    if args.csv:
+        export_sorted_csv(conn, args.csv)
+        print(f"Exported catalog to {args.csv}")
+    conn.close()
 
 '''
 smallest_files = files_sorted[:100]
@@ -0,0 +1,284 @@
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+'''
+local stand-ins for the PDC GraphQL endpoint and the signed-URL file host, used by the benchmark scripts
+the GraphQL server answers studyCatalog and (aliased) filesPerStudy queries from a synthetic catalog,
+with a configurable per-request latency to mimic the round trip to pdc.cancer.gov.
+the file server serves synthetic file contents with Range support, latency and a per-connection bandwidth cap,
+and with url_ttl signs its URLs with an Expires time after which it answers 403, like an expired S3 signature.
+for failure injection it answers a fraction of requests with 503 (error_rate) and cuts a fraction of
+transfers off halfway through the body (drop_rate)
+'''
+
+FILE_PATTERN = re.compile(r'^/files/([^/?]+)')
+RANGE_PATTERN = re.compile(r'bytes=(\d+)-(\d*)$')
+
+# Synthetic file contents are windows onto one shared random block, offset per file name
+CONTENT_BLOCK = random.Random(0).randbytes(1024 * 1024)
+SEND_CHUNK = 64 * 1024
+
+STUDY_CATALOG_PATTERN = re.compile(r'studyCatalog\s*\(')
+FILES_PER_STUDY_PATTERN = re.compile(r'(?:(\w+)\s*:\s*)?filesPerStudy\s*\(\s*study_id:\s*"([^"]+)"\s*\)')
+
+
+# Build a deterministic synthetic catalog: {pdc_study_id: [study_id, ...]} and {study_id: [file, ...]}.
+# File names cycle through `extensions`, one file per extension for each fraction number
+def make_synthetic_catalog(num_studies=200, versions_per_study=2, files_per_study=50, seed=0, extensions=('raw',)):
+    rng = random.Random(seed)
+    studies = {}
+    files = {}
+    for s in range(num_studies):
+        pdc_study_id = f"PDC{s:06d}"
+        studies[pdc_study_id] = []
+        # later versions of a study re-list the same files and add one new file each
+        base_files = [
+            {
+                'file_id': f"file-{s:04d}-{f:05d}",
+                'file_name': f"{pdc_study_id}_f{f // len(extensions):02d}.{extensions[f % len(extensions)]}",
+                'file_size': str(rng.randint(1_000, 5_000_000_000)),
+                'md5sum': f"{rng.getrandbits(128):032x}",
+            }
+            for f in range(files_per_study + versions_per_study)
+        ]
+        for v in range(versions_per_study):
+            study_id = f"study-{s:04d}-v{v}"
+            studies[pdc_study_id].append(study_id)
+            files[study_id] = [
+                dict(file, study_id=study_id, pdc_study_id=pdc_study_id,
+                     signedUrl={'url': f"https://example.invalid/{study_id}/{file['file_id']}"})
+                for file in base_files[:files_per_study + v]
+            ]
+    return studies, files
+
+
+class PDCHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlparse(self.path).query).get("query", [""])[0]
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.request_count += 1
+
+        if STUDY_CATALOG_PATTERN.search(query):
+            catalog = [
+                {'pdc_study_id': pdc_study_id, 'versions': [{'study_id': study_id} for study_id in versions]}
+                for pdc_study_id, versions in server.studies.items()
+            ]
+            self.send_json({'data': {'studyCatalog': catalog}})
+            return
+
+        # one or more (optionally aliased) filesPerStudy selections; with alias_error_rate > 0
+        # some aliased selections fail with a field-level error, like a partial GraphQL response
+        matches = FILES_PER_STUDY_PATTERN.findall(query)
+        if matches:
+            data = {}
+            errors = []
+            for alias, study_id in matches:
+                key = alias or 'filesPerStudy'
+                if alias and server.alias_error_rate and server.rng.random() < server.alias_error_rate:
+                    data[key] = None
+                    errors.append({'message': f'internal error resolving {study_id}', 'path': [key]})
+                else:
+                    data[key] = server.files.get(study_id, [])
+                    if server.sign_url is not None:
+                        data[key] = [dict(file, signedUrl={'url': server.sign_url(file)}) for file in data[key]]
+            payload = {'data': data}
+            if errors:
+                payload['errors'] = errors
+            self.send_json(payload)
+            return
+
+        self.send_json({'errors': [{'message': 'unsupported query'}]}, status=400)
+
+
+# Bytes [start, end) of a synthetic file's contents
+def synthetic_content(file_name, start, end):
+    block_size = len(CONTENT_BLOCK)
+    shift = int(hashlib.md5(file_name.encode()).hexdigest(), 16) % block_size
+    out = bytearray()
+    position = start
+    while position < end:
+        index = (position + shift) % block_size
+        take = min(block_size - index, end - position)
+        out += CONTENT_BLOCK[index:index + take]
+        position += take
+    return bytes(out)
+
+def synthetic_md5(file_name, size):
+    md5_hash = hashlib.md5()
+    for start in range(0, size, len(CONTENT_BLOCK)):
+        md5_hash.update(synthetic_content(file_name, start, min(start + len(CONTENT_BLOCK), size)))
+    return md5_hash.hexdigest()
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        match = FILE_PATTERN.match(self.path)
+        size = server.sizes.get(match.group(1)) if match else None
+        if size is None:
+            self.send_error(404)
+            return
+        expires = parse_qs(urlparse(self.path).query).get('Expires')
+        if server.url_ttl and (not expires or float(expires[0]) < time.time()):
+            with server.lock:
+                server.expired_count += 1
+            self.send_error(403, 'Request has expired')
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.request_count += 1
+            server.file_requests[match.group(1)] = server.file_requests.get(match.group(1), 0) + 1
+            fail = server.error_rate and server.rng.random() < server.error_rate
+            drop = not fail and server.drop_rate and server.rng.random() < server.drop_rate
+            server.error_count += bool(fail)
+            server.drop_count += bool(drop)
+        if fail:
+            self.send_error(503, 'Injected failure')
+            return
+
+        start, end = 0, size
+        range_match = RANGE_PATTERN.match(self.headers.get('Range', ''))
+        if range_match and server.supports_range:
+            start = int(range_match.group(1))
+            end = min(int(range_match.group(2)) + 1, size) if range_match.group(2) else size
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+
+        # pace the body so one connection never exceeds bandwidth_bps; a dropped transfer stops halfway
+        began = time.monotonic()
+        sent = 0
+        stop = start + (end - start) // 2 if drop else end
+        for position in range(start, end, SEND_CHUNK):
+            if position >= stop:
+                self.close_connection = True
+                return
+            chunk = synthetic_content(match.group(1), position, min(position + SEND_CHUNK, end))
+            self.wfile.write(chunk)
+            sent += len(chunk)
+            if server.bandwidth_bps:
+                delay = sent / server.bandwidth_bps - (time.monotonic() - began)
+                if delay > 0:
+                    time.sleep(delay)
+
+
+# Start the stand-in server on a background thread and return it; server.url is the GraphQL endpoint.
+# sign_url(file), if given, produces the signedUrl returned for each file at query time
+def start_server(studies, files, latency=0.0, alias_error_rate=0.0, sign_url=None, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), PDCHandler)
+    server.daemon_threads = True
+    server.studies = studies
+    server.files = files
+    server.latency = latency
+    server.alias_error_rate = alias_error_rate
+    server.sign_url = sign_url
+    server.rng = random.Random(1)
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.url = f"http://{host}:{server.server_address[1]}/graphql"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Clients abandoning a transfer (killed workers, failed downloads) are expected, so do not print their tracebacks
+class FileHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+# Start a synthetic file server for {file_name: size}; server.url is its base URL and
+# server.catalog lists the files as filesPerStudy records whose signedUrl points at this server.
+# With url_ttl, URLs carry an Expires time url_ttl seconds ahead and server.sign(file_name) makes a fresh one.
+# error_rate and drop_rate are the fractions of requests failed with 503 and of transfers cut off halfway
+def start_file_server(sizes, latency=0.0, bandwidth_bps=None, supports_range=True, study_id="study-bench",
+                      url_ttl=None, error_rate=0.0, drop_rate=0.0, seed=0, host="127.0.0.1", port=0):
+    server = FileHTTPServer((host, port), FileHandler)
+    server.daemon_threads = True
+    server.sizes = dict(sizes)
+    server.latency = latency
+    server.bandwidth_bps = bandwidth_bps
+    server.supports_range = supports_range
+    server.url_ttl = url_ttl
+    server.error_rate = error_rate
+    server.drop_rate = drop_rate
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.expired_count = 0
+    server.error_count = 0
+    server.drop_count = 0
+    server.file_requests = {}
+    server.url = f"http://{host}:{server.server_address[1]}"
+    server.sign = lambda file_name: f"{server.url}/files/{file_name}" + (
+        f"?Expires={time.time() + url_ttl:.0f}" if url_ttl else "")
+    server.catalog = [
+        {'study_id': study_id, 'pdc_study_id': 'PDC-bench', 'file_id': file_name, 'file_name': file_name,
+         'file_size': str(size), 'md5sum': synthetic_md5(file_name, size),
+         'signedUrl': {'url': server.sign(file_name)}}
+        for file_name, size in server.sizes.items()
+    ]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Group the files of one or more file servers into study versions of files_per_study files each, as
+# ({pdc_study_id: [study_id, ...]}, {study_id: [file, ...]}) for start_server, so the download list
+# can be crawled from the GraphQL stand-in like the real one
+def catalog_for_file_servers(servers, files_per_study, pdc_study_id='PDC-bench'):
+    files = {}
+    for i, file in enumerate(file for server in servers for file in server.catalog):
+        study_id = f"study-bench-{i // files_per_study:04d}"
+        files.setdefault(study_id, []).append(dict(file, study_id=study_id, pdc_study_id=pdc_study_id))
+    return {pdc_study_id: list(files)}, files
+
+
+if __name__ == "__main__":
+    studies, files = make_synthetic_catalog()
+    server = start_server(studies, files, latency=0.05, port=8765)
+    print(f"Serving synthetic PDC catalog at {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,104 @@
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime, timezone
+
+from prometheus_client import Counter
+
+'''
+just-in-time signed URL broker for download_files_with_progress_DB.py
+signed URLs captured when the catalog was crawled (or stored in files.signedUrl) expire, so files near
+the back of a long queue would fail. the broker tracks when each file's URL expires, read from the URL
+itself (X-Amz-Date + X-Amz-Expires, or Expires) or assumed SIGNED_URL_TTL after it was first seen.
+a file whose URL expires within REFRESH_MARGIN seconds of being dispatched gets a fresh one: the
+whole study is re-fetched in one query, renewing every URL of that study at once.
+a download that fails because its URL expired anyway is retried right away with a refreshed URL
+'''
+
+# Lifetime assumed for a URL that does not say when it expires, counted from when the broker first saw it
+SIGNED_URL_TTL = 60 * 60
+
+# URLs expiring within this many seconds are refreshed before the download starts
+REFRESH_MARGIN = 5 * 60
+
+# HTTP statuses an object store answers an expired signature with
+EXPIRED_STATUSES = (400, 401, 403)
+
+SIGNED_URL_REFRESHES = Counter(
+    'signed_url_refreshes_total',
+    'Per-study signed URL refreshes',
+    ['reason']
+)
+
+SIGNED_URLS_RENEWED = Counter(
+    'signed_urls_renewed_total',
+    'Signed URLs replaced by a refresh'
+)
+
+
+# Expiry time (epoch seconds) written into a signed URL, or None if it has none
+def url_expiry(signed_url):
+    params = parse_qs(urlparse(signed_url).query)
+    try:
+        if 'X-Amz-Date' in params and 'X-Amz-Expires' in params:
+            signed = datetime.strptime(params['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+            return signed.timestamp() + int(params['X-Amz-Expires'][0])
+        if 'Expires' in params:
+            return float(params['Expires'][0])
+    except ValueError:
+        pass
+    return None
+
+
+class UrlBroker:
+    # fetch(study_ids) returns {study_id: [file records with file_id and signedUrl]}
+    def __init__(self, fetch, margin=REFRESH_MARGIN, ttl=SIGNED_URL_TTL):
+        self.fetch = fetch
+        self.margin = margin
+        self.ttl = ttl
+        self.urls = {}
+        self.lock = threading.Lock()
+        self.study_locks = {}
+
+    def remember(self, study_id, file_id, signed_url, now):
+        expires = url_expiry(signed_url)
+        self.urls[(study_id, file_id)] = (signed_url, expires if expires is not None else now + self.ttl)
+
+    def current(self, file):
+        key = (file['study_id'], file['file_id'])
+        with self.lock:
+            if key not in self.urls:
+                self.remember(*key, file['signedUrl']['url'], time.time())
+            return self.urls[key]
+
+    # A usable URL for a file, refreshing its study first if the URL is about to expire.
+    # With expired_url (a URL the server just rejected) the study is refreshed unless another
+    # thread has already replaced that URL
+    def url_for(self, file, expired_url=None):
+        signed_url, expires = self.current(file)
+        if expired_url is None and expires - time.time() > self.margin:
+            return signed_url
+        with self.lock:
+            study_lock = self.study_locks.setdefault(file['study_id'], threading.Lock())
+        with study_lock:
+            signed_url, expires = self.current(file)
+            if expired_url is not None and signed_url == expired_url:
+                self.refresh(file['study_id'], 'expired')
+            elif expired_url is None and expires - time.time() <= self.margin:
+                self.refresh(file['study_id'], 'expiring')
+            return self.current(file)[0]
+
+    # Re-fetch the signed URLs of every file in a study with one query
+    def refresh(self, study_id, reason):
+        files = self.fetch([study_id]).get(study_id) or []
+        now = time.time()
+        with self.lock:
+            for file in files:
+                self.remember(study_id, file['file_id'], file['signedUrl']['url'], now)
+        SIGNED_URL_REFRESHES.labels(reason=reason).inc()
+        SIGNED_URLS_RENEWED.inc(len(files))
+
+    @staticmethod
+    def is_expired_error(error):
+        response = getattr(error, 'response', None)
+        return response is not None and response.status_code in EXPIRED_STATUSES
@@ -0,0 +1,104 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import multiprocessing
+import os
+import random
+import signal
+import sqlite3
+import tempfile
+import time
+
+from local_pdc_server import start_file_server
+
+'''
+multi-process check of the lease protocol in download_files_with_progress_DB.py
+starts a local file server and several worker processes that all work through the same catalog,
+sharing one download_progress.db and one download folder. one extra worker is killed (SIGKILL)
+part way through, so its leases have to expire before the others take its files over.
+at the end every file must be completed with a matching MD5, and only files the killed worker
+had claimed may have been requested more than once
+'''
+
+
+# One worker process: keep claiming and downloading until every file in the catalog is completed
+def run_worker(db_file, download_folder, files, seed, lease_seconds, threads):
+    import download_files_with_progress_DB as downloader
+    downloader.DB_FILE = db_file
+    downloader.DOWNLOAD_FOLDER = download_folder
+    downloader.LEASE_SECONDS = lease_seconds
+    downloader.HEARTBEAT_SECONDS = lease_seconds / 4
+    downloader.PROGRESS_PERSIST_BYTES = 256 * 1024
+    downloader.init_db()
+    downloader.start_progress_writer()
+
+    files = list(files)
+    random.Random(seed).shuffle(files)
+    with contextlib.redirect_stdout(io.StringIO()):
+        while True:
+            completed = downloader.load_completed_ids()
+            pending = [file for file in files if downloader.create_unique_identifier(file) not in completed]
+            if not pending:
+                break
+            downloader.download_files_in_parallel(pending, max_workers=threads)
+            downloader.progress_writer.flush()
+            time.sleep(0.2)
+    downloader.stop_progress_writer()
+
+def md5_of(path):
+    md5_hash = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5_hash.update(chunk)
+    return md5_hash.hexdigest()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several downloader processes against one catalog and check for duplicate work")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=2, help="download threads per worker process")
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--lease-seconds", type=float, default=3.0)
+    parser.add_argument("--kill-after", type=float, default=1.0, help="seconds before the extra worker is killed")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    server = start_file_server({f"lease_file_{i:03d}.raw": rng.randint(1_000_000, 8_000_000) for i in range(args.files)},
+                               latency=0.02, bandwidth_bps=10e6)
+    files = server.catalog
+    context = multiprocessing.get_context("spawn")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_file = os.path.join(work_dir, "download_progress.db")
+        download_folder = os.path.join(work_dir, "files")
+        start = time.perf_counter()
+
+        victim = context.Process(target=run_worker, args=(db_file, download_folder, files, 999, args.lease_seconds, args.threads))
+        victim.start()
+        time.sleep(args.kill_after)
+        workers = [context.Process(target=run_worker, args=(db_file, download_folder, files, seed, args.lease_seconds, args.threads))
+                   for seed in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        os.kill(victim.pid, signal.SIGKILL)
+        victim.join()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        conn = sqlite3.connect(db_file)
+        rows = conn.execute("SELECT file_name, status, md5sum, generated_md5sum, unique_id FROM download_progress").fetchall()
+        conn.close()
+        completed = [row for row in rows if row[1] == 'completed']
+        bad_md5 = [row[0] for row in completed if row[2] != row[3] or md5_of(os.path.join(download_folder, row[4])) != row[2]]
+
+    repeated = {name: count for name, count in server.file_requests.items() if count > 1}
+    server.shutdown()
+    print(f"{args.workers} workers (+1 killed after {args.kill_after}s), {args.files} files, {elapsed:.1f}s")
+    print(f"completed {len(completed)}/{args.files}, md5 mismatches {len(bad_md5)}")
+    print(f"files requested more than once: {len(repeated)} (expected: only files the killed worker had claimed)")
+    for name, count in sorted(repeated.items()):
+        print(f"  {name}: {count} requests")
+    if len(completed) != args.files or bad_md5:
+        raise SystemExit(1)
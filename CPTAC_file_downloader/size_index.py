@@ -0,0 +1,92 @@
+import json
+import threading
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, only needed for the numpy size engine
+    np = None
+
+'''
+in-memory columnar index of the files table for the size queries in API_get_files.py
+keeps file_size and the SQLite rowid of every file in two sorted NumPy arrays
+(8 + 4 bytes per file, 8 + 8 once rowids pass 2**31), answers smallest / largest / range
+with binary search and slicing, then reads only the selected rows from SQLite
+'''
+
+# Rows read from SQLite per chunk while building the arrays
+LOAD_CHUNK_ROWS = 1_000_000
+
+# Selections up to this size are looked up with bound parameters instead of a JSON array
+MAX_BOUND_ROWIDS = 500
+
+
+class SizeIndex:
+    def __init__(self):
+        if np is None:
+            raise ImportError("the numpy size engine needs numpy installed")
+        # (sizes, rowids) are replaced together so concurrent readers always see a consistent pair
+        self.arrays = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32))
+        self.version = None
+        self.lock = threading.Lock()
+
+    # Build the arrays from the files table, ordered the same way as the SQL queries (file_size, then file_id)
+    def load(self, conn, version=None):
+        cursor = conn.execute('SELECT file_size, rowid FROM files WHERE file_size IS NOT NULL ORDER BY file_size ASC, file_id ASC')
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(LOAD_CHUNK_ROWS)
+            if not rows:
+                break
+            chunks.append(np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows)).reshape(-1, 2))
+        pairs = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+        sizes = np.ascontiguousarray(pairs[:, 0])
+        rowids = pairs[:, 1]
+        rowids = rowids.astype(np.int32) if len(rowids) == 0 or rowids.max() < 2 ** 31 else rowids.copy()
+        self.arrays = (sizes, rowids)
+        self.version = version
+
+    # Reload if the database version token differs from the one the arrays were built from
+    def refresh_if_changed(self, conn, version):
+        if version == self.version:
+            return
+        with self.lock:
+            if version != self.version:
+                self.load(conn, version)
+
+    def nbytes(self):
+        sizes, rowids = self.arrays
+        return sizes.nbytes + rowids.nbytes
+
+    # Row pointers for each query, in result order
+    def smallest_rowids(self, n):
+        return self.arrays[1][:max(n, 0)]
+
+    def largest_rowids(self, n):
+        return self.arrays[1][::-1][:max(n, 0)]
+
+    def range_rowids(self, min_size, max_size):
+        sizes, rowids = self.arrays
+        lo = np.searchsorted(sizes, min_size, side='left')
+        hi = np.searchsorted(sizes, max_size, side='right')
+        return rowids[lo:hi]
+
+
+# Fetch the selected rows' details, keeping the order of rowids.
+# Small selections are bound as parameters; large ones are passed as one JSON array.
+# Either way the lookup walks the rowids in ascending order so SQLite reads table pages sequentially
+def fetch_rows(conn, rowids):
+    if len(rowids) == 0:
+        return []
+    ids = np.sort(rowids).tolist()
+    query = '''
+        SELECT rowid, file_id, file_name, file_size, md5sum, signedUrl
+        FROM files
+        WHERE rowid IN ({})
+    '''
+    if len(ids) <= MAX_BOUND_ROWIDS:
+        cursor = conn.execute(query.format(','.join('?' * len(ids))), ids)
+    else:
+        cursor = conn.execute(query.format('SELECT value FROM json_each(?)'), (json.dumps(ids),))
+    by_rowid = {row[0]: row[1:] for row in cursor}
+    return [by_rowid[rowid] for rowid in rowids.tolist() if rowid in by_rowid]
@@ -0,0 +1,165 @@
+import argparse
+import hashlib
+import math
+import sqlite3
+import time
+
+from create_DB_sqlite3 import DB_FILE, create_tables, create_indexes, file_row
+from fetch_study_files import (fetch_study_catalog, fetch_files_batched, make_session,
+                               BATCH_SIZE, MAX_WORKERS)
+
+'''
+incremental catalog sync for file_metadata_database.db
+instead of re-crawling every study version, this records which study_id versions were crawled
+together with a fingerprint of their file listing, then on each run fetches only
+  - study versions that are new in studyCatalog
+  - a refresh sample of already-crawled versions (least recently crawled first)
+and applies inserts, updates and deletes to the files / study_files tables.
+study versions that disappeared from the catalog have their files removed
+'''
+
+# Fraction of already-crawled study versions re-fetched on every run
+REFRESH_FRACTION = 0.05
+
+
+# Create the table that remembers what has been crawled
+def create_crawl_state_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_state (
+            study_id TEXT PRIMARY KEY,
+            pdc_study_id TEXT,
+            fingerprint TEXT NOT NULL,
+            file_count INTEGER,
+            last_crawled REAL
+        )
+    ''')
+    conn.commit()
+
+# Fingerprint of a study's file listing; signedUrl is left out because it changes on every request
+def fingerprint_files(files):
+    digest = hashlib.sha256()
+    for file in sorted(files, key=lambda f: f['file_id']):
+        digest.update(f"{file['file_id']}\t{file['file_name']}\t{file['file_size']}\t{file['md5sum']}\n".encode())
+    return digest.hexdigest()
+
+# Delete files no longer listed by any study version
+def delete_orphan_files(cursor, file_ids):
+    deleted = 0
+    for file_id in file_ids:
+        cursor.execute('''
+            DELETE FROM files
+            WHERE file_id = ? AND NOT EXISTS (SELECT 1 FROM study_files WHERE study_files.file_id = ?)
+        ''', (file_id, file_id))
+        deleted += cursor.rowcount
+    return deleted
+
+# Apply one study's fresh file listing to the database; returns (inserted, updated, deleted) file counts
+def apply_study_files(cursor, study_id, files):
+    cursor.execute("SELECT file_id FROM study_files WHERE study_id = ?", (study_id,))
+    old_ids = {row[0] for row in cursor.fetchall()}
+    new_ids = {file['file_id'] for file in files}
+
+    inserted = updated = 0
+    for file in files:
+        row = file_row(file)
+        cursor.execute("SELECT file_name, file_size, md5sum FROM files WHERE file_id = ?", (row[0],))
+        existing = cursor.fetchone()
+        if existing is None:
+            inserted += 1
+        elif existing != row[1:4]:
+            updated += 1
+        cursor.execute('''
+            INSERT INTO files (file_id, file_name, file_size, md5sum, signedUrl)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(file_id) DO UPDATE SET file_name=excluded.file_name, file_size=excluded.file_size,
+                md5sum=excluded.md5sum, signedUrl=excluded.signedUrl
+        ''', row)
+
+    cursor.executemany("INSERT OR IGNORE INTO study_files (study_id, file_id) VALUES (?, ?)",
+                       [(study_id, file_id) for file_id in new_ids - old_ids])
+    removed = old_ids - new_ids
+    cursor.executemany("DELETE FROM study_files WHERE study_id = ? AND file_id = ?",
+                       [(study_id, file_id) for file_id in removed])
+    deleted = delete_orphan_files(cursor, removed)
+    return inserted, updated, deleted
+
+# Remove a study version that is no longer in the catalog
+def remove_study(cursor, study_id):
+    cursor.execute("SELECT file_id FROM study_files WHERE study_id = ?", (study_id,))
+    file_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute("DELETE FROM study_files WHERE study_id = ?", (study_id,))
+    cursor.execute("DELETE FROM crawl_state WHERE study_id = ?", (study_id,))
+    return delete_orphan_files(cursor, file_ids)
+
+# Run one incremental sync; returns a dict of counts describing what changed
+def sync_catalog(conn, refresh_fraction=REFRESH_FRACTION, refresh_count=None, batch_size=BATCH_SIZE,
+                 max_workers=MAX_WORKERS, acceptDUA=True):
+    create_tables(conn)
+    create_indexes(conn)
+    create_crawl_state_table(conn)
+    session = make_session(pool_size=max_workers)
+
+    study_catalog = fetch_study_catalog(acceptDUA, session=session)
+    catalog_versions = {}
+    for study in study_catalog:
+        for version in study['versions']:
+            catalog_versions[version['study_id']] = study['pdc_study_id']
+
+    cursor = conn.cursor()
+    cursor.execute("SELECT study_id, fingerprint FROM crawl_state ORDER BY last_crawled ASC")
+    known = dict(cursor.fetchall())
+
+    new_ids = [study_id for study_id in catalog_versions if study_id not in known]
+    removed_ids = [study_id for study_id in known if study_id not in catalog_versions]
+    old_ids = [study_id for study_id in known if study_id in catalog_versions]  # least recently crawled first
+    if refresh_count is None:
+        refresh_count = math.ceil(len(old_ids) * refresh_fraction)
+    refresh_ids = old_ids[:refresh_count]
+
+    to_fetch = new_ids + refresh_ids
+    files_by_study = fetch_files_batched(to_fetch, batch_size=batch_size, max_workers=max_workers, session=session) if to_fetch else {}
+
+    stats = {'new_studies': len(new_ids), 'refreshed_studies': len(refresh_ids), 'changed_studies': 0,
+             'removed_studies': len(removed_ids), 'inserted': 0, 'updated': 0, 'deleted': 0}
+    now = time.time()
+    with conn:
+        for study_id in to_fetch:
+            files = files_by_study[study_id]
+            fingerprint = fingerprint_files(files)
+            if known.get(study_id) != fingerprint:
+                inserted, updated, deleted = apply_study_files(cursor, study_id, files)
+                stats['inserted'] += inserted
+                stats['updated'] += updated
+                stats['deleted'] += deleted
+                if study_id in known:
+                    stats['changed_studies'] += 1
+            cursor.execute('''
+                INSERT INTO crawl_state (study_id, pdc_study_id, fingerprint, file_count, last_crawled)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(study_id) DO UPDATE SET fingerprint=excluded.fingerprint,
+                    file_count=excluded.file_count, last_crawled=excluded.last_crawled
+            ''', (study_id, catalog_versions[study_id], fingerprint, len(files), now))
+
+        for study_id in removed_ids:
+            stats['deleted'] += remove_study(cursor, study_id)
+
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally sync file_metadata_database.db with the PDC study catalog")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--refresh-fraction", type=float, default=REFRESH_FRACTION,
+                        help="fraction of already-crawled study versions to re-fetch")
+    parser.add_argument("--refresh-count", type=int, default=None,
+                        help="exact number of already-crawled study versions to re-fetch (overrides --refresh-fraction)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    start = time.time()
+    stats = sync_catalog(conn, refresh_fraction=args.refresh_fraction, refresh_count=args.refresh_count,
+                         batch_size=args.batch_size, max_workers=args.workers)
+    conn.close()
+    print(f"Sync finished in {time.time() - start:.1f}s: " + ", ".join(f"{key}={value}" for key, value in stats.items()))
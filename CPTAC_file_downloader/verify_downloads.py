@@ -0,0 +1,116 @@
+import argparse
+import hashlib
+import mmap
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from download_files_with_progress_DB import DB_FILE, DOWNLOAD_FOLDER, CONTENT_FOLDER
+
+'''
+bulk integrity audit of the download folder
+re-hashes every downloaded file with a pool of processes, each reading through a memory map,
+and compares the MD5 with the catalog md5sum recorded in download_progress.db
+(or, for the content store, the md5 in the object's name). hardlinked names share one inode
+and are hashed once. reports GB/s hashed; with --mark, mismatched files are deleted and their
+rows set to checksum_mismatch so the downloader fetches them again
+'''
+
+VERIFY_WORKERS = os.cpu_count() or 1
+
+
+# MD5 of a file read through a memory map
+def md5_mmap(path):
+    md5_hash = hashlib.md5()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return md5_hash.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            md5_hash.update(mm)
+    return md5_hash.hexdigest()
+
+# Catalog md5sum of every completed download, by unique_id (the file name in the download folder)
+def expected_checksums(db_file):
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute("SELECT unique_id, md5sum FROM download_progress WHERE status = 'completed'").fetchall()
+    conn.close()
+    return dict(rows)
+
+# Downloaded files grouped by inode: {(device, inode): (size, [paths])}; partial downloads are skipped
+def collect_files(folder):
+    groups = {}
+    for root, _, names in os.walk(folder):
+        for name in names:
+            if name.endswith('.part') or name.endswith('.segments'):
+                continue
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            groups.setdefault((stat.st_dev, stat.st_ino), (stat.st_size, []))[1].append(path)
+    return groups
+
+# Expected MD5 for a group of names sharing one inode: the md5 in a content store object's name, else the catalog md5sum
+def expected_md5(paths, checksums):
+    for path in paths:
+        if os.path.basename(os.path.dirname(os.path.dirname(path))) == CONTENT_FOLDER:
+            return os.path.basename(path).split('_')[0]
+    for path in paths:
+        if checksums.get(os.path.basename(path)):
+            return checksums[os.path.basename(path)]
+    return None
+
+# Delete every name of a bad file and mark the rows that point at it for re-download
+def mark_mismatched(db_file, paths, generated_md5):
+    conn = sqlite3.connect(db_file)
+    with conn:
+        for path in paths:
+            conn.execute('''
+                UPDATE download_progress SET status = 'checksum_mismatch', generated_md5sum = ?, content_path = NULL
+                WHERE unique_id = ? OR content_path = ?
+            ''', (generated_md5, os.path.basename(path), path))
+    conn.close()
+    for path in paths:
+        os.remove(path)
+
+# Hash everything under folder; returns a dict of counts, bytes, seconds and the mismatched paths
+def verify_folder(folder=DOWNLOAD_FOLDER, db_file=DB_FILE, workers=VERIFY_WORKERS, mark=False):
+    checksums = expected_checksums(db_file) if os.path.exists(db_file) else {}
+    groups = sorted(collect_files(folder).values(), key=lambda group: group[0], reverse=True)  # largest first
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        digests = list(executor.map(md5_mmap, [paths[0] for _, paths in groups]))
+    elapsed = time.perf_counter() - start
+
+    report = {'files': sum(len(paths) for _, paths in groups), 'hashed': len(groups), 'ok': 0, 'unknown': 0,
+              'bytes': sum(size for size, _ in groups), 'seconds': elapsed, 'mismatched': []}
+    for (size, paths), digest in zip(groups, digests):
+        expected = expected_md5(paths, checksums)
+        if expected is None:
+            report['unknown'] += 1
+        elif digest == expected:
+            report['ok'] += 1
+        else:
+            report['mismatched'].append(paths)
+            if mark:
+                mark_mismatched(db_file, paths, digest)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-hash downloaded files and compare with the catalog MD5")
+    parser.add_argument("--folder", default=DOWNLOAD_FOLDER)
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--workers", type=int, default=VERIFY_WORKERS, help="hashing processes")
+    parser.add_argument("--mark", action="store_true",
+                        help="delete mismatched files and set their rows to checksum_mismatch for re-download")
+    args = parser.parse_args()
+
+    report = verify_folder(args.folder, args.db, args.workers, args.mark)
+    print(f"{report['files']} files ({report['hashed']} distinct), {report['bytes'] / 1e9:.2f} GB hashed in "
+          f"{report['seconds']:.2f}s ({report['bytes'] / 1e9 / max(report['seconds'], 1e-9):.2f} GB/s, {args.workers} workers)")
+    print(f"ok {report['ok']}, mismatched {len(report['mismatched'])}, no expected checksum {report['unknown']}")
+    for paths in report['mismatched']:
+        print(f"  MISMATCH {', '.join(paths)}" + (" (deleted, marked checksum_mismatch)" if args.mark else ""))
@@ -0,0 +1,250 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from openrouterAPI_callPRIDE import (PRIDE_URL, OPENROUTER_URL, MODEL, PROMPT_TEMPLATE,
+                                     fetch_project_details, build_prompt, request_completion, extract_json)
+from compact_prompt import PROJECT_FIELDS, MAX_FIELD_TOKENS, build_compact_prompt
+
+'''
+batch mode for openrouterAPI_callPRIDE.py: PRIDE project details and LLM extraction for many PXD accessions
+  - PRIDE fetches and LLM completions run in two thread pools, each with its own request-rate limit,
+    over keep-alive sessions that retry 429 and 5xx responses with exponential backoff (honouring Retry-After)
+  - projects flow from the PRIDE pool to the LLM pool as soon as their details arrive
+  - responses are kept in an on-disk cache: PRIDE details by accession, completions by accession plus a hash
+    of the prompt and the model, so a re-run, or a run with a changed prompt or model, only pays for what changed
+  - with compact=True the prompt carries the compacted PRIDE record (compact_prompt.py) and the estimated
+    tokens saved are reported per project
+writes output_<accession>.json per project and prints a summary with cache hits and calls made
+'''
+
+CACHE_DIR = ".extract_cache"
+OUTPUT_DIR = "outputs"
+
+# Concurrency and request-rate limits per service
+PRIDE_WORKERS = 8
+PRIDE_REQUESTS_PER_SECOND = 10.0
+LLM_WORKERS = 4
+LLM_REQUESTS_PER_SECOND = 2.0
+
+# Retry policy for 429 / 5xx responses
+MAX_RETRIES = 6
+BACKOFF_FACTOR = 1.0
+
+
+# Keep-alive session sized for the pool, retrying rate-limited and failed requests with exponential backoff
+def make_session(pool_size, max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR):
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "POST"],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Spaces requests out to at most rate requests per second across all threads of one service
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Content-addressed JSON store on disk: <cache_dir>/<kind>/<accession>/<key>.json, written atomically
+class ResponseCache:
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def path(self, kind, accession, key):
+        return os.path.join(self.cache_dir, kind, accession, f"{key}.json")
+
+    def get(self, kind, accession, key):
+        try:
+            with open(self.path(kind, accession, key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, kind, accession, key, value):
+        path = self.path(kind, accession, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+# Cache key of a completion: the prompt and the model, hashed (the accession is part of the path)
+def completion_key(prompt_content, model):
+    return hashlib.sha256(json.dumps([model, prompt_content]).encode()).hexdigest()
+
+
+class BatchExtractor:
+    def __init__(self, cache_dir=CACHE_DIR, output_dir=OUTPUT_DIR, model=MODEL, template=PROMPT_TEMPLATE,
+                 pride_url=PRIDE_URL, openrouter_url=OPENROUTER_URL, api_key=None,
+                 pride_workers=PRIDE_WORKERS, pride_rps=PRIDE_REQUESTS_PER_SECOND,
+                 llm_workers=LLM_WORKERS, llm_rps=LLM_REQUESTS_PER_SECOND, refresh_pride=False,
+                 compact=False, fields=PROJECT_FIELDS, max_field_tokens=MAX_FIELD_TOKENS):
+        self.cache = ResponseCache(cache_dir)
+        self.output_dir = output_dir
+        self.model = model
+        self.template = template
+        self.pride_url = pride_url
+        self.openrouter_url = openrouter_url
+        self.api_key = api_key
+        self.pride_workers = pride_workers
+        self.llm_workers = llm_workers
+        self.pride_limiter = RateLimiter(pride_rps)
+        self.llm_limiter = RateLimiter(llm_rps)
+        self.pride_session = make_session(pride_workers)
+        self.llm_session = make_session(llm_workers)
+        self.refresh_pride = refresh_pride
+        self.compact = compact
+        self.fields = fields
+        self.max_field_tokens = max_field_tokens
+        # {accession: (estimated tokens of the full prompt, of the compact prompt)} for compact runs
+        self.token_estimates = {}
+        self.stats = {'pride_calls': 0, 'pride_cached': 0, 'llm_calls': 0, 'llm_cached': 0, 'errors': 0}
+        self.lock = threading.Lock()
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    # PRIDE details for an accession, from the cache unless refresh_pride is set. Unreadable projects ({}) are
+    # not cached, and run() reports them as errors without calling the LLM
+    def project_details(self, accession):
+        if not self.refresh_pride:
+            cached = self.cache.get('pride', accession, 'project')
+            if cached is not None:
+                self.count('pride_cached')
+                return cached
+        self.pride_limiter.wait()
+        details = fetch_project_details(accession, session=self.pride_session, pride_url=self.pride_url)
+        self.count('pride_calls')
+        if details:
+            self.cache.put('pride', accession, 'project', details)
+        return details
+
+    # Extracted JSON for a project, from the cache if this prompt and model were already answered
+    def extract(self, accession, details):
+        if self.compact:
+            prompt_content, full_tokens, compact_tokens = build_compact_prompt(details, self.template, self.fields,
+                                                                               self.max_field_tokens)
+            with self.lock:
+                self.token_estimates[accession] = (full_tokens, compact_tokens)
+            print(f"{accession}: ~{full_tokens} -> ~{compact_tokens} prompt tokens (saved ~{full_tokens - compact_tokens})")
+        else:
+            prompt_content = build_prompt(details, self.template)
+        key = completion_key(prompt_content, self.model)
+        result = cached = self.cache.get('llm', accession, key)
+        if result is not None:
+            self.count('llm_cached')
+        else:
+            self.llm_limiter.wait()
+            result = request_completion(prompt_content, session=self.llm_session, model=self.model,
+                                        api_key=self.api_key, openrouter_url=self.openrouter_url)
+            self.count('llm_calls')
+        output = extract_json(result)
+        # only a completion that parses is cached; a malformed one is asked for again on the next run
+        if cached is None:
+            self.cache.put('llm', accession, key, result)
+        with open(os.path.join(self.output_dir, f"output_{accession}.json"), "w") as outfile:
+            json.dump(output, outfile, indent=4)
+        return output
+
+    # Process every accession; returns {accession: extracted JSON or None on error}
+    def run(self, accessions):
+        os.makedirs(self.output_dir, exist_ok=True)
+        accessions = list(dict.fromkeys(accessions))
+        outputs = {}
+        with ThreadPoolExecutor(max_workers=self.pride_workers) as pride_pool, \
+                ThreadPoolExecutor(max_workers=self.llm_workers) as llm_pool:
+            pride_futures = {pride_pool.submit(self.project_details, accession): accession for accession in accessions}
+            llm_futures = {}
+            for future in as_completed(pride_futures):
+                accession = pride_futures[future]
+                try:
+                    details = future.result()
+                except requests.RequestException as e:
+                    print(f"Error fetching {accession} from PRIDE: {e}")
+                    self.count('errors')
+                    outputs[accession] = None
+                    continue
+                if not details:
+                    # PRIDE answered with an error or a 404: nothing to extract from, so no completion is paid for
+                    print(f"No PRIDE details for {accession}, skipping extraction")
+                    self.count('errors')
+                    outputs[accession] = None
+                    continue
+                llm_futures[llm_pool.submit(self.extract, accession, details)] = accession
+            for future in as_completed(llm_futures):
+                accession = llm_futures[future]
+                try:
+                    outputs[accession] = future.result()
+                except (requests.RequestException, KeyError, IndexError, ValueError) as e:
+                    print(f"Error extracting {accession}: {e}")
+                    self.count('errors')
+                    outputs[accession] = None
+        return outputs
+
+def read_accessions(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract experiment metadata for many PRIDE projects")
+    parser.add_argument("accessions", help="file with one PXD accession per line")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--pride-workers", type=int, default=PRIDE_WORKERS)
+    parser.add_argument("--pride-rps", type=float, default=PRIDE_REQUESTS_PER_SECOND, help="PRIDE requests per second")
+    parser.add_argument("--llm-workers", type=int, default=LLM_WORKERS)
+    parser.add_argument("--llm-rps", type=float, default=LLM_REQUESTS_PER_SECOND, help="LLM requests per second")
+    parser.add_argument("--refresh-pride", action="store_true", help="re-fetch PRIDE details even if cached")
+    parser.add_argument("--compact", action="store_true", help="send a compacted PRIDE record instead of the full JSON")
+    parser.add_argument("--fields", default=",".join(PROJECT_FIELDS), help="comma-separated field allow-list for --compact")
+    parser.add_argument("--max-field-tokens", type=int, default=MAX_FIELD_TOKENS, help="token budget per text field for --compact")
+    args = parser.parse_args()
+
+    extractor = BatchExtractor(cache_dir=args.cache_dir, output_dir=args.output_dir, model=args.model,
+                               pride_workers=args.pride_workers, pride_rps=args.pride_rps,
+                               llm_workers=args.llm_workers, llm_rps=args.llm_rps, refresh_pride=args.refresh_pride,
+                               compact=args.compact, fields=args.fields.split(","), max_field_tokens=args.max_field_tokens)
+    accessions = read_accessions(args.accessions)
+    start = time.time()
+    outputs = extractor.run(accessions)
+    elapsed = time.time() - start
+    done = sum(output is not None for output in outputs.values())
+    print(f"Extracted {done}/{len(accessions)} projects in {elapsed:.1f}s")
+    print(", ".join(f"{name} {value}" for name, value in extractor.stats.items()))
+    if extractor.token_estimates:
+        full = sum(estimate[0] for estimate in extractor.token_estimates.values())
+        compact = sum(estimate[1] for estimate in extractor.token_estimates.values())
+        print(f"Prompt tokens (estimated): {full} full, {compact} compact, {full - compact} saved ({1 - compact / max(full, 1):.0%})")
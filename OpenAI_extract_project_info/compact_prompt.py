@@ -0,0 +1,94 @@
+import json
+import math
+import re
+
+from openrouterAPI_callPRIDE import PROMPT_TEMPLATE
+
+'''
+prompt compaction for PRIDE project payloads
+the full PRIDE record, dumped with indent=4, is mostly whitespace, submitter and reference lists,
+links and other fields that say nothing about the experiment. compaction
+  - projects the record onto an allow-list of fields; "instruments.name" keeps only the name of each instrument
+  - serialises it as compact JSON (no indentation, no spaces after separators)
+  - truncates free-text values to a token budget each, at a word boundary
+and estimates the tokens saved, at about CHARS_PER_TOKEN characters per token
+'''
+
+# Fields kept from a PRIDE project record. "a.b" keeps field b of every item (or of the object) under a
+PROJECT_FIELDS = [
+    'accession',
+    'title',
+    'projectDescription',
+    'sampleProcessingProtocol',
+    'dataProcessingProtocol',
+    'keywords',
+    'projectTags',
+    'submissionType',
+    'experimentTypes.name',
+    'quantificationMethods.name',
+    'instruments.name',
+    'softwares.name',
+    'organisms.name',
+    'organismParts.name',
+    'diseases.name',
+    'identifiedPTMStrings.name',
+]
+
+# Most tokens kept of any one text value
+MAX_FIELD_TOKENS = 400
+
+# Rough token estimate for English text and JSON
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+# Shorten text to about max_tokens, cutting at the last word boundary and marking the cut
+def truncate_text(text, max_tokens=MAX_FIELD_TOKENS):
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = cut.rfind(' ')
+    if boundary > max_chars // 2:
+        cut = cut[:boundary]
+    return cut.rstrip() + " ..."
+
+# Value of a dotted field path, or None if it is missing or empty
+def project_field(record, path):
+    head, _, rest = path.partition('.')
+    value = record.get(head) if isinstance(record, dict) else None
+    if not rest or value is None:
+        return value
+    if isinstance(value, list):
+        values = [project_field(item, rest) for item in value]
+        return [item for item in values if item not in (None, '', [])] or None
+    return project_field(value, rest)
+
+def truncate_values(value, max_tokens):
+    if isinstance(value, str):
+        return truncate_text(re.sub(r'\s+', ' ', value).strip(), max_tokens)
+    if isinstance(value, list):
+        return [truncate_values(item, max_tokens) for item in value]
+    if isinstance(value, dict):
+        return {key: truncate_values(item, max_tokens) for key, item in value.items()}
+    return value
+
+# The allow-listed fields of a record, with text truncated; "instruments.name" is kept as "instruments": [names]
+def compact_record(record, fields=PROJECT_FIELDS, max_tokens=MAX_FIELD_TOKENS):
+    compact = {}
+    for path in fields:
+        value = project_field(record, path)
+        if value not in (None, '', []):
+            compact[path.split('.')[0]] = truncate_values(value, max_tokens)
+    return compact
+
+def compact_json(record, fields=PROJECT_FIELDS, max_tokens=MAX_FIELD_TOKENS):
+    return json.dumps(compact_record(record, fields, max_tokens), separators=(',', ':'), ensure_ascii=False)
+
+# Build the prompt from a compacted record. Returns (prompt, estimated tokens of the full prompt,
+# estimated tokens of the compact one)
+def build_compact_prompt(project_details, template=PROMPT_TEMPLATE, fields=PROJECT_FIELDS, max_tokens=MAX_FIELD_TOKENS):
+    full = template.format(project_details=json.dumps(project_details, indent=4))
+    prompt = template.format(project_details=compact_json(project_details, fields, max_tokens))
+    return prompt, estimate_tokens(full), estimate_tokens(prompt)
@@ -0,0 +1,83 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import tempfile
+
+from batch_extract import BatchExtractor
+from compact_prompt import PROJECT_FIELDS, MAX_FIELD_TOKENS
+from local_services import start_pride_server, start_llm_server
+
+'''
+evaluation harness for compact_prompt.py
+serves the PRIDE records in fixtures/ from the local PRIDE stand-in and runs batch_extract.py twice,
+once with the full indent=4 prompt and once with the compacted one, then checks that the extracted JSON
+is the same for every fixture and reports the estimated prompt tokens saved.
+by default completions come from the local LLM stand-in; --openrouter-url (with OPENROUTER_API_KEY)
+evaluates against a real model instead, through the batch cache so repeated evaluations are free
+'''
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_fixtures(fixture_dir=FIXTURE_DIR):
+    projects = {}
+    for path in sorted(glob.glob(os.path.join(fixture_dir, "*.json"))):
+        with open(path) as f:
+            project = json.load(f)
+        projects[project['accession']] = project
+    return projects
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that prompt compaction leaves the extracted JSON unchanged")
+    parser.add_argument("--fixtures", default=FIXTURE_DIR, help="folder of PRIDE project JSON files")
+    parser.add_argument("--fields", default=",".join(PROJECT_FIELDS))
+    parser.add_argument("--max-field-tokens", type=int, default=MAX_FIELD_TOKENS)
+    parser.add_argument("--openrouter-url", default=None, help="real chat completions endpoint (default: local stand-in)")
+    parser.add_argument("--cache-dir", default=None, help="completion cache to reuse across evaluations")
+    args = parser.parse_args()
+
+    projects = load_fixtures(args.fixtures)
+    pride = start_pride_server(projects)
+    llm = None
+    openrouter_url = args.openrouter_url
+    if openrouter_url is None:
+        llm = start_llm_server()
+        openrouter_url = llm.url
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        cache_dir = args.cache_dir or os.path.join(work_dir, "cache")
+        outputs = {}
+        extractors = {}
+        for name, compact in (('full', False), ('compact', True)):
+            extractors[name] = BatchExtractor(cache_dir=cache_dir, output_dir=os.path.join(work_dir, name),
+                                              pride_url=pride.url, openrouter_url=openrouter_url, compact=compact,
+                                              fields=args.fields.split(","), max_field_tokens=args.max_field_tokens)
+            with contextlib.redirect_stdout(io.StringIO()):
+                outputs[name] = extractors[name].run(projects)
+
+    pride.shutdown()
+    if llm is not None:
+        llm.shutdown()
+
+    estimates = extractors['compact'].token_estimates
+    changed = []
+    print(f"{'accession':<12} {'full':>7} {'compact':>8} {'saved':>7}  extraction")
+    for accession in projects:
+        full_tokens, compact_tokens = estimates.get(accession, (0, 0))
+        same = outputs['full'][accession] is not None and outputs['full'][accession] == outputs['compact'][accession]
+        if not same:
+            changed.append(accession)
+        print(f"{accession:<12} {full_tokens:>7} {compact_tokens:>8} {full_tokens - compact_tokens:>7}  {'unchanged' if same else 'CHANGED'}")
+    full = sum(estimate[0] for estimate in estimates.values())
+    compact = sum(estimate[1] for estimate in estimates.values())
+    print(f"total: ~{full} -> ~{compact} prompt tokens ({1 - compact / max(full, 1):.0%} saved), "
+          f"{len(projects) - len(changed)}/{len(projects)} extractions unchanged")
+    for accession in changed:
+        print(f"  {accession}: full {json.dumps(outputs['full'][accession])}")
+        print(f"  {accession}: compact {json.dumps(outputs['compact'][accession])}")
+    if changed:
+        raise SystemExit(1)
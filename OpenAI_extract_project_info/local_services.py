@@ -0,0 +1,142 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''
+local stand-ins for the PRIDE archive API and the OpenRouter chat completions API, used by simulate_batch_extract.py
+the PRIDE server serves synthetic project records; the LLM server answers with a JSON extraction derived from
+the prompt, wrapped in a ```json fence like the real model often does.
+both have a per-request latency and a requests-per-second limit above which they answer 429 with Retry-After
+'''
+
+PROJECT_PATTERN = re.compile(r'^/pride/ws/archive/v2/projects/([^/?]+)$')
+ACCESSION_PATTERN = re.compile(r'"accession":\s*"([^"]+)"')
+
+# The LLM stand-in "extracts" every term of these vocabularies that occurs in the prompt
+EXTRACTION_TERMS = {
+    'organism': ['Homo sapiens', 'Mus musculus', 'Rattus norvegicus', 'Saccharomyces cerevisiae'],
+    'instrument': ['Q Exactive HF', 'Orbitrap Fusion Lumos', 'Orbitrap Exploris 480', 'TripleTOF 6600', 'timsTOF Pro'],
+    'quantification': ['TMT', 'iTRAQ', 'SILAC', 'Label free'],
+    'acquisition': ['Data-independent acquisition', 'Shotgun proteomics'],
+    'enzyme': ['trypsin', 'Lys-C'],
+    'software': ['MaxQuant', 'Spectrum Mill', 'DIA-NN', 'Proteome Discoverer'],
+}
+
+
+# Synthetic PRIDE project records for accessions PXD000000, PXD000001, ...
+def make_projects(count, start=0):
+    projects = {}
+    for i in range(start, start + count):
+        accession = f"PXD{i:06d}"
+        projects[accession] = {
+            'accession': accession,
+            'title': f"Synthetic proteomics project {i}",
+            'projectDescription': f"Project {i} studies the proteome of sample group {i % 7}. " * 5,
+            'sampleProcessingProtocol': "Proteins were digested with trypsin and desalted.",
+            'dataProcessingProtocol': "Raw files were searched with MaxQuant against UniProt.",
+            'organisms': [{'name': 'Homo sapiens (human)', 'accession': '9606'}],
+            'instruments': [{'name': 'Q Exactive' if i % 2 else 'Orbitrap Fusion Lumos'}],
+            'references': [{'pubmedID': 1000000 + i, 'doi': f"10.1000/synthetic.{i}"}],
+        }
+    return projects
+
+
+class RateLimitedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Count the request; returns False (after answering 429) if it is over the server's rate limit
+    def admit(self):
+        server = self.server
+        now = time.monotonic()
+        with server.lock:
+            server.request_count += 1
+            server.recent = [t for t in server.recent if now - t < 1.0]
+            if server.rate_limit and len(server.recent) >= server.rate_limit:
+                server.rejected_count += 1
+                limited = True
+            else:
+                server.recent.append(now)
+                limited = False
+        if limited:
+            self.send_json({'error': 'rate limited'}, status=429, headers={'Retry-After': '1'})
+            return False
+        if server.latency:
+            time.sleep(server.latency)
+        return True
+
+
+class PrideHandler(RateLimitedHandler):
+    def do_GET(self):
+        if not self.admit():
+            return
+        match = PROJECT_PATTERN.match(self.path)
+        project = self.server.projects.get(match.group(1)) if match else None
+        if project is None:
+            self.send_json({'error': 'not found'}, status=404)
+            return
+        self.send_json(project)
+
+
+class CompletionHandler(RateLimitedHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.admit():
+            return
+        request = json.loads(body)
+        prompt = request['messages'][0]['content']
+        with self.server.lock:
+            self.server.prompts.append(prompt)
+        accession = ACCESSION_PATTERN.search(prompt)
+        extraction = {'accession': accession.group(1) if accession else None}
+        for field, terms in EXTRACTION_TERMS.items():
+            extraction[field] = sorted(term for term in terms if term.lower() in prompt.lower())
+        content = "```json\n" + json.dumps(extraction, indent=2) + "\n```"
+        self.send_json({
+            'id': f"chatcmpl-{self.server.request_count}",
+            'object': 'chat.completion',
+            'model': request.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(content) // 4},
+        })
+
+
+def start(handler, latency, rate_limit, host, port):
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.rate_limit = rate_limit
+    server.lock = threading.Lock()
+    server.recent = []
+    server.request_count = 0
+    server.rejected_count = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# PRIDE stand-in for {accession: project}; server.url is a PRIDE_URL-style template with {project_id}
+def start_pride_server(projects, latency=0.0, rate_limit=None, host="127.0.0.1", port=0):
+    server = start(PrideHandler, latency, rate_limit, host, port)
+    server.projects = projects
+    server.url = f"http://{host}:{server.server_address[1]}/pride/ws/archive/v2/projects/{{project_id}}"
+    return server
+
+# OpenRouter stand-in; server.url is the chat completions endpoint and server.prompts the prompts received
+def start_llm_server(latency=0.0, rate_limit=None, host="127.0.0.1", port=0):
+    server = start(CompletionHandler, latency, rate_limit, host, port)
+    server.prompts = []
+    server.url = f"http://{host}:{server.server_address[1]}/api/v1/chat/completions"
+    return server
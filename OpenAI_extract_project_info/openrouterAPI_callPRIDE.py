@@ -1,93 +1,115 @@
 import requests
 import json
+import os
 import re
 '''
 this script calls PRIDE API first to retrieve project details
 feed this description into openrouter API prompt
 return JSON output
+the functions are shared with batch_extract.py, which runs many projects concurrently
 '''
 
-# Define the project identifier
-project_id = "PXD001468"
-
 # PRIDE API endpoint for fetching project details
-pride_url = f"https://www.ebi.ac.uk/pride/ws/archive/v2/projects/{project_id}"
+PRIDE_URL = "https://www.ebi.ac.uk/pride/ws/archive/v2/projects/{project_id}"
 
-# Get project details from PRIDE
-pride_response = requests.get(pride_url)
+# OpenRouter API endpoint and model
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+MODEL = "meta-llama/llama-4-maverick"
 
-if pride_response.status_code == 200:
-    try:
-        project_details = pride_response.json()
-        # Adjust this key based on the actual JSON structure from the PRIDE API.
-        #project_description = project_data.get("projectDescription", "No description available")
-    except ValueError:
-        print("Error: PRIDE API response is not valid JSON.")
-        project_details = {}
-else:
-    print(f"Error: Received status code {pride_response.status_code} from PRIDE API")
-    project_details = {}
-
-# Convert the project details JSON object to a formatted string for inclusion in the prompt
-project_details_str = json.dumps(project_details, indent=4)
-print(project_details_str)
-# Construct the prompt for OpenRouter, incorporating the project description from PRIDE.
-prompt_content = (
-    f"Given this project description, can you extract key experiment information useful for machine learning-based data analysis and return output in JSON format?? "
-    f"Below is the project information:\n\n{project_details_str}"
+# Prompt sent with every project; the project details are appended after it
+PROMPT_TEMPLATE = (
+    "Given this project description, can you extract key experiment information useful for machine learning-based data analysis and return output in JSON format?? "
+    "Below is the project information:\n\n{project_details}"
 )
 
-# OpenRouter API endpoint and configuration    
-response = requests.post(
-    url="https://openrouter.ai/api/v1/chat/completions",
-    headers={
-        "Authorization": "Bearer api_key", # replace with actual API key (private)
-        "HTTP-Referer": "<YOUR_SITE_URL>",  # Optional
-        "X-Title": "<YOUR_SITE_NAME>",      # Optional
-        "Accept": "application/json"
-    },
-    data=json.dumps({
-        "model": "meta-llama/llama-4-maverick",  # Optional
-        "response_format": { "type": "json_object" },
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt_content
-
-            }
-        ]
-    })
-)
+REQUEST_TIMEOUT = 120
+
+# Get project details from PRIDE; returns {} if the project cannot be read
+def fetch_project_details(project_id, session=None, pride_url=PRIDE_URL):
+    pride_response = (session or requests).get(pride_url.format(project_id=project_id), timeout=REQUEST_TIMEOUT)
+
+    if pride_response.status_code == 200:
+        try:
+            return pride_response.json()
+            # Adjust this key based on the actual JSON structure from the PRIDE API.
+            #project_description = project_data.get("projectDescription", "No description available")
+        except ValueError:
+            print("Error: PRIDE API response is not valid JSON.")
+            return {}
+    print(f"Error: Received status code {pride_response.status_code} from PRIDE API")
+    return {}
+
+# Construct the prompt for OpenRouter, incorporating the project details from PRIDE
+def build_prompt(project_details, template=PROMPT_TEMPLATE):
+    # Convert the project details JSON object to a formatted string for inclusion in the prompt
+    project_details_str = json.dumps(project_details, indent=4)
+    return template.format(project_details=project_details_str)
 
+# Send the prompt to OpenRouter and return the parsed JSON response (raises on HTTP errors)
+def request_completion(prompt_content, session=None, model=MODEL, api_key=None, openrouter_url=OPENROUTER_URL):
+    response = (session or requests).post(
+        url=openrouter_url,
+        headers={
+            "Authorization": f"Bearer {api_key or os.environ.get('OPENROUTER_API_KEY', 'api_key')}", # API key is private
+            "HTTP-Referer": "<YOUR_SITE_URL>",  # Optional
+            "X-Title": "<YOUR_SITE_NAME>",      # Optional
+            "Accept": "application/json"
+        },
+        data=json.dumps({
+            "model": model,  # Optional
+            "response_format": { "type": "json_object" },
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt_content
 
-# Parse the JSON response
-try:
-    result = response.json()
-except ValueError:
-    print("Error: Response content is not valid JSON.")
-    result = None
+                }
+            ]
+        }),
+        timeout=REQUEST_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()
 
-if result:
+# Extract the content from the API response (assumes similar structure to OpenAI's API)
+# and parse it into a Python dictionary
+def extract_json(result):
+    content = result["choices"][0]["message"]["content"]
+
+    # Remove markdown code block markers (``` or ```json)
+    content_clean = re.sub(r'^```(?:json)?\n', '', content.strip())
+    content_clean = re.sub(r'\n```$', '', content_clean)
+    return json.loads(content_clean)
+
+
+if __name__ == "__main__":
+    # Define the project identifier
+    project_id = "PXD001468"
+
+    project_details = fetch_project_details(project_id)
+    prompt_content = build_prompt(project_details)
+    print(prompt_content)
+
+    # Parse the JSON response
     try:
-        # Extract the content from the API response (assumes similar structure to OpenAI's API)
-        content = result["choices"][0]["message"]["content"]
-        #print(content)
-        
-        # Remove markdown code block markers (``` or ```json)
-        content_clean = re.sub(r'^```(?:json)?\n', '', content)
-        content_clean = re.sub(r'\n```$', '', content_clean)
-        print("Cleaned content:\n", content_clean)
-        # Parse the cleaned content into a Python dictionary
-        pure_json_output = json.loads(content)
-
-        # Save the pure JSON output to a file
-        output_filename = f"output_{project_id}.json"
-        with open(output_filename, "w") as outfile:
-            json.dump(pure_json_output, outfile, indent=4)
-        
-        print("Pure JSON output saved to {output_filename}")
-    except (KeyError, IndexError, json.JSONDecodeError) as e:
-        print("Error processing the assistant's message:", e)
+        result = request_completion(prompt_content)
+    except (requests.RequestException, ValueError) as e:
+        print("Error: OpenRouter request failed:", e)
+        result = None
+
+    if result:
+        try:
+            pure_json_output = extract_json(result)
+            print("Cleaned content:\n", json.dumps(pure_json_output, indent=4))
+
+            # Save the pure JSON output to a file
+            output_filename = f"output_{project_id}.json"
+            with open(output_filename, "w") as outfile:
+                json.dump(pure_json_output, outfile, indent=4)
+
+            print(f"Pure JSON output saved to {output_filename}")
+        except (KeyError, IndexError, json.JSONDecodeError) as e:
+            print("Error processing the assistant's message:", e)
 
 # Check the structure of the returned JSON (assuming it has a similar structure to OpenAI's API)
 # For example, it might look like:
@@ -110,4 +132,4 @@ if result:
 #       "completion_tokens": 12,
 #       "total_tokens": 21
 #   }
-# }
\ No newline at end of file
+# }
@@ -0,0 +1,89 @@
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from batch_extract import BatchExtractor
+from local_services import make_projects, start_pride_server, start_llm_server
+from openrouterAPI_callPRIDE import PROMPT_TEMPLATE
+
+'''
+end-to-end check of batch_extract.py against local stand-ins for PRIDE and OpenRouter (local_services.py)
+  1. sequential run (one worker per service) for reference
+  2. concurrent cold run: every project fetched and extracted; the stand-ins rate-limit with 429s,
+     which must be retried rather than lost
+  3. warm re-run: everything comes from the cache, no calls at all
+  4. prompt tweak: PRIDE stays cached, every completion is requested again
+reports wall time and calls for each run and exits 1 if any check fails
+'''
+
+
+def run(extractor, accessions):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        outputs = extractor.run(accessions)
+    return time.perf_counter() - start, outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check batch_extract.py against local PRIDE and LLM stand-ins")
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--pride-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--pride-rate-limit", type=int, default=40, help="requests/sec before the PRIDE stand-in answers 429")
+    parser.add_argument("--llm-rate-limit", type=int, default=20, help="requests/sec before the LLM stand-in answers 429")
+    parser.add_argument("--sequential-projects", type=int, default=20, help="projects in the sequential reference run")
+    args = parser.parse_args()
+
+    projects = make_projects(args.projects)
+    accessions = list(projects)
+    pride = start_pride_server(projects, latency=args.pride_latency, rate_limit=args.pride_rate_limit)
+    llm = start_llm_server(latency=args.llm_latency, rate_limit=args.llm_rate_limit)
+    failures = []
+
+    def extractor(work_dir, name, template=PROMPT_TEMPLATE, **kwargs):
+        options = dict(pride_workers=16, pride_rps=50, llm_workers=16, llm_rps=30)
+        options.update(kwargs)
+        return BatchExtractor(cache_dir=os.path.join(work_dir, name, "cache"), output_dir=os.path.join(work_dir, name, "outputs"),
+                              template=template, pride_url=pride.url, openrouter_url=llm.url, **options)
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        sequential = extractor(work_dir, "sequential", pride_workers=1, pride_rps=None, llm_workers=1, llm_rps=None)
+        seconds, outputs = run(sequential, accessions[:args.sequential_projects])
+        per_project = seconds / args.sequential_projects
+        print(f"sequential: {args.sequential_projects} projects in {seconds:.2f}s ({per_project:.3f}s per project)")
+
+        batch = extractor(work_dir, "batch")
+        rejected = pride.rejected_count + llm.rejected_count
+        seconds, outputs = run(batch, accessions)
+        rejected = pride.rejected_count + llm.rejected_count - rejected
+        print(f"cold:   {len(accessions)} projects in {seconds:.2f}s "
+              f"(sequential estimate {per_project * len(accessions):.1f}s), {rejected} requests answered 429, {batch.stats}")
+        check(all(outputs[a] and outputs[a]['accession'] == a for a in accessions), "cold run: missing or wrong extractions")
+        check(batch.stats['pride_calls'] == len(accessions) and batch.stats['llm_calls'] == len(accessions),
+              "cold run: expected one call per project to each service")
+
+        warm = extractor(work_dir, "batch")
+        seconds, outputs = run(warm, accessions)
+        print(f"warm:   {len(accessions)} projects in {seconds:.2f}s, {warm.stats}")
+        check(warm.stats['pride_calls'] == 0 and warm.stats['llm_calls'] == 0, "warm run: expected no calls")
+        check(all(outputs[a] for a in accessions), "warm run: missing extractions")
+
+        tweaked = extractor(work_dir, "batch", template="Return the experiment metadata as JSON.\n\n{project_details}")
+        seconds, outputs = run(tweaked, accessions)
+        print(f"prompt tweak: {len(accessions)} projects in {seconds:.2f}s, {tweaked.stats}")
+        check(tweaked.stats['pride_calls'] == 0 and tweaked.stats['llm_calls'] == len(accessions),
+              "prompt tweak: expected cached PRIDE details and one new completion per project")
+
+    pride.shutdown()
+    llm.shutdown()
+    for message in failures:
+        print(f"FAILED: {message}")
+    if failures:
+        raise SystemExit(1)